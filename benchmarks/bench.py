@@ -0,0 +1,343 @@
+'''
+Benchmarks for recorder and player hot paths.
+Results are written as json and can be compared with a previous run::
+
+    python -m benchmarks.bench --output bench.json
+    python -m benchmarks.bench --compare bench.json
+'''
+
+import io
+import os
+import sys
+import json as pyjson
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+import platform
+import tracemalloc
+import http.client
+from statistics import median
+
+import yaml as pyyaml
+import httpsrv
+import tornado.web
+import tornado.ioloop
+from tornado.gen import coroutine
+from tornado.httputil import HTTPHeaders, HTTPServerRequest
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPResponse
+
+from httpsrvvcr import recorder
+from httpsrvvcr.player import Player, tape_from_yaml
+from httpsrvvcr.tape import read_tape
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.synth import synth_yaml
+
+
+BODY_SIZES = [('small', 64), ('medium', 4 * 1024), ('large', 256 * 1024)]
+TAPE_SIZES = [1000, 10000]
+FULL_TAPE_SIZES = [1000, 10000, 100000]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _latency(samples):
+    return {
+        'median_ms': median(samples) * 1000,
+        'p95_ms': _percentile(samples, 0.95) * 1000,
+    }
+
+
+def _tape_yaml(size):
+    return synth_yaml(size, json_ratio=1, post_ratio=0, header_count=0, seed=0)
+
+
+def bench_writer(iterations):
+    '''
+    Measures ``VcrWriter.write`` + ``YamlWriter.write`` throughput
+    for json responses of different sizes
+    '''
+    results = {}
+    for name, size in BODY_SIZES:
+        request = HTTPServerRequest(
+            'GET', '/api/items/1', headers=HTTPHeaders({'Accept': 'application/json'}))
+        body = pyjson.dumps({'id': 1, 'payload': 'x' * size}).encode('utf8')
+        response = HTTPResponse(
+            HTTPRequest('http://localhost/api/items/1'), 200,
+            headers=HTTPHeaders({'Content-Type': 'application/json'}), buffer=io.BytesIO(body))
+        writer = recorder.VcrWriter(recorder.YamlWriter(io.StringIO(), pyyaml), pyjson)
+        count = max(10, iterations // max(1, size // 1024))
+        started = time.perf_counter()
+        for _ in range(count):
+            writer.write(request, response)
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            'interactions_per_s': count / elapsed,
+            'mb_per_s': count * len(body) / elapsed / 1024 / 1024,
+        }
+    return results
+
+
+class _TargetHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(b'{"id": 1, "name": "John"}')
+
+
+@coroutine
+def _measure(client, url, requests):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        yield client.fetch(url)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_proxy(requests):
+    '''
+    Measures latency added by ``ProxyHandler`` compared to
+    requesting a local tornado target directly
+    '''
+    target_port, proxy_port = _free_port(), _free_port()
+    target = 'http://127.0.0.1:{}'.format(target_port)
+    client = AsyncHTTPClient()
+    tornado.web.Application([(r'.*', _TargetHandler)]).listen(target_port)
+    writer = recorder.VcrWriter(recorder.YamlWriter(io.StringIO(), pyyaml), pyjson)
+    tornado.web.Application([
+        (r'.*', recorder.ProxyHandler, dict(httpclient=client, target=target, writer=writer))
+    ]).listen(proxy_port)
+    loop = tornado.ioloop.IOLoop.current()
+    direct = loop.run_sync(lambda: _measure(client, target + '/', requests))
+    proxied = loop.run_sync(
+        lambda: _measure(client, 'http://127.0.0.1:{}/'.format(proxy_port), requests))
+    return {
+        'direct': _latency(direct),
+        'proxied': _latency(proxied),
+        'added_median_ms': (median(proxied) - median(direct)) * 1000,
+    }
+
+
+def _self_signed(directory):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.check_call([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-keyout', keyfile, '-out', certfile, '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=IP:127.0.0.1,DNS:localhost'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def _proxy(port, target, client, **server_options):
+    writer = recorder.VcrWriter(recorder.YamlWriter(io.StringIO(), pyyaml), pyjson)
+    recorder.listen(tornado.web.Application([
+        (r'.*', recorder.ProxyHandler, dict(httpclient=client, target=target, writer=writer))
+    ]), port, **server_options)
+
+
+def bench_tls(requests):
+    '''
+    Measures proxy latency against a local self-signed HTTPS target with
+    the default client and with the libcurl client reusing upstream TLS
+    sessions (if ``pycurl`` is installed), and latency of a TLS listening proxy
+    '''
+    loop = tornado.ioloop.IOLoop.current()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = _self_signed(directory)
+        ssl_options = recorder.server_ssl_context(certfile, keyfile)
+        target_port = _free_port()
+        target = 'https://127.0.0.1:{}'.format(target_port)
+        recorder.listen(tornado.web.Application([(r'.*', _TargetHandler)]), target_port,
+                        ssl_options=ssl_options)
+        client = recorder.create_client()
+        clients = [('simple', False)]
+        if importlib.util.find_spec('pycurl'):
+            clients.append(('curl', True))
+        for name, curl in clients:
+            proxy_port = _free_port()
+            _proxy(proxy_port, target, recorder.create_client(curl, ca_certs=certfile))
+            url = 'http://127.0.0.1:{}/'.format(proxy_port)
+            results['upstream_' + name] = _latency(
+                loop.run_sync(lambda: _measure(client, url, requests)))
+        proxy_port = _free_port()
+        _proxy(proxy_port, 'http://127.0.0.1:{}'.format(_plain_target()),
+               recorder.create_client(), ssl_options=ssl_options)
+        tls_client = recorder.create_client(ca_certs=certfile)
+        url = 'https://127.0.0.1:{}/'.format(proxy_port)
+        results['listener'] = _latency(loop.run_sync(lambda: _measure(tls_client, url, requests)))
+    return results
+
+
+def _plain_target():
+    port = _free_port()
+    tornado.web.Application([(r'.*', _TargetHandler)]).listen(port)
+    return port
+
+
+def _parse(parser, text):
+    started = time.perf_counter()
+    parser(text)
+    elapsed = time.perf_counter() - started
+    # tracing slows parsing down, so memory is measured in a separate pass
+    tracemalloc.start()
+    tape = parser(text)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tape
+    return {'seconds': elapsed, 'retained_mb': current / 1024 / 1024, 'peak_mb': peak / 1024 / 1024}
+
+
+def bench_tape_parse(sizes):
+    '''
+    Measures parse time and memory of ``tape_from_yaml`` and ``read_tape``
+    '''
+    results = {}
+    for size in sizes:
+        text = _tape_yaml(size)
+        results[str(size)] = {
+            'tape_from_yaml': _parse(tape_from_yaml, text),
+            'read_tape': _parse(read_tape, text),
+        }
+    return results
+
+
+def _replay(port, tape, requests):
+    samples = []
+    for number in range(requests):
+        request = tape[number % len(tape)].request
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        started = time.perf_counter()
+        connection.request(request.method, request.path, headers=dict(request.headers))
+        connection.getresponse().read()
+        samples.append(time.perf_counter() - started)
+        connection.close()
+    return samples
+
+
+def bench_player(size, requests):
+    '''
+    Measures ``Player.play`` setup time and per-request replay latency
+    with literal and canonical matching
+    '''
+    tape = read_tape(_tape_yaml(size))
+    port = _free_port()
+    server = httpsrv.Server(port).start()
+    results = {}
+    try:
+        for name, player in [('literal', Player(server)),
+                             ('canonical', Player(server, canonicalizer=Canonicalizer()))]:
+            server.reset()
+            started = time.perf_counter()
+            player.play(tape)
+            setup = time.perf_counter() - started
+            results[name] = {
+                'setup_seconds': setup,
+                'replay': _latency(_replay(port, tape, requests)),
+            }
+    finally:
+        server.stop()
+    return results
+
+
+def run(full=False, iterations=2000, requests=200):
+    '''
+    Runs all benchmarks
+
+    :type full: bool
+    :param full: if ``True`` tape parsing is measured for 100k interactions too
+
+    :type iterations: int
+    :param iterations: number of interactions written by the writer benchmark
+
+    :type requests: int
+    :param requests: number of requests sent by proxy and player benchmarks
+
+    :rtype: dict
+    '''
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {
+            'writer': bench_writer(iterations),
+            'proxy': bench_proxy(requests),
+            'tls': bench_tls(requests),
+            'tape_parse': bench_tape_parse(FULL_TAPE_SIZES if full else TAPE_SIZES),
+            'player': bench_player(1000, requests),
+        },
+    }
+
+
+def _flatten(results, prefix=''):
+    for name, value in sorted(results.items()):
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + name + '.')
+        else:
+            yield prefix + name, value
+
+
+def compare(baseline, current, threshold=0.2):
+    '''
+    Yields ``(metric, baseline, current, change)`` for metrics present in both runs,
+    ``change`` is relative to baseline
+
+    :type baseline: dict
+    :param baseline: results of a previous run
+
+    :type current: dict
+    :param current: results of this run
+    '''
+    previous = dict(_flatten(baseline['results']))
+    for metric, value in _flatten(current['results']):
+        if previous.get(metric):
+            yield metric, previous[metric], value, (value - previous[metric]) / previous[metric]
+
+
+def _higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for httpsrvvcr', prog='python -m benchmarks.bench')
+    parser.add_argument('--output', help='file to write json results to', type=str, default=None)
+    parser.add_argument('--compare', help='json results of a previous run to compare with',
+                        type=str, default=None)
+    parser.add_argument('--threshold', help='relative change reported as regression',
+                        type=float, default=0.2)
+    parser.add_argument('--full', help='parse 100k-interaction tapes as well',
+                        action='store_const', const=True, default=False)
+    args = parser.parse_args()
+    current = run(args.full)
+    dumped = pyjson.dumps(current, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as output:
+            output.write(dumped)
+    else:
+        print(dumped)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as baseline_file:
+            baseline = pyjson.load(baseline_file)
+        regressions = 0
+        for metric, before, after, change in compare(baseline, current):
+            worse = -change if _higher_is_better(metric) else change
+            mark = 'REGRESSION' if worse > args.threshold else ''
+            regressions += bool(mark)
+            sys.stderr.write('{:60} {:>12.4f} {:>12.4f} {:>+8.1%} {}\n'.format(
+                metric, before, after, change, mark))
+        sys.exit(1 if regressions else 0)
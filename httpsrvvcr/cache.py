@@ -0,0 +1,247 @@
+'''
+Target response cache for ``httpsrvvcr.recorder``.
+Keeps recently fetched responses in a memory-bounded LRU tier
+and optionally in a directory on disk, so repeated recording sessions
+don't fetch identical resources from the target again
+'''
+
+import os
+import re
+import time
+import json as pyjson
+import hashlib
+from collections import OrderedDict, namedtuple
+
+from tornado.httputil import HTTPHeaders
+
+
+# Only requests without side effects are cached
+CACHED_METHODS = ['GET', 'HEAD']
+# Request headers that may change target response
+CACHE_KEY_HEADERS = ['Host', 'Accept', 'Accept-Encoding', 'Accept-Language', 'Authorization', 'Cookie']
+# Codes cacheable by default according to RFC 7231
+CACHED_CODES = [200, 203, 204, 300, 301, 404, 405, 410, 414, 501]
+
+_MAX_AGE = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)', re.I)
+_NOT_STORED = re.compile(r'(?:^|,)\s*(no-store|no-cache|private)\b', re.I)
+# rough per-entry memory overhead besides body
+_ENTRY_OVERHEAD = 512
+
+
+class CachedResponse(namedtuple('CachedResponse', 'code headers body')):
+    '''
+    Response stored in cache, supports the subset of
+    :class:`tornado.httpclient.HTTPResponse` interface used by recorder
+
+    :type code: int
+    :param code: response status code
+
+    :type headers: tornado.httputil.HTTPHeaders
+    :param headers: response headers
+
+    :type body: bytes
+    :param body: response body
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_response(cls, response):
+        '''
+        Copies a response received from the target
+
+        :type response: tornado.httpclient.HTTPResponse
+        :param response: response to copy
+        '''
+        return cls(response.code, HTTPHeaders(response.headers), response.body or b'')
+
+    @property
+    def size(self):
+        '''
+        Approximate memory taken by response in bytes
+        '''
+        return len(self.body) + _ENTRY_OVERHEAD
+
+
+class ResponseCache:
+    '''
+    TTL and LRU response cache with optional disk tier
+
+    :type max_bytes: int
+    :param max_bytes: approximate memory limit for cached responses
+
+    :type ttl: float
+    :param ttl: time in seconds responses are kept
+
+    :type respect_cache_control: bool
+    :param respect_cache_control: if ``True`` responses with ``no-store``, ``no-cache``
+        or ``private`` in ``Cache-Control`` are not cached and ``max-age``
+        overrides ``ttl``
+
+    :type directory: str
+    :param directory: directory for the disk tier, disabled if omitted
+
+    :type clock: callable
+    :param clock: function returning current time in seconds
+    '''
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300, respect_cache_control=False,
+                 directory=None, clock=time.time):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._respect_cache_control = respect_cache_control
+        self._directory = directory
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, request, target=None):
+        '''
+        Calculates cache key of a request or ``None``
+        if request cannot be cached
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type target: str
+        :param target: URL the request is proxied to, clients send ``Host``
+            of the proxy, so responses of different targets are told apart by it
+        '''
+        if request.method not in CACHED_METHODS:
+            return None
+        headers = tuple(request.headers.get(name) for name in CACHE_KEY_HEADERS)
+        return request.method, request.uri, headers, target
+
+    def get(self, request, target=None):
+        '''
+        Returns cached response for a request or ``None``
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type target: str
+        :param target: URL the request is proxied to
+
+        :rtype: CachedResponse
+        '''
+        key = self.key(request, target)
+        if key is None:
+            return None
+        now = self._clock()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            self._discard(key)
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        entry = self._read(key, now)
+        if entry is not None:
+            self._remember(key, *entry)
+            self.disk_hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, request, response, target=None):
+        '''
+        Caches target response for a request if it is cacheable
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type response: tornado.httpclient.HTTPResponse
+        :param response: target response
+
+        :type target: str
+        :param target: URL the request is proxied to
+        '''
+        key = self.key(request, target)
+        ttl = self._response_ttl(response)
+        if key is None or not ttl:
+            return
+        expires = self._clock() + ttl
+        cached = CachedResponse.from_response(response)
+        self._remember(key, expires, cached)
+        self._write(key, expires, cached)
+
+    def stats(self):
+        '''
+        Returns cache counters
+
+        :rtype: dict
+        '''
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def _response_ttl(self, response):
+        if response.code not in CACHED_CODES:
+            return 0
+        if not self._respect_cache_control:
+            return self._ttl
+        cache_control = response.headers.get('Cache-Control', '')
+        if _NOT_STORED.search(cache_control):
+            return 0
+        max_age = _MAX_AGE.search(cache_control)
+        return int(max_age.group(1)) if max_age else self._ttl
+
+    def _remember(self, key, expires, cached):
+        if key in self._entries:
+            self._discard(key)
+        if cached.size > self._max_bytes:
+            return
+        self._entries[key] = (expires, cached)
+        self._bytes += cached.size
+        while self._bytes > self._max_bytes:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        _, cached = self._entries.pop(key)
+        self._bytes -= cached.size
+
+    def _file_name(self, key):
+        digest = hashlib.sha1(pyjson.dumps(key).encode('utf8')).hexdigest()
+        return os.path.join(self._directory, digest + '.cache')
+
+    def _write(self, key, expires, cached):
+        if not self._directory:
+            return
+        file_name = self._file_name(key)
+        meta = {
+            'key': key,
+            'expires': expires,
+            'code': cached.code,
+            'headers': list(cached.headers.get_all()),
+        }
+        temp = file_name + '.tmp'
+        with open(temp, 'wb') as cache_file:
+            cache_file.write(pyjson.dumps(meta).encode('utf8') + b'\n')
+            cache_file.write(cached.body)
+        os.replace(temp, file_name)
+
+    def _read(self, key, now):
+        if not self._directory:
+            return None
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'rb') as cache_file:
+                meta = pyjson.loads(cache_file.readline().decode('utf8'))
+                body = cache_file.read()
+        except (OSError, ValueError):
+            return None
+        if meta['expires'] <= now or tuple(meta['key'][:2]) != key[:2]:
+            os.remove(file_name)
+            return None
+        headers = HTTPHeaders()
+        for name, value in meta['headers']:
+            headers.add(name, value)
+        return meta['expires'], CachedResponse(meta['code'], headers, body)
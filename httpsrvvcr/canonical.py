@@ -0,0 +1,106 @@
+'''
+Request canonicalization used to match requests against recorded ones.
+Recorded requests are reduced to a digest once when a tape is loaded,
+incoming requests are reduced the same way and matching is a single
+digest comparison
+'''
+
+import json as pyjson
+import hashlib
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class Canonicalizer:
+    '''
+    Calculates canonical digests of requests
+
+    :type sort_query: bool
+    :param sort_query: if ``True`` order of query parameters is ignored
+
+    :type ignore_params: list
+    :param ignore_params: query parameters that are ignored completely,
+        e.g. cache busters or timestamps
+
+    :type canonical_json: bool
+    :param canonical_json: if ``True`` json bodies are compared regardless of
+        formatting and key order
+
+    :type cache_size: int
+    :param cache_size: number of incoming request digests to memoize
+    '''
+    def __init__(self, sort_query=False, ignore_params=None, canonical_json=True, cache_size=256):
+        self._sort_query = sort_query
+        self._ignore_params = frozenset(ignore_params or [])
+        self._canonical_json = canonical_json
+        self.incoming_key = lru_cache(maxsize=cache_size)(self._incoming_key)
+
+    def path(self, path):
+        '''
+        Returns canonical form of a request path
+
+        :type path: str
+        :param path: path including query string
+        '''
+        if not (self._sort_query or self._ignore_params) or '?' not in path:
+            return path
+        parts = urlsplit(path)
+        params = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                  if name not in self._ignore_params]
+        if self._sort_query:
+            params.sort()
+        return urlunsplit(parts._replace(query=urlencode(params)))
+
+    def body(self, text=None, json=None):
+        '''
+        Returns canonical form of a request body
+
+        :type text: str
+        :param text: body text
+
+        :type json: any
+        :param json: parsed json body, has priority over ``text``
+        '''
+        if not self._canonical_json:
+            return pyjson.dumps(json) if json is not None else text or ''
+        if json is None:
+            if not text:
+                return ''
+            try:
+                json = pyjson.loads(text)
+            except ValueError:
+                return text
+        return pyjson.dumps(json, sort_keys=True, separators=(',', ':'))
+
+    def key(self, method, path, body):
+        '''
+        Calculates digest of canonical request parts
+
+        :type method: str
+        :param method: request method
+
+        :type path: str
+        :param path: canonical path
+
+        :type body: str
+        :param body: canonical body
+
+        :rtype: bytes
+        '''
+        return hashlib.sha1('\0'.join((method, path, body)).encode('utf8')).digest()
+
+    def recorded_key(self, request):
+        '''
+        Calculates digest of a recorded request
+
+        :type request: httpsrvvcr.tape.RecordedRequest
+        :param request: recorded request
+
+        :rtype: bytes
+        '''
+        return self.key(request.method, self.path(request.path),
+                        self.body(request.text, request.json))
+
+    def _incoming_key(self, method, path, body):
+        text = body.decode('utf8', 'replace') if body else None
+        return self.key(method, self.path(path), self.body(text))
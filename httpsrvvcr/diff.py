@@ -0,0 +1,359 @@
+'''
+Tape diff. Interactions are keyed by canonical request digest
+(see :class:`httpsrvvcr.canonical.Canonicalizer`) and a digest of their canonical
+form with volatile headers dropped and json bodies compared regardless of key order.
+Tapes are compared as multisets: equal interactions cancel out wherever they are,
+the rest of interactions of the same request are paired in order and reported as changed.
+
+Tapes are memory-mapped and parsed item by item, only keys, digests and
+offsets are kept in memory, so huge tapes are compared in linear time.
+Items equal byte for byte are not parsed at all::
+
+    python -m httpsrvvcr.diff old.yaml new.yaml --drop-headers Date X-Trace-*
+'''
+
+import os
+import sys
+import mmap
+import hashlib
+import argparse
+import json as pyjson
+from collections import Counter, deque
+
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.index import parse_item, split_items
+from httpsrvvcr.tape import PROFILE_KEY, HeaderFilter, is_profile
+
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+# headers that differ between recordings of the same response
+VOLATILE_HEADERS = ['Date', 'Expires', 'Age', 'Last-Modified', 'Etag', 'Set-Cookie',
+                    'X-Request-Id']
+
+_MARKS = {ADDED: '+', REMOVED: '-', CHANGED: '~'}
+# keys are dumped sorted, so every interaction written by the recorder starts with it
+_INTERACTION_START = b'- request:'
+
+
+class TapeReader:
+    '''
+    Memory-mapped yaml tape read item by item. Header profiles are
+    resolved, so items are returned with plain header dictionaries
+
+    :type tape_path: str
+    :param tape_path: path to yaml tape
+    '''
+    def __init__(self, tape_path):
+        self.tape_path = tape_path
+        with open(tape_path, 'rb') as tape_file:
+            if os.fstat(tape_file.fileno()).st_size:
+                self._data = mmap.mmap(tape_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = b''
+        self._profiles = {}
+        self._plain = None
+
+    def chunks(self):
+        '''
+        Yields ``(offset, length, text)`` for every item of the tape without parsing it
+
+        :rtype: generator
+        '''
+        for offset, length in split_items(self._data):
+            yield offset, length, self._data[offset:offset + length]
+
+    def is_plain(self):
+        '''
+        Checks without parsing that the tape has no header profiles,
+        items of such tapes can be compared and copied as text
+
+        :rtype: bool
+        '''
+        if self._plain is None:
+            self._plain = all(chunk.startswith(_INTERACTION_START) for _, _, chunk in self.chunks())
+        return self._plain
+
+    def items(self, skip=None):
+        '''
+        Yields ``(offset, length, item)`` for every interaction of the tape
+
+        :type skip: callable
+        :param skip: function deciding by item text if it should be skipped without parsing
+
+        :rtype: generator
+        '''
+        for offset, length, chunk in self.chunks():
+            if skip is not None and skip(chunk):
+                continue
+            item = parse_item(chunk)
+            if is_profile(item):
+                self._profiles[item[PROFILE_KEY]] = item['headers']
+                continue
+            yield offset, length, self._resolve(item)
+
+    def read(self, offset, length):
+        '''
+        Reads an interaction at a given position, profiles it refers to
+        must have been read by :func:`TapeReader.items` already
+
+        :type offset: int
+        :param offset: item offset
+
+        :type length: int
+        :param length: item length
+
+        :rtype: dict
+        '''
+        return self._resolve(parse_item(self._data[offset:offset + length]))
+
+    def text(self, offset, length):
+        '''
+        Returns text of an item at a given position
+
+        :type offset: int
+        :param offset: item offset
+
+        :type length: int
+        :param length: item length
+
+        :rtype: str
+        '''
+        return self._data[offset:offset + length].decode('utf8')
+
+    def _resolve(self, item):
+        for message in (item['request'], item['response']):
+            if isinstance(message.get('headers'), str):
+                message['headers'] = self._profiles[message['headers']]
+        return item
+
+    def close(self):
+        '''
+        Unmaps the tape
+        '''
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+class TapeComparer:
+    '''
+    Calculates keys and digests interactions are compared by
+
+    :type canonicalizer: httpsrvvcr.canonical.Canonicalizer
+    :param canonicalizer: canonicalizer of request paths and bodies
+
+    :type header_filter: httpsrvvcr.tape.HeaderFilter
+    :param header_filter: filter deciding which headers are compared,
+        :data:`VOLATILE_HEADERS` are ignored by default
+
+    :type no_headers: bool
+    :param no_headers: if ``True`` headers are not compared at all
+    '''
+    def __init__(self, canonicalizer=None, header_filter=None, no_headers=False):
+        self._canonicalizer = canonicalizer or Canonicalizer()
+        self._header_filter = header_filter or HeaderFilter(drop=VOLATILE_HEADERS)
+        self._no_headers = no_headers
+
+    def request_key(self, item):
+        '''
+        Calculates canonical request digest of a tape interaction
+
+        :type item: dict
+        :param item: tape interaction
+
+        :rtype: bytes
+        '''
+        request = item['request']
+        return self._canonicalizer.key(
+            request['method'], self._canonicalizer.path(request['path']),
+            self._canonicalizer.body(request.get('text'), request.get('json')))
+
+    def digest(self, item):
+        '''
+        Calculates digest of everything compared besides the request key
+
+        :type item: dict
+        :param item: tape interaction
+
+        :rtype: bytes
+        '''
+        request, response = item['request'], item['response']
+        canonical = [self._headers(request.get('headers')), response['code'],
+                     self._headers(response.get('headers')),
+                     self._canonicalizer.body(response.get('text'), response.get('json'))]
+        return hashlib.sha1(pyjson.dumps(canonical, sort_keys=True).encode('utf8')).digest()
+
+    def _headers(self, headers):
+        if self._no_headers or not headers:
+            return None
+        return self._header_filter.filter(headers)
+
+    def keyed(self, reader, skip=None):
+        '''
+        Yields ``(key, offset, length, item)`` for every interaction of a tape,
+        key is a request key with its occurrence number
+
+        :type reader: TapeReader
+        :param reader: tape to read
+
+        :type skip: callable
+        :param skip: see :func:`TapeReader.items`
+
+        :rtype: generator
+        '''
+        occurrences = {}
+        for offset, length, item in reader.items(skip):
+            request_key = self.request_key(item)
+            occurrence = occurrences.get(request_key, 0)
+            occurrences[request_key] = occurrence + 1
+            yield (request_key, occurrence), offset, length, item
+
+    def _digested(self, reader, skip=None):
+        return [((self.request_key(item), self.digest(item)), offset, length)
+                for offset, length, item in reader.items(skip)]
+
+    def diff(self, old, new):
+        '''
+        Compares two tapes. Added and changed interactions are yielded in order
+        of the new tape, removed ones follow in order of the old tape.
+        Items equal byte for byte are equal anyway, so they are skipped without
+        parsing, this doesn't change the result
+
+        :type old: TapeReader
+        :param old: original tape
+
+        :type new: TapeReader
+        :param new: changed tape
+
+        :returns: ``(status, old_item, new_item)`` tuples, status is one of
+            :data:`ADDED`, :data:`REMOVED` and :data:`CHANGED`
+        :rtype: generator
+        '''
+        skip_old, skip_new = _identical(old, new)
+        old_items, new_items = self._digested(old, skip_old), self._digested(new, skip_new)
+        common = (Counter(key for key, _, _ in old_items)
+                  & Counter(key for key, _, _ in new_items))
+        old_items = list(_unmatched(old_items, common))
+        # positions of unmatched old interactions by request key
+        pending = {}
+        for position, ((request_key, _), _, _) in enumerate(old_items):
+            pending.setdefault(request_key, deque()).append(position)
+        paired = set()
+        for (request_key, _), offset, length in _unmatched(new_items, common):
+            positions = pending.get(request_key)
+            if not positions:
+                yield ADDED, None, new.read(offset, length)
+                continue
+            position = positions.popleft()
+            paired.add(position)
+            _, old_offset, old_length = old_items[position]
+            yield CHANGED, old.read(old_offset, old_length), new.read(offset, length)
+        for position, (_, offset, length) in enumerate(old_items):
+            if position not in paired:
+                yield REMOVED, old.read(offset, length), None
+
+
+def _unmatched(items, common):
+    left = Counter(common)
+    for item in items:
+        if left[item[0]]:
+            left[item[0]] -= 1
+            continue
+        yield item
+
+
+def _identical(old, new):
+    # items present in both tapes byte for byte are equal and never parsed,
+    # unless tapes have header profiles that may differ under the same ids
+    if not (old.is_plain() and new.is_plain()):
+        return None, None
+    counts = [Counter(hashlib.sha1(chunk).digest() for _, _, chunk in reader.chunks())
+              for reader in (old, new)]
+    common = counts[0] & counts[1]
+    return _skipper(common), _skipper(common)
+
+
+def _skipper(common):
+    left = Counter(common)
+
+    def skip(chunk):
+        digest = hashlib.sha1(chunk).digest()
+        if left[digest]:
+            left[digest] -= 1
+            return True
+        return False
+    return skip
+
+
+def format_change(status, old_item, new_item):
+    '''
+    Formats a change yielded by :func:`TapeComparer.diff` as a single line,
+    e.g. ``~ GET /api/users 200 -> 500``
+
+    :type status: str
+    :param status: change status
+
+    :type old_item: dict
+    :param old_item: interaction of the original tape
+
+    :type new_item: dict
+    :param new_item: interaction of the changed tape
+
+    :rtype: str
+    '''
+    item = new_item or old_item
+    line = '{} {} {}'.format(_MARKS[status], item['request']['method'], item['request']['path'])
+    if status == CHANGED and old_item['response']['code'] != new_item['response']['code']:
+        line += ' {} -> {}'.format(old_item['response']['code'], new_item['response']['code'])
+    return line
+
+
+def add_compare_arguments(parser):
+    '''
+    Adds command line options of :class:`TapeComparer` to a parser
+
+    :type parser: argparse.ArgumentParser
+    :param parser: parser
+    '''
+    parser.add_argument('--no-headers', help='do not compare headers',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--drop-headers', help='do not compare headers matching these patterns, '
+                        'default: ' + ' '.join(VOLATILE_HEADERS),
+                        type=str, nargs='*', default=VOLATILE_HEADERS)
+    parser.add_argument('--sort-query', help='ignore order of query parameters',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--ignore-params', help='query parameters to ignore',
+                        type=str, nargs='*', default=[])
+
+
+def comparer_from_args(args):
+    '''
+    Creates :class:`TapeComparer` from options added by :func:`add_compare_arguments`
+
+    :type args: argparse.Namespace
+    :param args: parsed arguments
+
+    :rtype: TapeComparer
+    '''
+    return TapeComparer(Canonicalizer(args.sort_query, args.ignore_params),
+                        HeaderFilter(drop=args.drop_headers), args.no_headers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare vcr tapes', prog='python -m httpsrvvcr.diff')
+    parser.add_argument('old', help='original tape', type=str)
+    parser.add_argument('new', help='changed tape', type=str)
+    add_compare_arguments(parser)
+    args = parser.parse_args()
+    old_tape, new_tape = TapeReader(args.old), TapeReader(args.new)
+    counts = {ADDED: 0, REMOVED: 0, CHANGED: 0}
+    for change in comparer_from_args(args).diff(old_tape, new_tape):
+        counts[change[0]] += 1
+        sys.stdout.write(format_change(*change) + '\n')
+    old_tape.close()
+    new_tape.close()
+    sys.stderr.write('{added} added, {removed} removed, {changed} changed\n'.format(**counts))
+    sys.exit(1 if any(counts.values()) else 0)
@@ -0,0 +1,395 @@
+'''
+On-disk index for vcr tapes recorded with ``httpsrvvcr.recorder``.
+
+Index is stored next to the tape (``tape.yaml.idx``) and keeps byte offsets
+of every recorded interaction keyed by a hash of request method and path.
+Both tape and index are memory-mapped so opening an indexed tape costs
+the same no matter how many interactions it holds, and only interactions
+that are actually requested get parsed.
+
+Tapes can also be compiled into a single file (``tape.yaml.hvc``) holding
+the index followed by interactions encoded as json, which is much faster to
+decode than yaml. The compiled file is built by one process while others wait
+for it and is memory-mapped read-only, so parallel test workers share
+a single copy of the tape in the page cache
+'''
+
+import os
+import mmap
+import struct
+import hashlib
+import json as pyjson
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from httpsrvvcr.tape import HeaderProfiles, Interaction, is_profile, load_yaml
+
+
+INDEX_SUFFIX = '.idx'
+COMPILED_SUFFIX = '.hvc'
+
+_MAGIC = b'HVCRIDX1'
+_COMPILED_MAGIC = b'HVCRCMP1'
+# magic, tape size, tape mtime (ns), entries count, methods block length
+_HEADER = struct.Struct('<8sQQII')
+# key hash, interaction offset, interaction length
+_ENTRY = struct.Struct('<QQI')
+# header profiles are stored under a reserved key
+_PROFILE_KEY = 0
+
+
+def request_hash(method, path):
+    '''
+    Calculates 64-bit key used to store interactions in the index
+
+    :type method: str
+    :param method: request method, e.g. ``'GET'``
+
+    :type path: str
+    :param path: request path including query string
+
+    :rtype: int
+    '''
+    digest = hashlib.sha1((method + ' ' + path).encode('utf8')).digest()
+    return struct.unpack('<Q', digest[:8])[0]
+
+
+def index_path(tape_path):
+    '''
+    Returns index file name for a given tape file name
+
+    :type tape_path: str
+    :param tape_path: path to yaml tape
+    '''
+    return tape_path + INDEX_SUFFIX
+
+
+def compiled_path(tape_path):
+    '''
+    Returns compiled tape file name for a given tape file name
+
+    :type tape_path: str
+    :param tape_path: path to yaml tape
+    '''
+    return tape_path + COMPILED_SUFFIX
+
+
+def split_items(data):
+    '''
+    Yields ``(offset, length)`` of every top-level list item of a tape
+    produced by :class:`httpsrvvcr.recorder.YamlWriter`.
+    Each item starts with ``'- '`` at the very beginning of a line,
+    nested lists and multiline scalars are always indented
+
+    :type data: bytes
+    :param data: tape contents, bytes or ``mmap.mmap``
+    '''
+    start = None
+    position = 0
+    size = len(data)
+    while position < size:
+        end = data.find(b'\n', position)
+        end = size if end == -1 else end + 1
+        if data[position:position + 2] == b'- ':
+            if start is not None:
+                yield start, position - start
+            start = position
+        position = end
+    if start is not None:
+        yield start, size - start
+
+
+def parse_item(data):
+    '''
+    Parses a single tape item slice into a python dictionary
+
+    :type data: bytes
+    :param data: yaml text of a single list item
+    '''
+    return load_yaml(data)[0]
+
+
+def parse_compiled_item(data):
+    '''
+    Parses a single compiled tape item into a python dictionary
+
+    :type data: bytes
+    :param data: json text of a single item
+    '''
+    return pyjson.loads(data.decode('utf8'))
+
+
+def _scan(data):
+    items = []
+    methods = []
+    for offset, length in split_items(data):
+        item = parse_item(data[offset:offset + length])
+        if is_profile(item):
+            items.append((_PROFILE_KEY, offset, length, item))
+            continue
+        request = item['request']
+        if request['method'] not in methods:
+            methods.append(request['method'])
+        items.append((request_hash(request['method'], request['path']), offset, length, item))
+    return items, methods
+
+
+def _read_tape(tape_path):
+    with open(tape_path, 'rb') as tape_file:
+        return tape_file.read(), os.fstat(tape_file.fileno())
+
+
+def _write(target, magic, stat, entries, methods, blobs=()):
+    methods_block = '\n'.join(methods).encode('utf8')
+    # concurrent builders never share a temporary file
+    temp = '{}.{}.tmp'.format(target, os.getpid())
+    with open(temp, 'wb') as index_file:
+        index_file.write(_HEADER.pack(
+            magic, stat.st_size, _mtime(stat), len(entries), len(methods_block)))
+        index_file.write(methods_block)
+        for entry in entries:
+            index_file.write(_ENTRY.pack(*entry))
+        for blob in blobs:
+            index_file.write(blob)
+    os.replace(temp, target)
+    return target
+
+
+def build_index(tape_path):
+    '''
+    Scans the tape and writes an index file next to it
+
+    :type tape_path: str
+    :param tape_path: path to yaml tape
+
+    :returns: index file name
+    :rtype: str
+    '''
+    data, stat = _read_tape(tape_path)
+    items, methods = _scan(data)
+    entries = sorted(item[:3] for item in items)
+    return _write(index_path(tape_path), _MAGIC, stat, entries, methods)
+
+
+def build_compiled(tape_path):
+    '''
+    Compiles the tape into a single file next to it holding the index
+    and interactions encoded as json
+
+    :type tape_path: str
+    :param tape_path: path to yaml tape
+
+    :returns: compiled tape file name
+    :rtype: str
+    '''
+    data, stat = _read_tape(tape_path)
+    items, methods = _scan(data)
+    # stable sort keeps recording order of interactions with equal keys
+    items.sort(key=lambda item: item[0])
+    blobs = [pyjson.dumps(item, separators=(',', ':')).encode('utf8')
+             for _, _, _, item in items]
+    methods_length = len('\n'.join(methods).encode('utf8'))
+    offset = _HEADER.size + methods_length + len(items) * _ENTRY.size
+    entries = []
+    for (key, _, _, _), blob in zip(items, blobs):
+        entries.append((key, offset, len(blob)))
+        offset += len(blob)
+    return _write(compiled_path(tape_path), _COMPILED_MAGIC, stat, entries, methods, blobs)
+
+
+def _mtime(stat):
+    return getattr(stat, 'st_mtime_ns', int(stat.st_mtime * 1e9))
+
+
+@contextmanager
+def _locked(target):
+    # exclusive lock on a file next to target, a no-op where fcntl is missing
+    if fcntl is None:
+        yield
+        return
+    with open(target + '.lock', 'wb') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _is_fresh(tape_path, target, magic):
+    try:
+        with open(target, 'rb') as index_file:
+            header = index_file.read(_HEADER.size)
+    except FileNotFoundError:
+        return False
+    if len(header) < _HEADER.size:
+        return False
+    found_magic, size, mtime, _, _ = _HEADER.unpack(header)
+    stat = os.stat(tape_path)
+    return found_magic == magic and size == stat.st_size and mtime == _mtime(stat)
+
+
+def _map(file_name):
+    with open(file_name, 'rb') as mapped_file:
+        if not os.fstat(mapped_file.fileno()).st_size:
+            return b''
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class TapeIndex:
+    '''
+    Memory-mapped tape with its index. Use :func:`TapeIndex.open`
+    to obtain an instance, index will be (re)built if it is missing or stale
+
+    :type tape_path: str
+    :param tape_path: path to yaml tape
+
+    :type tape: mmap.mmap
+    :param tape: memory-mapped tape contents
+
+    :type index: mmap.mmap
+    :param index: memory-mapped index contents
+
+    :type parse: callable
+    :param parse: function parsing a single tape item
+    '''
+    def __init__(self, tape_path, tape, index, parse=parse_item):
+        self.tape_path = tape_path
+        self._tape = tape
+        self._index = index
+        self._parse = parse
+        _, _, _, self._count, methods_length = _HEADER.unpack_from(index, 0)
+        methods_start = _HEADER.size
+        self._entries_start = methods_start + methods_length
+        methods = bytes(index[methods_start:self._entries_start]).decode('utf8')
+        self.methods = methods.split('\n') if methods else []
+        self._parsed = {}
+        self._profiles = None
+        self._length = self._count - len(self._entries(_PROFILE_KEY))
+
+    @classmethod
+    def open(cls, tape_path, compiled=False):
+        '''
+        Opens indexed tape building the index when needed. Only one process
+        builds the index at a time, others wait and reuse it
+
+        :type tape_path: str
+        :param tape_path: path to yaml tape
+
+        :type compiled: bool
+        :param compiled: if ``True`` compiled tape is opened instead,
+            see :func:`build_compiled`
+
+        :rtype: TapeIndex
+        '''
+        if compiled:
+            target, magic, build = compiled_path(tape_path), _COMPILED_MAGIC, build_compiled
+        else:
+            target, magic, build = index_path(tape_path), _MAGIC, build_index
+        if not _is_fresh(tape_path, target, magic):
+            with _locked(target):
+                # another process may have built it while we were waiting
+                if not _is_fresh(tape_path, target, magic):
+                    build(tape_path)
+        if compiled:
+            mapped = _map(target)
+            return cls(tape_path, mapped, mapped, parse_compiled_item)
+        return cls(tape_path, _map(tape_path), _map(target))
+
+    def __len__(self):
+        return self._length
+
+    def _key_at(self, position):
+        return _ENTRY.unpack_from(self._index, self._entries_start + position * _ENTRY.size)
+
+    def _first_position(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _entries(self, key):
+        position = self._first_position(key)
+        found = []
+        while position < self._count:
+            entry_key, offset, length = self._key_at(position)
+            if entry_key != key:
+                break
+            found.append((offset, length))
+            position += 1
+        return found
+
+    def _header_profiles(self):
+        if self._profiles is None:
+            self._profiles = HeaderProfiles()
+            for offset, length in self._entries(_PROFILE_KEY):
+                self._profiles.add(self._parse(self._tape[offset:offset + length]))
+        return self._profiles
+
+    def offsets(self, method, path):
+        '''
+        Returns ``(offset, length)`` pairs of interactions
+        recorded for given method and path in recording order
+
+        :type method: str
+        :param method: request method
+
+        :type path: str
+        :param path: request path including query string
+
+        :rtype: list
+        '''
+        return self._entries(request_hash(method, path))
+
+    def interaction(self, offset, length):
+        '''
+        Parses the interaction stored at the given offset,
+        parsed interactions are cached
+
+        :type offset: int
+        :param offset: interaction offset in tape
+
+        :type length: int
+        :param length: interaction length in bytes
+
+        :rtype: httpsrvvcr.tape.Interaction
+        '''
+        if offset not in self._parsed:
+            item = self._parse(self._tape[offset:offset + length])
+            self._parsed[offset] = Interaction.from_dict(item, self._header_profiles())
+        return self._parsed[offset]
+
+    def lookup(self, method, path):
+        '''
+        Returns all interactions recorded for given method and path
+
+        :type method: str
+        :param method: request method
+
+        :type path: str
+        :param path: request path including query string
+
+        :rtype: list
+        '''
+        found = []
+        for offset, length in self.offsets(method, path):
+            action = self.interaction(offset, length)
+            # guard against hash collisions
+            if action.request.method == method and action.request.path == path:
+                found.append(action)
+        return found
+
+    def close(self):
+        '''
+        Releases mapped memory
+        '''
+        for mapped in (self._tape, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
@@ -0,0 +1,112 @@
+'''
+Tape merge. Interactions of several tapes are keyed the same way as in
+:mod:`httpsrvvcr.diff`, every key is written once at the position it first
+appeared at, its interaction is taken from the first or the last tape having it.
+Tapes are streamed item by item, items equal byte for byte are parsed once
+and items of tapes without header profiles are copied as text::
+
+    python -m httpsrvvcr.merge base.yaml new.yaml --prefer last > merged.yaml
+'''
+
+import sys
+import hashlib
+import argparse
+
+from httpsrvvcr.diff import TapeReader, add_compare_arguments, comparer_from_args
+from httpsrvvcr.index import parse_item
+from httpsrvvcr.tape import Interaction, write_tape
+
+
+PREFER_FIRST = 'first'
+PREFER_LAST = 'last'
+
+
+def _keyed(comparer, reader, parsed):
+    if not reader.is_plain():
+        for key, offset, length, _ in comparer.keyed(reader):
+            yield key, offset, length
+        return
+    occurrences = {}
+    for offset, length, chunk in reader.chunks():
+        digest = hashlib.sha1(chunk).digest()
+        request_key = parsed.get(digest)
+        if request_key is None:
+            request_key = parsed[digest] = comparer.request_key(parse_item(chunk))
+        occurrence = occurrences.get(request_key, 0)
+        occurrences[request_key] = occurrence + 1
+        yield (request_key, occurrence), offset, length
+
+
+def merge(comparer, readers, prefer=PREFER_LAST):
+    '''
+    Yields positions of merged interactions
+
+    :type comparer: httpsrvvcr.diff.TapeComparer
+    :param comparer: comparer keying interactions
+
+    :type readers: list
+    :param readers: :class:`httpsrvvcr.diff.TapeReader` objects of tapes to merge
+
+    :type prefer: str
+    :param prefer: :data:`PREFER_FIRST` or :data:`PREFER_LAST`, tape
+        an interaction is taken from when several tapes have it
+
+    :returns: ``(reader, offset, length)`` tuples, see :func:`httpsrvvcr.diff.TapeReader.read`
+    :rtype: generator
+    '''
+    # request keys of plain items by item digest, so repeated items are parsed once
+    parsed = {}
+    tapes = [(reader, list(_keyed(comparer, reader, parsed))) for reader in readers]
+    winners = {}
+    for reader, keys in tapes if prefer == PREFER_FIRST else reversed(tapes):
+        for key, offset, length in keys:
+            winners.setdefault(key, (reader, offset, length))
+    for _, keys in tapes:
+        for key, _, _ in keys:
+            winner = winners.pop(key, None)
+            if winner is not None:
+                yield winner
+
+
+def write_merged(stream, positions, batch_size=1000):
+    '''
+    Writes merged interactions as a yaml tape. Items of tapes without
+    header profiles are copied as text, the rest are parsed and dumped in batches
+
+    :type stream: object
+    :param stream: stream supporting ``write(str)``
+
+    :type positions: iterable
+    :param positions: positions yielded by :func:`merge`
+
+    :type batch_size: int
+    :param batch_size: number of interactions dumped at once
+    '''
+    batch = []
+    for reader, offset, length in positions:
+        if not reader.is_plain():
+            batch.append(Interaction.from_dict(reader.read(offset, length)))
+            if len(batch) < batch_size:
+                continue
+        if batch:
+            write_tape(stream, batch, batch_size)
+            batch = []
+        if reader.is_plain():
+            text = reader.text(offset, length)
+            stream.write(text if text.endswith('\n') else text + '\n')
+    if batch:
+        write_tape(stream, batch, batch_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Merge vcr tapes', prog='python -m httpsrvvcr.merge')
+    parser.add_argument('tapes', help='tapes to merge', type=str, nargs='+')
+    parser.add_argument('--prefer', help='tape to take interactions recorded on several tapes '
+                        'from', choices=[PREFER_FIRST, PREFER_LAST], default=PREFER_LAST)
+    add_compare_arguments(parser)
+    args = parser.parse_args()
+    tape_readers = [TapeReader(tape_path) for tape_path in args.tapes]
+    write_merged(sys.stdout, merge(comparer_from_args(args), tape_readers, args.prefer))
+    for tape_reader in tape_readers:
+        tape_reader.close()
@@ -3,16 +3,28 @@ VCR Player plays tapes recorded with ``httpsrvvcr.recorder``
 using :class:`httpsrv.Server` provided
 '''
 
+import atexit
+import asyncio
+import hashlib
+import weakref
+import json as pyjson
 from functools import wraps
+from contextlib import nullcontext
 
-import yaml
+from httpsrv import Rule
+
+from httpsrvvcr.index import TapeIndex
+from httpsrvvcr.store import TapeStore, body_hash, is_store
+from httpsrvvcr.routing import split_path
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.profiling import Profiler
+from httpsrvvcr.tape import Interaction, interactions, load_yaml, read_tape
 
 
 _IGNORE_HEADERS = [
     'transfer-encoding'
 ]
 
-
 def tape_from_yaml(yaml_text):
     '''
     Parses yaml tape into python dictionary
@@ -20,15 +32,328 @@ def tape_from_yaml(yaml_text):
     :type yaml_text: str
     :param yaml_text: yaml string to parse
     '''
-    return yaml.load(yaml_text)
+    return load_yaml(yaml_text)
 
 
 def _filter_headers(headers):
     headers = headers or {}
+    if not any(name.lower() in _IGNORE_HEADERS for name in headers):
+        return headers
     return dict((name, value) for name, value in headers.items()
                 if name.lower() not in _IGNORE_HEADERS)
 
 
+def _headers_match(expected, actual):
+    for name, value in expected.items():
+        if actual.get(name) != value:
+            return False
+    return True
+
+
+class _Dispatcher:
+    '''
+    Connects rule sources to httpsrv. Replaces ``matches`` of an ``always`` rule
+    registered on the server and sets response found by the first source having one.
+    httpsrv asks every ``always`` rule before it serves the first matching one,
+    so a player keeps a single dispatcher per method and only the source
+    that answers a request marks its interaction served
+    '''
+    def __init__(self, rule):
+        self.rule = rule
+        # replaced rather than changed, so requests in flight see a consistent list
+        self.sources = ()
+
+    def matches(self, method, path, headers, bytes=None):
+        # httpsrv asks every always rule, whatever method it was registered for
+        if method != self.rule.method:
+            return False
+        for source in self.sources:
+            response = source.match(method, path, headers, bytes)
+            if response is not None:
+                self.rule.response = response
+                return True
+        return False
+
+
+class _IndexSource:
+    '''
+    Resolves rules on demand from a :class:`httpsrvvcr.index.TapeIndex`
+    so interactions are parsed only when a request for them arrives.
+    Every interaction is served once just like rules created with ``Server.on``
+    '''
+    def __init__(self, player, index):
+        self._player = player
+        self._index = index
+        self._candidates = {}
+        self._used = set()
+
+    def match(self, method, path, headers, bytes=None):
+        for offset, length in self._index.offsets(method, path):
+            if offset in self._used:
+                continue
+            candidate = self._candidate(offset, length)
+            if candidate.matches(method, path, headers, bytes):
+                self._used.add(offset)
+                return candidate.response
+        return None
+
+    def _candidate(self, offset, length):
+        if offset not in self._candidates:
+            action = self._index.interaction(offset, length)
+            self._candidates[offset] = self._player._create_rule(Rule, action)
+        return self._candidates[offset]
+
+
+class _StoreSource:
+    '''
+    Resolves rules on demand from a :class:`httpsrvvcr.store.TapeStore`
+    querying interactions by method, path and body hash.
+    Every interaction is served once just like rules created with ``Server.on``
+    '''
+    # httpsrv rules recorded without a body match any body
+    _ANY_BODY = body_hash()
+
+    def __init__(self, player, store):
+        self._player = player
+        self._store = store
+        self._candidates = {}
+        self._used = set()
+
+    def match(self, method, path, headers, bytes=None):
+        digest = body_hash(bytes.decode('utf8', 'replace') if bytes else None)
+        for interaction_id in self._store.ids(method, path, [digest, self._ANY_BODY]):
+            if interaction_id in self._used:
+                continue
+            candidate = self._candidate(interaction_id)
+            if candidate.matches(method, path, headers, bytes):
+                self._used.add(interaction_id)
+                return candidate.response
+        return None
+
+    def _candidate(self, interaction_id):
+        if interaction_id not in self._candidates:
+            action = self._store.interaction(interaction_id)
+            self._candidates[interaction_id] = self._player._create_rule(Rule, action)
+        return self._candidates[interaction_id]
+
+
+def interaction_key(action):
+    '''
+    Returns a digest of the whole interaction, equal interactions get equal digests
+
+    :type action: httpsrvvcr.tape.Interaction
+    :param action: interaction record
+
+    :rtype: bytes
+    '''
+    dumped = pyjson.dumps(action.to_dict(), sort_keys=True, default=str)
+    return hashlib.sha1(dumped.encode('utf8')).digest()
+
+
+class CompiledTape:
+    '''
+    Tape prepared for :func:`Player.switch`. Every interaction gets a key,
+    a digest of the whole interaction with its occurrence number, so
+    interactions shared by different tapes get equal keys
+
+    :type tape: list
+    :param tape: vcr tape, dictionaries or :class:`httpsrvvcr.tape.Interaction` records
+
+    :type digests: list
+    :param digests: digests of tape interactions computed with :func:`interaction_key`,
+        given when they are known already, computed otherwise
+    '''
+    def __init__(self, tape, digests=None):
+        self.actions = {}
+        self.methods = []
+        self._by_request = {}
+        occurrences = {}
+        actions = list(interactions(tape))
+        if digests is None:
+            digests = [interaction_key(action) for action in actions]
+        for action, digest in zip(actions, digests):
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            key = (digest, occurrence)
+            request = action.request
+            self.actions[key] = action
+            self._by_request.setdefault((request.method, request.path), []).append(key)
+            if request.method not in self.methods:
+                self.methods.append(request.method)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def keys(self, method, path):
+        '''
+        Returns keys of interactions recorded for a request in recording order
+
+        :type method: str
+        :param method: request method
+
+        :type path: str
+        :param path: request path including query string
+
+        :rtype: list
+        '''
+        return self._by_request.get((method, path), ())
+
+
+class _SwitchSource:
+    '''
+    Rules of the tape played with :func:`Player.switch`. When tapes are switched
+    rules are created only for interactions missing from the previous tape,
+    rules of interactions absent from the new tape are dropped and served
+    rules are made available again.
+    Every interaction is served once just like rules created with ``Server.on``
+    '''
+    def __init__(self, player):
+        self._player = player
+        # tape, rules and served keys are replaced at once, so requests
+        # in flight finish matching against the tape they started with
+        self._state = None
+
+    def switch(self, tape, keep_served=False):
+        _, rules, used = self._state or (None, {}, set())
+        retained = dict((key, rule) for key, rule in rules.items() if key in tape.actions)
+        added = tape.actions.keys() - retained.keys()
+        for key in added:
+            retained[key] = self._player._create_rule(Rule, tape.actions[key])
+        served = set(key for key in used.copy() if key in retained) if keep_served else set()
+        self._state = (tape, retained, served)
+        return len(added)
+
+    def match(self, method, path, headers, bytes=None):
+        tape, rules, used = self._state
+        for key in tape.keys(method, path):
+            if key in used:
+                continue
+            rule = rules[key]
+            if rule.matches(method, path, headers, bytes):
+                used.add(key)
+                return rule.response
+        return None
+
+
+class _LayeredSource:
+    '''
+    Resolves rules from compiled tapes layered on top of each other,
+    rules of upper layers take precedence. Layers are shared between plays,
+    only served rules are tracked per play, so cached base tapes are never copied.
+    Every interaction is served once just like rules created with ``Server.on``
+    '''
+    def __init__(self, layers):
+        # (tape, rules) pairs, upper layers first
+        self._layers = layers
+        self._used = set()
+
+    def match(self, method, path, headers, bytes=None):
+        for depth, (tape, rules) in enumerate(self._layers):
+            for key in tape.keys(method, path):
+                if (depth, key) in self._used:
+                    continue
+                rule = rules[key]
+                if rule.matches(method, path, headers, bytes):
+                    self._used.add((depth, key))
+                    return rule.response
+        return None
+
+
+def _file_names(value):
+    return (value,) if isinstance(value, str) else tuple(value)
+
+
+class RuleTable:
+    '''
+    Rules keyed by canonical request digest calculated once when a rule is added,
+    so finding a rule for a request takes a single digest lookup.
+    Request headers recorded for a rule still have to be present in a request.
+    Every rule is served once just like rules created with ``Server.on``
+
+    :type canonicalizer: httpsrvvcr.canonical.Canonicalizer
+    :param canonicalizer: canonicalizer used to calculate request digests
+    '''
+    def __init__(self, canonicalizer):
+        self._canonicalizer = canonicalizer
+        self._rules = {}
+        self.methods = []
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._rules.values())
+
+    def add(self, request, response):
+        '''
+        Adds a rule
+
+        :type request: httpsrvvcr.tape.RecordedRequest
+        :param request: recorded request to match
+
+        :type response: object
+        :param response: httpsrv response to serve, e.g. ``Rule.response``
+        '''
+        key = self._canonicalizer.recorded_key(request)
+        self._rules.setdefault(key, []).append((_filter_headers(request.headers), response))
+        if request.method not in self.methods:
+            self.methods.append(request.method)
+
+    def match(self, method, path, headers, bytes=None):
+        '''
+        Finds and removes a rule matching given request
+
+        :returns: httpsrv response or ``None``
+        '''
+        rules = self._rules.get(self._canonicalizer.incoming_key(method, path, bytes))
+        for position, (expected_headers, response) in enumerate(rules or ()):
+            if _headers_match(expected_headers, headers):
+                del rules[position]
+                return response
+        return None
+
+
+class RoutedRuleTable(RuleTable):
+    '''
+    Rule table that also matches requests by path templates found with
+    :class:`httpsrvvcr.routing.PathRouter`. Request recorded for the exact path
+    is preferred, otherwise the first rule recorded for the template is served,
+    and it is served any number of times. So a single ``/api/users/42`` rule
+    answers ``/api/users/43`` as well once ``/api/users/{id}`` template is known
+
+    :type canonicalizer: httpsrvvcr.canonical.Canonicalizer
+    :param canonicalizer: canonicalizer used to calculate request digests
+
+    :type router: httpsrvvcr.routing.PathRouter
+    :param router: router holding path templates
+    '''
+    def __init__(self, canonicalizer, router):
+        super().__init__(canonicalizer)
+        self._router = router
+        self._fallbacks = {}
+
+    def add(self, request, response):
+        super().add(request, response)
+        template = self._router.template(request.path)
+        request = request._replace(path=self._templated(request.path, template))
+        key = self._canonicalizer.recorded_key(request)
+        if key not in self._fallbacks:
+            self._fallbacks[key] = (_filter_headers(request.headers), response)
+
+    def match(self, method, path, headers, bytes=None):
+        response = super().match(method, path, headers, bytes)
+        if response is not None:
+            return response
+        template = self._router.find(path)
+        if template is None:
+            return None
+        key = self._canonicalizer.incoming_key(method, self._templated(path, template), bytes)
+        expected_headers, response = self._fallbacks.get(key, (None, None))
+        if response is not None and _headers_match(expected_headers, headers):
+            return response
+        return None
+
+    def _templated(self, path, template):
+        _, query = split_path(path)
+        return template + '?' + query if query else template
+
 
 class Player:
     '''
@@ -40,44 +365,225 @@ class Player:
 
     :type add_cors: bool
     :param add_cors: if ``True`` player will add CORS header to all responses
+
+    :type canonicalizer: httpsrvvcr.canonical.Canonicalizer
+    :param canonicalizer: if given tapes passed to :func:`Player.play` are matched
+        by canonical request digests, see :class:`RuleTable`
+
+    :type router: httpsrvvcr.routing.PathRouter
+    :param router: if given tapes passed to :func:`Player.play` are matched
+        by path templates as well, see :class:`RoutedRuleTable`
+
+    :type profile: bool
+    :param profile: if ``True`` tape loading and :func:`Player.play` are profiled,
+        report is written to ``stderr`` on exit. If a file name is given
+        pstats are dumped to it as well. Tapes read in executor threads
+        by :func:`Player.aload` are covered by memory statistics only
+
+
+    Only tapes played with :func:`Player.play` without a canonicalizer are loaded
+    as ``Server.on`` rules. Canonical, indexed, stored, switched and layered tapes
+    are served through ``Server.always`` rules, so interactions left unserved
+    are not reported by ``Server.assert_no_pending``
     '''
-    def __init__(self, server, add_cors=False):
+    def __init__(self, server, add_cors=False, canonicalizer=None, router=None, profile=False):
         self._server = server
         self._add_cors = add_cors
+        self._canonicalizer = canonicalizer
+        self._router = router
+        if router is not None and canonicalizer is None:
+            self._canonicalizer = Canonicalizer()
+        self._indexes = {}
+        self._compiled = {}
+        self._layer_rules = weakref.WeakKeyDictionary()
+        self._switch_source = None
+        self._layered_source = None
+        self._table = None
+        self._dispatchers = {}
+        self._profiler = None
+        if profile:
+            self._profiler = Profiler(None if profile is True else profile)
+            atexit.register(self._profiler.report)
 
     def play(self, tape):
         '''
         Loads the server with rules created from tape passed
 
-        :type tape: dict
-        :param tape: vcr tape previously recorded with ``httpsrvvcr.recorder``
+        :type tape: list
+        :param tape: vcr tape previously recorded with ``httpsrvvcr.recorder``,
+            either :func:`tape_from_yaml` dictionaries or
+            :class:`httpsrvvcr.tape.Interaction` records
+        '''
+        with self._profiling():
+            self._play(tape)
+
+    def _play(self, tape):
+        if self._canonicalizer is None:
+            for action in interactions(tape):
+                self._set_rule(action)
+            return
+        # tapes played until the server is reset share a table
+        table = self._table
+        if table is None or not self._dispatched(table):
+            if self._router is not None:
+                table = RoutedRuleTable(self._canonicalizer, self._router)
+            else:
+                table = RuleTable(self._canonicalizer)
+            self._table = table
+        for action in interactions(tape):
+            table.add(action.request, self._create_rule(Rule, action).response)
+        self._dispatch(table, table.methods)
+
+    def play_index(self, index):
+        '''
+        Loads the server with an indexed tape. Unlike :func:`Player.play`
+        no interactions are parsed upfront, matching ones are resolved
+        from the index when requests arrive
+
+        :type index: httpsrvvcr.index.TapeIndex
+        :param index: indexed tape opened with :func:`httpsrvvcr.index.TapeIndex.open`
+        '''
+        with self._profiling():
+            self._dispatch(_IndexSource(self, index), index.methods)
+
+    def play_store(self, store):
+        '''
+        Loads the server with a SQLite tape store. Interactions are queried
+        from the store when requests arrive
+
+        :type store: httpsrvvcr.store.TapeStore
+        :param store: tape store
+        '''
+        with self._profiling():
+            self._dispatch(_StoreSource(self, store), store.methods)
+
+    def switch(self, tape, keep_served=False, register=True):
+        '''
+        Makes the server play a tape instead of the one played with a previous
+        :func:`Player.switch` call. Only the difference between tapes is applied,
+        so switching between overlapping tapes costs as much as they differ.
+        Rules are swapped atomically, so tapes can be switched while the server
+        handles requests. Switched rules are registered again after ``Server.reset``
+        and are not visible to ``Server.assert_no_pending``
+
+        :type tape: list
+        :param tape: vcr tape or :class:`CompiledTape`, compile tapes
+            that are switched to repeatedly
+
+        :type keep_served: bool
+        :param keep_served: if ``True`` interactions served before the switch
+            and present in the new tape are not served again
+
+        :type register: bool
+        :param register: if ``False`` no rules are registered on the server, so the
+            switch may be made outside of the server thread, interactions of methods
+            the player does not serve yet are served after a switch that registers them
+
+        :returns: number of rules created
+        :rtype: int
+        '''
+        with self._profiling():
+            if not isinstance(tape, CompiledTape):
+                tape = CompiledTape(tape)
+            if self._switch_source is None:
+                self._switch_source = _SwitchSource(self)
+            added = self._switch_source.switch(tape, keep_served)
+            self._dispatch(self._switch_source, tape.methods, register)
+            return added
+
+    def play_layers(self, *tapes):
+        '''
+        Loads the server with tapes layered on top of each other, rules of later
+        tapes take precedence over rules of earlier ones. Rules created for
+        a :class:`CompiledTape` are cached while it is alive, so a base tape
+        shared by many tests is compiled once and never copied::
+
+            base = CompiledTape(read_tape(base_yaml))
+            player.play_layers(base, overlay)
+
+        Layers played before are replaced, rules served by them are made available again
+
+        :type tapes: list
+        :param tapes: vcr tapes or :class:`CompiledTape` objects, lowest layer first
         '''
-        for rule in tape:
-            self._set_rule(rule)
+        with self._profiling():
+            layers = []
+            methods = []
+            for tape in reversed(tapes):
+                if not isinstance(tape, CompiledTape):
+                    tape = CompiledTape(tape)
+                layers.append((tape, self._rules_of(tape)))
+                methods.extend(method for method in tape.methods if method not in methods)
+            if self._layered_source is not None:
+                self._undispatch(self._layered_source)
+            self._layered_source = _LayeredSource(layers)
+            self._dispatch(self._layered_source, methods)
+
+    def _rules_of(self, tape):
+        rules = self._layer_rules.get(tape)
+        if rules is None:
+            rules = self._layer_rules[tape] = dict(
+                (key, self._create_rule(Rule, action)) for key, action in tape.actions.items())
+        return rules
+
+    def _dispatch(self, source, methods, register=True):
+        # one rule per method is reused while registered, sources are asked in play order
+        for method in methods:
+            dispatcher = self._dispatchers.get(method)
+            if dispatcher is None or not self._registered(dispatcher.rule):
+                if not register:
+                    continue
+                rule = self._server.always(method)
+                dispatcher = self._dispatchers[method] = _Dispatcher(rule)
+                rule.matches = dispatcher.matches
+            if source not in dispatcher.sources:
+                dispatcher.sources += (source,)
+
+    def _dispatched(self, source):
+        for method in source.methods:
+            dispatcher = self._dispatchers.get(method)
+            if (dispatcher is None or source not in dispatcher.sources
+                    or not self._registered(dispatcher.rule)):
+                return False
+        return True
+
+    def _undispatch(self, source):
+        for dispatcher in self._dispatchers.values():
+            if source in dispatcher.sources:
+                dispatcher.sources = tuple(
+                    other for other in dispatcher.sources if other is not source)
+
+    def _registered(self, rule):
+        # Server.reset drops always rules and httpsrv has no public way to tell
+        return rule in self._server._always_rules
 
     def _set_rule(self, action):
-        request = action['request']
-        response = action['response']
-        req_headers = _filter_headers(request['headers'])
+        self._create_rule(self._server.on, action)
+
+    def _create_rule(self, factory, action):
+        action = Interaction.from_dict(action)
+        request = action.request
+        req_headers = _filter_headers(request.headers)
         # httpsrv gurantees that json param will have priority over text
-        rule = self._server.on(
-            request['method'], request['path'], req_headers,
-            text=request['text'], json=request['json'])
-        self._set_response(rule, response)
+        rule = factory(
+            request.method, request.path, req_headers,
+            text=request.text, json=request.json)
+        self._set_response(rule, action.response)
+        return rule
 
     def _set_response(self, rule, response):
-        headers = response['headers'] or {}
+        # records are shared, httpsrv may modify headers it is given
+        headers = dict(response.headers or {})
         if self._add_cors:
             headers['Access-Control-Allow-Origin'] = '*'
-        if response['json']:
-            rule.json(response['json'], response['code'], headers)
-        elif response['text']:
-            rule.text(response['text'], response['code'], headers)
+        if response.json:
+            rule.json(response.json, response.code, headers)
+        elif response.text:
+            rule.text(response.text, response.code, headers)
         else:
-            rule.status(response['code'], headers)
-
+            rule.status(response.code, headers)
 
-    def load(self, tape_file_name):
+    def load(self, tape_file_name, lazy=False, incremental=False, shared=False, base=None):
         '''
         Decorator that can be used on test functions to read vcr tape from file
         and load current player with it::
@@ -86,17 +592,147 @@ class Player:
             def test_should_do_some_vcr(self):
                 pass
 
+        Coroutine functions are supported as well, tape is read
+        with :func:`Player.aload` then::
+
+            @player.load('path/to/tape.yaml')
+            async def test_should_do_some_async_vcr(self):
+                pass
+
         :type tape_file_name: str
-        :param tape_file_name: tape filename to load
+        :param tape_file_name: tape filename to load, SQLite stores
+            (``.db``, ``.sqlite``, ``.sqlite3``) are always queried on demand,
+            see :func:`Player.play_store`
+
+        :type lazy: bool
+        :param lazy: if ``True`` tape is memory-mapped together with its index
+            (built next to the tape on first use) and interactions are
+            resolved on demand, see :func:`Player.play_index`
+
+        :type incremental: bool
+        :param incremental: if ``True`` tape is compiled once and switched to
+            with :func:`Player.switch`, so only rules that differ from the
+            previously loaded tape are replaced
+
+        :type shared: bool
+        :param shared: if ``True`` tape is compiled into a file next to it
+            (``path/to/tape.yaml.hvc``) once and loaded lazily from it, processes
+            like parallel test workers share a single read-only copy of the tape,
+            see :func:`httpsrvvcr.index.build_compiled`
+
+        :type base: str
+        :param base: base tape filename or a list of them. Base tapes are compiled
+            once and cached, loaded tape is layered on top of them and its rules
+            take precedence, see :func:`Player.play_layers`
+
+        Tapes loaded with ``lazy``, ``incremental``, ``shared`` or ``base``, SQLite stores
+        and tapes loaded by a player with a canonicalizer are not checked by
+        ``Server.assert_no_pending``, see :class:`Player`
         '''
         def _decorator(wrapped):
+            if asyncio.iscoroutinefunction(wrapped):
+                @wraps(wrapped)
+                async def _async_wrapper(*args, **kwargs):
+                    await self.aload(tape_file_name, lazy=lazy, incremental=incremental,
+                                     shared=shared, base=base)
+                    return await wrapped(*args, **kwargs)
+                return _async_wrapper
+
             @wraps(wrapped)
             def _wrapper(*args, **kwargs):
-                with open(tape_file_name, 'r', encoding='utf8') as tape_file:
-                    tape_yaml = tape_file.read()
-                    tape = tape_from_yaml(tape_yaml)
-                    self.play(tape)
-                    wrapped(*args, **kwargs)
+                with self._profiling():
+                    if base is not None:
+                        self.play_layers(self._compile(*_file_names(base)),
+                                         self._compile(tape_file_name))
+                    else:
+                        self._play_loaded(self._read(tape_file_name, lazy, incremental, shared))
+                return wrapped(*args, **kwargs)
             return _wrapper
         return _decorator
 
+    async def aload(self, *tape_file_names, lazy=False, incremental=False, shared=False,
+                    base=None):
+        '''
+        Reads vcr tapes from files without blocking the event loop and
+        loads current player with them. Files are read and parsed concurrently
+        in the default executor and played in the order they were given::
+
+            await player.aload('path/to/auth.yaml', 'path/to/users.yaml')
+
+        :type tape_file_names: str
+        :param tape_file_names: tape filenames to load
+
+        :type lazy: bool
+        :param lazy: if ``True`` tapes are loaded through their indexes,
+            see :func:`Player.play_index`
+
+        :type incremental: bool
+        :param incremental: if ``True`` tapes are switched to as a single tape,
+            see :func:`Player.load`
+
+        :type shared: bool
+        :param shared: if ``True`` tapes are loaded from compiled files
+            shared between processes, see :func:`Player.load`
+
+        :type base: str
+        :param base: base tape filename or a list of them, tapes are layered
+            on top of base tapes in the order they were given, see :func:`Player.load`
+        '''
+        loop = asyncio.get_running_loop()
+        if base is not None:
+            layers = await asyncio.gather(*[
+                loop.run_in_executor(None, self._compile, *file_names)
+                for file_names in [_file_names(base)] + [(name,) for name in tape_file_names]])
+            self.play_layers(*layers)
+            return
+        if incremental:
+            self.switch(await loop.run_in_executor(None, self._compile, *tape_file_names))
+            return
+        loaded = await asyncio.gather(*[
+            loop.run_in_executor(None, self._read, tape_file_name, lazy, False, shared)
+            for tape_file_name in tape_file_names])
+        for tape in loaded:
+            self._play_loaded(tape)
+
+    def _read(self, tape_file_name, lazy, incremental=False, shared=False):
+        if incremental:
+            return self._compile(tape_file_name)
+        if is_store(tape_file_name):
+            return self._open_store(tape_file_name)
+        if lazy or shared:
+            return self._open_index(tape_file_name, shared)
+        with open(tape_file_name, 'r', encoding='utf8') as tape_file:
+            return read_tape(tape_file.read())
+
+    def _play_loaded(self, tape):
+        if isinstance(tape, TapeIndex):
+            self.play_index(tape)
+        elif isinstance(tape, TapeStore):
+            self.play_store(tape)
+        elif isinstance(tape, CompiledTape):
+            self.switch(tape)
+        else:
+            self.play(tape)
+
+    def _open_index(self, tape_file_name, compiled=False):
+        key = (tape_file_name, compiled)
+        if key not in self._indexes:
+            self._indexes[key] = TapeIndex.open(tape_file_name, compiled)
+        return self._indexes[key]
+
+    def _compile(self, *tape_file_names):
+        if tape_file_names not in self._compiled:
+            tape = []
+            for tape_file_name in tape_file_names:
+                with open(tape_file_name, 'r', encoding='utf8') as tape_file:
+                    tape.extend(read_tape(tape_file.read()))
+            self._compiled[tape_file_names] = CompiledTape(tape)
+        return self._compiled[tape_file_names]
+
+    def _open_store(self, tape_file_name):
+        if tape_file_name not in self._indexes:
+            self._indexes[tape_file_name] = TapeStore(tape_file_name, create=False)
+        return self._indexes[tape_file_name]
+
+    def _profiling(self):
+        return self._profiler or nullcontext()
@@ -0,0 +1,87 @@
+'''
+Profiling hooks for ``httpsrvvcr.recorder`` and ``httpsrvvcr.player``.
+Time is measured with :mod:`cProfile` and memory with :mod:`tracemalloc`,
+report with the slowest functions and top allocation sites is written on demand
+'''
+
+import io
+import sys
+import pstats
+import cProfile
+import tracemalloc
+
+
+class Profiler:
+    '''
+    Context manager profiling code executed inside it. Profiler can be
+    entered many times, measurements are accumulated until :func:`Profiler.report`.
+    Memory is traced only inside the outermost section, allocations made
+    and still alive when a section exits are summed up per allocation site
+
+    :type output: str
+    :param output: file name to dump pstats to, can be inspected later with :mod:`pstats`
+
+    :type stream: object
+    :param stream: stream report is written to, ``stderr`` by default
+
+    :type top: int
+    :param top: number of functions and allocation sites reported
+    '''
+    def __init__(self, output=None, stream=None, top=20):
+        self._output = output
+        self._stream = stream
+        self._top = top
+        self._profile = cProfile.Profile()
+        self._depth = 0
+        self._snapshot = None
+        self._started_tracing = False
+        # (size, count) of allocations by traceback accumulated over sections
+        self._allocations = {}
+
+    def __enter__(self):
+        if self._depth == 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._snapshot = tracemalloc.take_snapshot()
+            self._profile.enable()
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            self._profile.disable()
+            # allocations made by profiled code and still alive when it finishes
+            for stat in tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno'):
+                size, count = self._allocations.get(stat.traceback, (0, 0))
+                self._allocations[stat.traceback] = (
+                    size + stat.size_diff, count + stat.count_diff)
+            self._snapshot = None
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        return False
+
+    def report(self):
+        '''
+        Writes the slowest functions by cumulative time and top allocation
+        sites to stream and dumps pstats to ``output`` if given
+        '''
+        stream = self._stream or sys.stderr
+        stats_stream = io.StringIO()
+        try:
+            stats = pstats.Stats(self._profile, stream=stats_stream)
+        except TypeError:
+            # nothing was profiled
+            return
+        stats.sort_stats('cumulative').print_stats(self._top)
+        stream.write(stats_stream.getvalue())
+        if self._output:
+            stats.dump_stats(self._output)
+            stream.write('pstats written to {}\n'.format(self._output))
+        if self._allocations:
+            stream.write('top {} allocation sites:\n'.format(self._top))
+            top = sorted(self._allocations.items(), key=lambda item: item[1][0], reverse=True)
+            for traceback, (size, count) in top[:self._top]:
+                stream.write('{}: size={} B, count={}\n'.format(traceback, size, count))
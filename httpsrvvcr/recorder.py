@@ -4,20 +4,61 @@ Works as a proxy recording real API calls to yaml "vcr tape"
 that can further be used as httpsrv fixture
 '''
 
+import re
+import ssl
 import sys
+import signal
 import argparse
+import functools
+import hashlib
 import json as pyjson
+from contextlib import nullcontext
 from urllib.parse import urlparse
 
 import yaml as pyyaml
 import tornado.ioloop
 import tornado.web
+import tornado.netutil
+import tornado.routing
+from tornado.httpserver import HTTPServer
 from tornado.gen import coroutine
 from tornado.httpclient import AsyncHTTPClient, HTTPError
 
+from httpsrvvcr.tape import (
+    PROFILE_KEY, HeaderFilter, Interaction, RecordedRequest, RecordedResponse, intern_headers,
+    read_tape)
+from httpsrvvcr.replay import ReplayIndex
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.cache import ResponseCache
+from httpsrvvcr.profiling import Profiler
+from httpsrvvcr.sampling import RateSampler, FirstSampler, ReservoirSampler
+from httpsrvvcr.store import TapeStore, is_store
+from httpsrvvcr.shaping import ResponseShaper
+
 
 # We don't support chunked encoding for now
 EXCLUDED_HEADERS = ['Transfer-Encoding']
+# Headers of a client connection, forwarding them would close kept-alive target connections
+HOP_BY_HOP_HEADERS = ['Connection', 'Keep-Alive', 'Proxy-Connection', 'TE', 'Upgrade']
+
+# always forward to target and record
+MODE_RECORD = 'record'
+# serve known requests from tape, forward unknown ones without recording
+MODE_REPLAY = 'replay'
+# always forward to target, never record
+MODE_PASSTHROUGH = 'passthrough'
+# serve known requests from tape, forward and record unknown ones
+MODE_RECORD_NEW = 'record-new'
+
+MODES = [MODE_RECORD, MODE_REPLAY, MODE_PASSTHROUGH, MODE_RECORD_NEW]
+
+# seconds between flushes of recorded interactions to outputs
+OUTPUT_FLUSH_INTERVAL = 1.0
+
+# Only requests without side effects are safe to share
+COALESCED_METHODS = ['GET', 'HEAD', 'OPTIONS']
+# Request headers that may change target response
+COALESCED_HEADERS = ['Host', 'Accept', 'Accept-Encoding', 'Accept-Language', 'Authorization', 'Cookie']
 
 
 class YamlWriter:
@@ -46,6 +87,20 @@ class YamlWriter:
         dumped = self._yaml.dump(data, default_flow_style=False, allow_unicode=True)
         self._writer.write(dumped)
 
+    def flush(self):
+        '''
+        Flushes the underlying writer if it supports ``flush()``
+        '''
+        flush = getattr(self._writer, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        '''
+        Closes the underlying writer
+        '''
+        self._writer.close()
+
 
 class VcrWriter:
     '''
@@ -61,12 +116,31 @@ class VcrWriter:
 
     :type no_headers: bool
     :param no_headers: if ``True`` then no headers will be recorded for request or resposne
+
+    :type skip_methods: list
+    :param skip_methods: requests with these methods will not be recorded
+
+    :type share_headers: bool
+    :param share_headers: if ``True`` every distinct set of headers is written
+        once as a header profile and interactions reference it by id
+
+    :type header_filter: HeaderFilter
+    :param header_filter: filter deciding which headers are recorded
+
+    :type sampler: object
+    :param sampler: one of ``httpsrvvcr.sampling`` samplers deciding which
+        interactions are recorded, call :func:`VcrWriter.flush` when recording stops
     '''
-    def __init__(self, writer, json, no_headers=False, skip_methods=None):
+    def __init__(self, writer, json, no_headers=False, skip_methods=None, share_headers=False,
+                 header_filter=None, sampler=None):
         self._writer = writer
         self._json = json
         self._no_headers = no_headers
         self._skip_methods = skip_methods or []
+        self._share_headers = share_headers
+        self._header_filter = header_filter
+        self._sampler = sampler
+        self._profiles = {}
 
     def write(self, request, response):
         '''
@@ -82,29 +156,73 @@ class VcrWriter:
         '''
         if request.method in self._skip_methods:
             return
-        self._writer.write([{
-            'request': self._request_output(request),
-            'response': self._response_output(response)
-        }])
+        if self._sampler is None:
+            self._write(request, response)
+            return
+        for sampled in self._sampler.offer(request, response):
+            self._write(*sampled)
+
+    def flush(self):
+        '''
+        Writes interactions kept by sampler and flushes
+        the underlying writer if it supports ``flush()``
+        '''
+        if self._sampler is not None:
+            for sampled in self._sampler.drain():
+                self._write(*sampled)
+        flush = getattr(self._writer, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def interaction(self, request, response):
+        '''
+        Converts given request and response into an interaction record
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type response: tornado.httpclient.HTTPResponse
+        :param response: client response
+
+        :rtype: httpsrvvcr.tape.Interaction
+        '''
+        return Interaction(self._request_output(request), self._response_output(response))
+
+    def _write(self, request, response):
+        output = self.interaction(request, response).to_dict()
+        if self._share_headers:
+            for message in (output['request'], output['response']):
+                message['headers'] = self._profile_id(message['headers'])
+        self._writer.write([output])
 
     def _request_output(self, request):
-        text_and_json = self._read_text_and_json(request)
-        output = {
-            'path': request.uri,
-            'method': request.method,
-            'headers': None if self._no_headers else dict(request.headers),
-        }
-        output.update(text_and_json)
-        return output
+        text, json = self._read_text_and_json(request)
+        return RecordedRequest(
+            request.method, request.uri, self._headers_output(request.headers), text, json)
 
     def _response_output(self, response):
-        text_and_json = self._read_text_and_json(response)
-        code_and_headers = {
-            'code': response.code,
-            'headers': None if self._no_headers else dict(response.headers),
-        }
-        code_and_headers.update(text_and_json)
-        return code_and_headers
+        text, json = self._read_text_and_json(response)
+        return RecordedResponse(
+            response.code, self._headers_output(response.headers), text, json)
+
+    def _headers_output(self, headers):
+        if self._no_headers:
+            return None
+        if self._header_filter:
+            headers = self._header_filter.filter(headers)
+        return intern_headers(headers)
+
+    def _profile_id(self, headers):
+        if headers is None:
+            return None
+        key = tuple(sorted(headers.items()))
+        if key not in self._profiles:
+            # ids are derived from headers, so sessions appended to a tape never reuse them
+            digest = hashlib.sha1(pyjson.dumps(key, default=str).encode('utf8')).hexdigest()
+            profile_id = 'h' + digest[:12]
+            self._writer.write([{PROFILE_KEY: profile_id, 'headers': headers}])
+            self._profiles[key] = profile_id
+        return self._profiles[key]
 
     def _read_text_and_json(self, data):
         json_body = None
@@ -112,18 +230,88 @@ class VcrWriter:
         if text_body and 'application/json' in data.headers.get('Content-Type', []):
             json_body = self._json.loads(text_body)
             text_body = None
-        return {'text': text_body, 'json': json_body}
+        return text_body, json_body
 
 
+class RequestCoalescer:
+    '''
+    Shares a single target request between identical concurrent requests.
+    Requests are identical if they have the same method, uri, body and
+    values of relevant headers
+
+    :type methods: list
+    :param methods: methods of requests that can be shared
+
+    :type headers: list
+    :param headers: request headers that must be equal for requests to be shared
+    '''
+    def __init__(self, methods=None, headers=None):
+        self._methods = frozenset(methods or COALESCED_METHODS)
+        self._headers = headers or COALESCED_HEADERS
+        self._in_flight = {}
+        self.coalesced = 0
+
+    def key(self, request):
+        '''
+        Calculates coalescing key of a request or ``None``
+        if request cannot be shared
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+        '''
+        if request.method not in self._methods:
+            return None
+        body_hash = hashlib.sha1(request.body).hexdigest() if request.body else None
+        headers = tuple(request.headers.get(name) for name in self._headers)
+        return request.method, request.uri, headers, body_hash
+
+    def join(self, request, fetch):
+        '''
+        Returns a future of target response, calling ``fetch`` only if
+        there is no identical request in flight
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type fetch: callable
+        :param fetch: function returning a future of target response
+
+        :returns: ``(future, leader)`` tuple, ``leader`` is ``True``
+            if ``fetch`` was called for this request
+        :rtype: tuple
+        '''
+        key = self.key(request)
+        if key is None:
+            return fetch(), True
+        if key in self._in_flight:
+            self.coalesced += 1
+            return self._in_flight[key], False
+        future = self._lead(key, fetch)
+        if not future.done():
+            self._in_flight[key] = future
+        return future, True
+
+    @coroutine
+    def _lead(self, key, fetch):
+        try:
+            res = yield fetch()
+            return res
+        finally:
+            # forget request before waiters are resumed
+            self._in_flight.pop(key, None)
+
 
 class ProxyHandler(tornado.web.RequestHandler):
     '''
     Implementation of a :class:`tornado.web.RequestHandler` that
     proxies any recieved request to a target URL and
-    recorders everything that passes through into a given writer
+    recorders everything that passes through into a given writer.
+    In ``replay`` and ``record-new`` modes requests found in the replay index
+    are answered locally and only the rest is forwarded to the target
     '''
 
-    def initialize(self, httpclient, target, writer):
+    def initialize(self, httpclient, target, writer, mode=MODE_RECORD, replay_index=None,
+                   coalescer=None, cache=None, prefix='', shaper=None):
         '''
         Initializes a handler, overrides standard :class:`tornado.web.RequestHandler`
         method
@@ -136,23 +324,81 @@ class ProxyHandler(tornado.web.RequestHandler):
 
         :type writer: VcrWriter
         :param writer: vcr writer that will be used to output recorded requests
+
+        :type mode: str
+        :param mode: one of :data:`MODES`
+
+        :type replay_index: httpsrvvcr.replay.ReplayIndex
+        :param replay_index: index of recorded responses used in
+            ``replay`` and ``record-new`` modes
+
+        :type coalescer: RequestCoalescer
+        :param coalescer: if given identical concurrent requests share one target
+            request and are recorded once
+
+        :type cache: httpsrvvcr.cache.ResponseCache
+        :param cache: if given cached target responses are used instead of
+            fetching them again, they are still recorded
+
+        :type prefix: str
+        :param prefix: path prefix stripped from request URI before it is
+            forwarded to target, requests are recorded with their original URI
+
+        :type shaper: httpsrvvcr.shaping.ResponseShaper
+        :param shaper: if given responses are sent at a limited rate and concurrency
         '''
         self._httpclient = httpclient
         self._target = target
         self._writer = writer
         self._target_host = self._extract_host(target)
+        self._mode = mode
+        self._replay_index = replay_index if mode in (MODE_REPLAY, MODE_RECORD_NEW) else None
+        self._coalescer = coalescer
+        self._cache = cache
+        self._prefix = prefix
+        self._shaper = shaper
 
     @coroutine
     def prepare(self):
-        res = yield self._make_request()
-        self._writer.write(self.request, res)
-        if res.body:
-            self.write(res.body)
-        self.set_status(res.code)
-        for name, value in res.headers.items():
+        if self._replay_index is not None:
+            recorded = self._replay_index.lookup(self.request)
+            if recorded is not None:
+                yield self._respond(recorded.code, recorded.headers, recorded.body)
+                return
+        res = self._cache.get(self.request, self._target) if self._cache is not None else None
+        if res is not None:
+            self._record(res)
+            yield self._respond(res.code, res.headers.items(), res.body)
+            return
+        if self._coalescer is not None:
+            future, leader = self._coalescer.join(self.request, self._make_request)
+        else:
+            future, leader = self._make_request(), True
+        res = yield future
+        if leader:
+            if self._cache is not None:
+                self._cache.put(self.request, res, self._target)
+            self._record(res)
+        yield self._respond(res.code, res.headers.items(), res.body)
+
+    def _record(self, res):
+        if self._mode in (MODE_RECORD, MODE_RECORD_NEW):
+            self._writer.write(self.request, res)
+        if self._mode == MODE_RECORD_NEW:
+            self._replay_index.add_response(self.request, res)
+
+    @coroutine
+    def _respond(self, code, headers, body):
+        self.set_status(code)
+        for name, value in headers:
             if name not in EXCLUDED_HEADERS:
                 self.set_header(name, value)
         self.set_header('Access-Control-Allow-Origin', '*')
+        if self._shaper is not None:
+            yield self._shaper.send(self, body)
+            return
+        if body:
+            self.write(body)
         self.finish()
 
     @coroutine
@@ -171,21 +417,202 @@ class ProxyHandler(tornado.web.RequestHandler):
 
     def _proxy_request(self):
         return self._httpclient.fetch(
-            self._target + self.request.uri,
+            self._target + self._upstream_uri(),
             method=self.request.method,
-            headers=self._rewrite_host(self.request.headers),
+            headers=self._upstream_headers(self.request.headers),
             allow_nonstandard_methods=True,
             body=self.request.body or None)
 
-    def _rewrite_host(self, headers):
-        if 'Host' not in headers:
+    def _upstream_uri(self):
+        uri = self.request.uri[len(self._prefix):]
+        return uri if uri.startswith('/') else '/' + uri
+
+    def _upstream_headers(self, headers):
+        if 'Host' not in headers and not any(name in headers for name in HOP_BY_HOP_HEADERS):
             return headers
-        copy = headers.copy()
-        copy['Host'] = self._target_host
-        return copy
+        upstream = headers.copy()
+        if 'Host' in upstream:
+            upstream['Host'] = self._target_host
+        for name in HOP_BY_HOP_HEADERS:
+            upstream.pop(name, None)
+        return upstream
+
+
+class Route:
+    '''
+    Recorder route, requests matching it are proxied to their own target
+    with their own http client and recorded to their own tape, so a single
+    recorder can stand in front of every API a service talks to
+
+    :type match: str
+    :param match: path prefix starting with ``/`` or a host name requests
+        are sent to. Path prefix is stripped before a request is forwarded
+
+    :type target: str
+    :param target: URL to proxy matching requests to, e.g. ``http://users-api:8080``
+
+    :type output: str
+    :param output: tape filename, yaml or a store (see :func:`httpsrvvcr.store.is_store`),
+        interactions are appended to. In ``replay`` and ``record-new`` modes requests
+        are served from it. Interactions are written to the default output if omitted
+
+    :type client: tornado.httpclient.AsyncHTTPClient
+    :param client: http client with its own connection pool, see :func:`create_client`
+    '''
+    def __init__(self, match, target, output=None, client=None):
+        self.match = match
+        self.target = target
+        self.output = output
+        self.client = client
+
+    @classmethod
+    def parse(cls, values, client=None):
+        '''
+        Creates a route from ``MATCH TARGET [TAPE]`` command line values
+
+        :type values: list
+        :param values: route values
+
+        :type client: tornado.httpclient.AsyncHTTPClient
+        :param client: http client of the route
+
+        :rtype: Route
+        '''
+        if len(values) not in (2, 3):
+            raise ValueError('route expects MATCH TARGET [TAPE], got {}'.format(' '.join(values)))
+        return cls(values[0], values[1], values[2] if len(values) == 3 else None, client)
 
+    @property
+    def prefix(self):
+        '''
+        Path prefix stripped from forwarded requests, empty for host routes
+
+        :rtype: str
+        '''
+        return self.match.rstrip('/') if self.match.startswith('/') else ''
+
+    def matcher(self):
+        '''
+        Creates tornado matcher selecting requests of this route
 
-def run(port, target, no_headers=False, skip_methods=None):
+        :rtype: tornado.routing.Matcher
+        '''
+        if self.match.startswith('/'):
+            return tornado.routing.PathMatches(re.escape(self.prefix) + r'(?:/.*)?$')
+        return tornado.routing.HostMatches(re.escape(self.match))
+
+
+def open_output(tape_file_name):
+    '''
+    Opens a tape for appending interactions, returns a writer
+    for :class:`VcrWriter`
+
+    :type tape_file_name: str
+    :param tape_file_name: yaml tape or store filename
+    '''
+    if is_store(tape_file_name):
+        return TapeStore(tape_file_name)
+    # line buffered, so interactions reach the tape even if recorder is killed
+    return YamlWriter(open(tape_file_name, 'a', encoding='utf8', buffering=1), pyyaml)
+
+
+def load_replay_index(tape_file_name, canonicalizer=None):
+    '''
+    Reads a tape file into a :class:`httpsrvvcr.replay.ReplayIndex`,
+    missing file results in an empty index
+
+    :type tape_file_name: str
+    :param tape_file_name: tape filename to read
+
+    :type canonicalizer: httpsrvvcr.canonical.Canonicalizer
+    :param canonicalizer: canonicalizer used to match requests
+    '''
+    if is_store(tape_file_name):
+        store = TapeStore(tape_file_name)
+        try:
+            return ReplayIndex(store.interactions(), canonicalizer)
+        finally:
+            store.close()
+    try:
+        with open(tape_file_name, 'r', encoding='utf8') as tape_file:
+            return ReplayIndex(read_tape(tape_file.read()), canonicalizer)
+    except FileNotFoundError:
+        return ReplayIndex(canonicalizer=canonicalizer)
+
+
+def listen(app, port, backlog=128, **server_options):
+    '''
+    Starts serving ``app`` on a given ``port``. Unlike ``app.listen`` allows
+    to tune client-facing connections, keep-alive is enabled unless ``no_keep_alive``
+    is passed
+
+    :type app: tornado.web.Application
+    :param app: application to serve
+
+    :type port: int
+    :param port: port to bind to
+
+    :type backlog: int
+    :param backlog: maximum number of pending connections
+
+    :param server_options: :class:`tornado.httpserver.HTTPServer` arguments, e.g.
+        ``max_buffer_size``, ``max_body_size``, ``idle_connection_timeout``,
+        ``body_timeout``, ``xheaders``
+
+    :rtype: tornado.httpserver.HTTPServer
+    '''
+    server = HTTPServer(app, **server_options)
+    server.add_sockets(tornado.netutil.bind_sockets(port, backlog=backlog))
+    return server
+
+
+def server_ssl_context(certfile, keyfile=None):
+    '''
+    Creates ssl context for accepting HTTPS connections from clients,
+    pass it as ``ssl_options`` to :func:`listen`
+
+    :type certfile: str
+    :param certfile: certificate file in PEM format
+
+    :type keyfile: str
+    :param keyfile: private key file, key is read from ``certfile`` if omitted
+
+    :rtype: ssl.SSLContext
+    '''
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def create_client(curl=False, max_clients=10, ca_certs=None):
+    '''
+    Creates http client used to fetch target responses
+
+    :type curl: bool
+    :param curl: if ``True`` libcurl based client is used, it keeps upstream
+        connections alive and resumes TLS sessions instead of doing a handshake
+        for every request. Requires ``pycurl``
+
+    :type max_clients: int
+    :param max_clients: maximum number of concurrent target requests
+
+    :type ca_certs: str
+    :param ca_certs: CA certificates file to verify target certificate with,
+        e.g. a self-signed certificate of a local stand-in
+
+    :rtype: tornado.httpclient.AsyncHTTPClient
+    '''
+    defaults = dict(ca_certs=ca_certs) if ca_certs else None
+    if curl:
+        from tornado.curl_httpclient import CurlAsyncHTTPClient
+        return CurlAsyncHTTPClient(force_instance=True, max_clients=max_clients, defaults=defaults)
+    return AsyncHTTPClient(force_instance=True, max_clients=max_clients, defaults=defaults)
+
+
+def run(port, target, no_headers=False, skip_methods=None, share_headers=False,
+        keep_headers=None, drop_headers=None, mode=MODE_RECORD, tape=None, coalesce=False,
+        cache=None, sort_query=False, ignore_params=None, profile=False, server_options=None,
+        client=None, sampler_factory=None, output=None, routes=None, shaper=None):
     '''
     Starts a vcr proxy on a given ``port`` using ``target`` as a request destination
 
@@ -194,20 +621,133 @@ def run(port, target, no_headers=False, skip_methods=None):
 
     :type target: str
     :param target: URL to proxy requests to, must be passed with protocol,
-        e.g. ``http://some-url.com``
+        e.g. ``http://some-url.com``. May be ``None`` if every request is routed
 
     :type no_headers: bool
     :param no_headers: if ``True`` then no headers will be recorded for request or resposne
 
     :type skip_methods: list
     :param skip_methods: recorder will not write any requests with provided methods to output
+
+    :type share_headers: bool
+    :param share_headers: if ``True`` every distinct set of headers is recorded once
+        as a header profile referenced by interactions
+
+    :type keep_headers: list
+    :param keep_headers: only headers matching these shell-style patterns will be recorded
+
+    :type drop_headers: list
+    :param drop_headers: headers matching these shell-style patterns will not be recorded
+
+    :type mode: str
+    :param mode: one of :data:`MODES`
+
+    :type tape: str
+    :param tape: previously recorded tape filename to serve requests from
+        in ``replay`` and ``record-new`` modes
+
+    :type coalesce: bool
+    :param coalesce: if ``True`` identical concurrent ``GET``, ``HEAD`` and ``OPTIONS``
+        requests share one target request and are recorded once
+
+    :type cache: httpsrvvcr.cache.ResponseCache
+    :param cache: cache of target responses, its counters are written
+        to ``stderr`` when proxy stops
+
+    :type sort_query: bool
+    :param sort_query: if ``True`` order of query parameters is ignored
+        when requests are looked up on tape
+
+    :type ignore_params: list
+    :param ignore_params: query parameters ignored when requests are looked up on tape
+
+    :type profile: bool
+    :param profile: if ``True`` the proxy is profiled while running, report is written
+        to ``stderr`` when proxy stops. If a file name is given pstats are dumped to it as well
+
+    :type server_options: dict
+    :param server_options: options of client-facing server, see :func:`listen`
+
+    :type client: tornado.httpclient.AsyncHTTPClient
+    :param client: http client used to fetch target responses, see :func:`create_client`
+
+    :type sampler_factory: callable
+    :param sampler_factory: function creating a ``httpsrvvcr.sampling`` sampler deciding
+        which interactions are recorded, every tape gets its own sampler.
+        Interactions kept by samplers are written when proxy stops
+
+    :type output: object
+    :param output: writer interactions are written to, e.g. :class:`httpsrvvcr.store.TapeStore`,
+        yaml is written to ``stdout`` by default
+
+    :type routes: list
+    :param routes: :class:`Route` objects checked in order before requests
+        are proxied to ``target``
+
+    :type shaper: httpsrvvcr.shaping.ResponseShaper
+    :param shaper: shaper limiting rate and concurrency of responses
     '''
-    vcr_writer = VcrWriter(YamlWriter(sys.stdout, pyyaml), pyjson, no_headers, skip_methods)
-    app = tornado.web.Application([
-        (r'.*', ProxyHandler, dict(httpclient=AsyncHTTPClient(), target=target, writer=vcr_writer))
-    ])
-    app.listen(port)
-    tornado.ioloop.IOLoop.current().start()
+    header_filter = None
+    if keep_headers or drop_headers:
+        header_filter = HeaderFilter(keep_headers, drop_headers)
+    if output is None:
+        output = YamlWriter(sys.stdout, pyyaml)
+    vcr_writer = VcrWriter(
+        output, pyjson, no_headers, skip_methods, share_headers, header_filter,
+        sampler_factory() if sampler_factory else None)
+    vcr_writers = [vcr_writer]
+    route_outputs = []
+    canonicalizer = Canonicalizer(sort_query, ignore_params)
+    if tape:
+        replay_index = load_replay_index(tape, canonicalizer)
+    else:
+        replay_index = ReplayIndex(canonicalizer=canonicalizer)
+    rules = []
+    for route in routes or []:
+        route_writer, route_index = vcr_writer, replay_index
+        if route.output:
+            if mode in (MODE_REPLAY, MODE_RECORD_NEW):
+                route_index = load_replay_index(route.output, canonicalizer)
+            if mode in (MODE_RECORD, MODE_RECORD_NEW):
+                route_outputs.append(open_output(route.output))
+                route_writer = VcrWriter(
+                    route_outputs[-1], pyjson, no_headers, skip_methods, share_headers,
+                    header_filter, sampler_factory() if sampler_factory else None)
+                vcr_writers.append(route_writer)
+        rules.append(tornado.routing.Rule(route.matcher(), ProxyHandler, dict(
+            httpclient=route.client or create_client(), target=route.target,
+            writer=route_writer, mode=mode, replay_index=route_index,
+            coalescer=RequestCoalescer() if coalesce else None, cache=cache,
+            prefix=route.prefix, shaper=shaper)))
+    if target is not None:
+        rules.append((r'.*', ProxyHandler, dict(
+            httpclient=client or AsyncHTTPClient(), target=target, writer=vcr_writer, mode=mode,
+            replay_index=replay_index, coalescer=RequestCoalescer() if coalesce else None,
+            cache=cache, shaper=shaper)))
+    listen(tornado.web.Application(rules), port, **(server_options or {}))
+
+    def flush_outputs():
+        for opened in [output] + route_outputs:
+            flush = getattr(opened, 'flush', None)
+            if flush is not None:
+                flush()
+    # pending interactions reach tapes and stores even while traffic pauses
+    flusher = tornado.ioloop.PeriodicCallback(flush_outputs, OUTPUT_FLUSH_INTERVAL * 1000)
+    flusher.start()
+    profiler = Profiler(None if profile is True else profile) if profile else None
+    try:
+        with profiler or nullcontext():
+            tornado.ioloop.IOLoop.current().start()
+    finally:
+        flusher.stop()
+        for writer in vcr_writers:
+            writer.flush()
+        for route_output in route_outputs:
+            route_output.close()
+        if profiler is not None:
+            profiler.report()
+        if cache is not None:
+            sys.stderr.write('cache: {}\n'.format(pyjson.dumps(cache.stats(), sort_keys=True)))
 
 def stop():
     '''
@@ -220,11 +760,137 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Recording proxy for httpsrv library', prog='python -m httpsrvvcr.recorder')
     parser.add_argument('port', help='port our proxy will be binded to', type=int)
-    parser.add_argument('target', help='destination server URL including protocol', type=str)
+    parser.add_argument('target', help='destination server URL including protocol, '
+                        'may be omitted if every request is routed', type=str, nargs='?')
     parser.add_argument('--no-headers', help='do not record any headers',
                         action='store_const', const=True, default=False)
     parser.add_argument('--skip-methods', help='method to skip, can pass multiple times',
                         type=str, nargs='*', default=[])
+    parser.add_argument('--share-headers', help='record each distinct set of headers once',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--keep-headers', help='record only headers matching these patterns, '
+                        'e.g. Content-* Accept', type=str, nargs='*', default=[])
+    parser.add_argument('--drop-headers', help='do not record headers matching these patterns, '
+                        'e.g. Date Set-Cookie X-Trace-*', type=str, nargs='*', default=[])
+    parser.add_argument('--mode', help='record: forward and record everything (default), '
+                        'replay: serve requests found on --tape, forward the rest, '
+                        'passthrough: forward without recording, '
+                        'record-new: like replay but record forwarded requests',
+                        choices=MODES, default=MODE_RECORD)
+    parser.add_argument('--tape', help='previously recorded tape for replay and record-new modes',
+                        type=str, default=None)
+    parser.add_argument('--coalesce', help='share one target request between identical '
+                        'concurrent GET, HEAD and OPTIONS requests and record it once',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--cache', help='cache target responses for GET and HEAD requests',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--cache-size', help='memory limit for cached responses in megabytes',
+                        type=int, default=64)
+    parser.add_argument('--cache-ttl', help='time in seconds responses are cached',
+                        type=int, default=300)
+    parser.add_argument('--cache-control', help='honor Cache-Control of target responses',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--cache-dir', help='directory to keep cached responses between runs',
+                        type=str, default=None)
+    parser.add_argument('--sort-query', help='ignore order of query parameters '
+                        'when looking requests up on tape',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--ignore-params', help='query parameters to ignore '
+                        'when looking requests up on tape', type=str, nargs='*', default=[])
+    parser.add_argument('--profile', help='profile the proxy and write a report to stderr '
+                        'on exit, pstats are dumped to FILE if given', metavar='FILE',
+                        type=str, nargs='?', const=True, default=False)
+    parser.add_argument('--backlog', help='maximum number of pending client connections',
+                        type=int, default=128)
+    parser.add_argument('--max-buffer-size', help='maximum bytes buffered per client connection',
+                        type=int, default=None)
+    parser.add_argument('--max-body-size', help='maximum request body size in bytes',
+                        type=int, default=None)
+    parser.add_argument('--idle-timeout', help='seconds an idle keep-alive client connection '
+                        'is kept open', type=float, default=None)
+    parser.add_argument('--body-timeout', help='seconds to wait for a request body',
+                        type=float, default=None)
+    parser.add_argument('--xheaders', help='trust X-Real-Ip and X-Scheme headers set by a '
+                        'load balancer in front of the proxy',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--certfile', help='certificate file to accept HTTPS connections with',
+                        type=str, default=None)
+    parser.add_argument('--keyfile', help='private key of --certfile if stored separately',
+                        type=str, default=None)
+    parser.add_argument('--curl', help='fetch target responses with libcurl keeping upstream '
+                        'connections and TLS sessions alive, requires pycurl',
+                        action='store_const', const=True, default=False)
+    parser.add_argument('--max-clients', help='maximum number of concurrent target requests',
+                        type=int, default=10)
+    parser.add_argument('--ca-certs', help='CA certificates to verify target certificate with',
+                        type=str, default=None)
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument('--sample-rate', help='record only this fraction of interactions',
+                          type=float, default=None)
+    sampling.add_argument('--sample-first', help='record only first N interactions '
+                          'of every method and path', metavar='N', type=int, default=None)
+    sampling.add_argument('--sample-reservoir', help='record N random interactions of every '
+                          'method and path, written when proxy stops', metavar='N',
+                          type=int, default=None)
+    parser.add_argument('--store', help='write interactions to a SQLite tape store '
+                        'instead of stdout', type=str, default=None)
+    parser.add_argument('--route', help='MATCH TARGET [TAPE]: proxy requests matching a path '
+                        'prefix or a host name to their own target and record them to their '
+                        'own tape, can pass multiple times', metavar='ARG',
+                        type=str, nargs='+', action='append', default=[])
+    parser.add_argument('--rate', help='stream response bodies at this many bytes per second',
+                        type=int, default=None)
+    parser.add_argument('--path-rate', help='stream responses to paths matching PATTERN at RATE '
+                        'bytes per second instead of --rate, can pass multiple times',
+                        metavar=('PATTERN', 'RATE'), nargs=2, action='append', default=[])
+    parser.add_argument('--concurrency', help='maximum number of responses sent at once, '
+                        'the rest are queued', type=int, default=None)
+    parser.add_argument('--latency', help='seconds every response is delayed by',
+                        type=float, default=0)
     args = parser.parse_args()
-    run(args.port, args.target, args.no_headers, args.skip_methods)
+    if args.target is None and not args.route:
+        parser.error('either target or --route is required')
+    try:
+        routes = [Route.parse(values, create_client(args.curl, args.max_clients, args.ca_certs))
+                  for values in args.route]
+    except ValueError as error:
+        parser.error(str(error))
+    if (args.mode in (MODE_REPLAY, MODE_RECORD_NEW) and not args.tape
+            and not any(route.output for route in routes)):
+        parser.error('--tape or a route with a tape is required in {} mode'.format(args.mode))
+    create_sampler = None
+    if args.sample_rate is not None:
+        create_sampler = functools.partial(RateSampler, args.sample_rate)
+    elif args.sample_first is not None:
+        create_sampler = functools.partial(FirstSampler, args.sample_first)
+    elif args.sample_reservoir is not None:
+        create_sampler = functools.partial(ReservoirSampler, args.sample_reservoir)
+    options = dict(backlog=args.backlog, xheaders=args.xheaders)
+    if args.certfile:
+        options['ssl_options'] = server_ssl_context(args.certfile, args.keyfile)
+    for name, value in [('max_buffer_size', args.max_buffer_size),
+                        ('max_body_size', args.max_body_size),
+                        ('idle_connection_timeout', args.idle_timeout),
+                        ('body_timeout', args.body_timeout)]:
+        if value is not None:
+            options[name] = value
+    response_shaper = None
+    if args.rate or args.path_rate or args.concurrency or args.latency:
+        response_shaper = ResponseShaper(
+            args.rate, args.concurrency, args.latency,
+            [(pattern, int(rate)) for pattern, rate in args.path_rate])
+    response_cache = None
+    if args.cache or args.cache_dir:
+        response_cache = ResponseCache(
+            args.cache_size * 1024 * 1024, args.cache_ttl, args.cache_control, args.cache_dir)
+    # stop on SIGTERM like on Ctrl-C, so pending interactions are written
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        run(args.port, args.target, args.no_headers, args.skip_methods, args.share_headers,
+            args.keep_headers, args.drop_headers, args.mode, args.tape, args.coalesce,
+            response_cache, args.sort_query, args.ignore_params, args.profile, options,
+            create_client(args.curl, args.max_clients, args.ca_certs), create_sampler,
+            TapeStore(args.store) if args.store else None, routes, response_shaper)
+    except KeyboardInterrupt:
+        pass
 
@@ -0,0 +1,129 @@
+'''
+In-memory hash index of recorded responses used by
+``httpsrvvcr.recorder`` to answer requests from an existing tape
+instead of forwarding them to the target
+'''
+
+import json as pyjson
+from collections import namedtuple
+
+from httpsrvvcr.canonical import Canonicalizer
+
+
+# Recorded bodies are re-encoded so original length may not match
+_SKIP_HEADERS = frozenset(['transfer-encoding', 'content-length'])
+
+
+class ReplayResponse(namedtuple('ReplayResponse', 'code headers body')):
+    '''
+    Pre-encoded response ready to be written to a client
+
+    :type code: int
+    :param code: response status code
+
+    :type headers: tuple
+    :param headers: ``(name, value)`` pairs of response headers
+
+    :type body: bytes
+    :param body: encoded response body
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_record(cls, response):
+        '''
+        Encodes a recorded response
+
+        :type response: httpsrvvcr.tape.RecordedResponse
+        :param response: recorded response
+        '''
+        if response.json is not None:
+            body = pyjson.dumps(response.json).encode('utf8')
+        elif response.text:
+            body = response.text.encode('utf8')
+        else:
+            body = b''
+        return cls(response.code, _headers(response.headers), body)
+
+    @classmethod
+    def from_response(cls, response):
+        '''
+        Copies a live response
+
+        :type response: tornado.httpclient.HTTPResponse
+        :param response: response received from the target
+        '''
+        return cls(response.code, _headers(response.headers), response.body or b'')
+
+
+def _headers(headers):
+    return tuple((name, value) for name, value in (headers or {}).items()
+                 if name.lower() not in _SKIP_HEADERS)
+
+
+class ReplayIndex:
+    '''
+    Maps canonical request digests to recorded responses. Request headers
+    are not taken into account. Responses recorded for the same request
+    are served in recording order, the last one is served for any further request
+
+    :type tape: list
+    :param tape: :class:`httpsrvvcr.tape.Interaction` records to index
+
+    :type canonicalizer: httpsrvvcr.canonical.Canonicalizer
+    :param canonicalizer: canonicalizer used to calculate request digests,
+        by default json bodies are compared regardless of key order
+    '''
+    def __init__(self, tape=(), canonicalizer=None):
+        self._canonicalizer = canonicalizer or Canonicalizer()
+        self._responses = {}
+        self._served = {}
+        for action in tape:
+            self.add(action)
+
+    def __len__(self):
+        return sum(len(responses) for responses in self._responses.values())
+
+    def add(self, action):
+        '''
+        Adds a recorded interaction
+
+        :type action: httpsrvvcr.tape.Interaction
+        :param action: interaction to add
+        '''
+        key = self._canonicalizer.recorded_key(action.request)
+        self._responses.setdefault(key, []).append(ReplayResponse.from_record(action.response))
+
+    def add_response(self, request, response):
+        '''
+        Adds a response received from the target
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type response: tornado.httpclient.HTTPResponse
+        :param response: target response
+        '''
+        key = self._key(request)
+        self._responses.setdefault(key, []).append(ReplayResponse.from_response(response))
+
+    def _key(self, request):
+        return self._canonicalizer.incoming_key(request.method, request.uri, request.body)
+
+    def lookup(self, request):
+        '''
+        Finds a response for a request received by the proxy
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :returns: recorded response or ``None``
+        :rtype: ReplayResponse
+        '''
+        key = self._key(request)
+        responses = self._responses.get(key)
+        if not responses:
+            return None
+        served = self._served.get(key, 0)
+        self._served[key] = served + 1
+        return responses[min(served, len(responses) - 1)]
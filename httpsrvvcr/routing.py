@@ -0,0 +1,147 @@
+'''
+Path templates like ``/api/users/{id}`` compiled into a segment trie.
+Finding a template for a path takes time proportional to the number of
+path segments no matter how many templates the router holds
+'''
+
+import re
+
+
+_PLACEHOLDER = re.compile(r'^\{[^/{}]*\}$')
+# segments that look like identifiers: numbers, uuids, long hex strings
+_ID_SEGMENT = re.compile(
+    r'^(\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{16,})$', re.I)
+
+
+def split_path(path):
+    '''
+    Splits path into route part segments and query string
+
+    :type path: str
+    :param path: path including query string
+
+    :returns: ``(segments, query)`` tuple
+    :rtype: tuple
+    '''
+    route, _, query = path.partition('?')
+    return route.split('/'), query
+
+
+def is_template(path):
+    '''
+    Checks if path contains placeholders
+
+    :type path: str
+    :param path: path to check
+    '''
+    return any(_PLACEHOLDER.match(segment) for segment in split_path(path)[0])
+
+
+def derive_template(path, name='id'):
+    '''
+    Derives a template from a path replacing segments that look
+    like identifiers with placeholders, e.g. ``/users/42`` becomes ``/users/{id}``
+
+    :type path: str
+    :param path: path without query string
+
+    :type name: str
+    :param name: placeholder name
+    '''
+    segments = split_path(path)[0]
+    return '/'.join('{' + name + '}' if _ID_SEGMENT.match(segment) else segment
+                    for segment in segments)
+
+
+class _Node:
+    __slots__ = ('children', 'wildcard', 'template')
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.template = None
+
+
+class PathRouter:
+    '''
+    Trie of path templates. Literal segments take precedence over placeholders
+
+    :type templates: list
+    :param templates: templates to add, e.g. ``['/api/users/{id}']``
+
+    :type auto: bool
+    :param auto: if ``True`` paths that don't match any template get a template
+        derived with :func:`derive_template` added on first use
+    '''
+    def __init__(self, templates=None, auto=False):
+        self._root = _Node()
+        self._auto = auto
+        for template in templates or []:
+            self.add(template)
+
+    def add(self, template):
+        '''
+        Adds a template to the router
+
+        :type template: str
+        :param template: path template without query string
+        '''
+        node = self._root
+        for segment in split_path(template)[0]:
+            if _PLACEHOLDER.match(segment):
+                if node.wildcard is None:
+                    node.wildcard = _Node()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(segment, _Node())
+        if node.template is None:
+            node.template = template
+
+    def find(self, path):
+        '''
+        Finds a template for a path
+
+        :type path: str
+        :param path: path, query string is ignored
+
+        :returns: matching template or ``None``
+        :rtype: str
+        '''
+        return self._find(self._root, split_path(path)[0], 0)
+
+    def _find(self, node, segments, position):
+        if position == len(segments):
+            return node.template
+        child = node.children.get(segments[position])
+        if child is not None:
+            found = self._find(child, segments, position + 1)
+            if found is not None:
+                return found
+        if node.wildcard is not None:
+            return self._find(node.wildcard, segments, position + 1)
+        return None
+
+    def template(self, path):
+        '''
+        Returns a template for a path. Paths that are templates themselves
+        are added to the router, in ``auto`` mode templates are derived
+        for paths without one. Otherwise path route part is returned as is
+
+        :type path: str
+        :param path: path, query string is ignored
+
+        :rtype: str
+        '''
+        found = self.find(path)
+        if found is not None:
+            return found
+        route = '/'.join(split_path(path)[0])
+        if is_template(route):
+            self.add(route)
+            return route
+        if self._auto:
+            derived = derive_template(route)
+            if derived != route:
+                self.add(derived)
+                return derived
+        return route
@@ -0,0 +1,152 @@
+'''
+Sampling policies for ``httpsrvvcr.recorder``. Samplers decide which
+interactions are recorded before any body is decoded, so recording
+overhead and tape size stay bounded under heavy load.
+
+Every sampler is offered ``(request, response)`` pairs and returns pairs that
+should be written right away, pairs kept until recording stops are returned
+by ``drain()``
+'''
+
+import random
+from itertools import count
+
+
+def endpoint_key(request):
+    '''
+    Default sampling key, request method and path without query string
+
+    :type request: tornado.httputil.HTTPServerRequest
+    :param request: server request
+    '''
+    return request.method, request.path
+
+
+class RateSampler:
+    '''
+    Records a fixed fraction of interactions
+
+    :type rate: float
+    :param rate: fraction of interactions to record, from 0 to 1
+
+    :type rnd: random.Random
+    :param rnd: random numbers source
+    '''
+    def __init__(self, rate, rnd=None):
+        self._rate = rate
+        self._random = rnd or random.Random()
+
+    def offer(self, request, response):
+        '''
+        Offers an interaction to the sampler
+
+        :type request: tornado.httputil.HTTPServerRequest
+        :param request: server request
+
+        :type response: tornado.httpclient.HTTPResponse
+        :param response: client response
+
+        :returns: list of ``(request, response)`` pairs to write
+        :rtype: list
+        '''
+        if self._random.random() < self._rate:
+            return [(request, response)]
+        return []
+
+    def drain(self):
+        '''
+        Returns interactions kept by the sampler, always empty
+
+        :rtype: list
+        '''
+        return []
+
+
+class FirstSampler:
+    '''
+    Records first ``limit`` interactions of every endpoint
+
+    :type limit: int
+    :param limit: number of interactions recorded per key
+
+    :type key: callable
+    :param key: function calculating sampling key of a request, :func:`endpoint_key` by default
+    '''
+    def __init__(self, limit, key=endpoint_key):
+        self._limit = limit
+        self._key = key
+        self._counts = {}
+
+    def offer(self, request, response):
+        '''
+        Offers an interaction to the sampler, see :func:`RateSampler.offer`
+        '''
+        key = self._key(request)
+        seen = self._counts.get(key, 0)
+        if seen >= self._limit:
+            return []
+        self._counts[key] = seen + 1
+        return [(request, response)]
+
+    def drain(self):
+        '''
+        Returns interactions kept by the sampler, always empty
+
+        :rtype: list
+        '''
+        return []
+
+
+class ReservoirSampler:
+    '''
+    Keeps a uniform random sample of ``size`` interactions of every endpoint.
+    Nothing is written until recording stops, sampled interactions
+    are then returned by :func:`ReservoirSampler.drain` in arrival order
+
+    :type size: int
+    :param size: number of interactions kept per key
+
+    :type key: callable
+    :param key: function calculating sampling key of a request, :func:`endpoint_key` by default
+
+    :type rnd: random.Random
+    :param rnd: random numbers source
+    '''
+    def __init__(self, size, key=endpoint_key, rnd=None):
+        self._size = size
+        self._key = key
+        self._random = rnd or random.Random()
+        self._reservoirs = {}
+        self._seen = {}
+        self._order = count()
+
+    def offer(self, request, response):
+        '''
+        Offers an interaction to the sampler, see :func:`RateSampler.offer`.
+        Interactions are only kept, so nothing is returned
+        '''
+        key = self._key(request)
+        seen = self._seen.get(key, 0) + 1
+        self._seen[key] = seen
+        reservoir = self._reservoirs.setdefault(key, [])
+        item = (next(self._order), request, response)
+        if len(reservoir) < self._size:
+            reservoir.append(item)
+        else:
+            position = self._random.randrange(seen)
+            if position < self._size:
+                reservoir[position] = item
+        return []
+
+    def drain(self):
+        '''
+        Returns sampled interactions in arrival order and empties reservoirs
+
+        :returns: list of ``(request, response)`` pairs
+        :rtype: list
+        '''
+        items = sorted((item for reservoir in self._reservoirs.values() for item in reservoir),
+                       key=lambda item: item[0])
+        self._reservoirs = {}
+        self._seen = {}
+        return [(request, response) for _, request, response in items]
@@ -0,0 +1,105 @@
+'''
+Response shaping for ``httpsrvvcr.recorder``. Responses, usually replayed
+from a tape, are sent at a limited rate with a limited number of them in flight
+and with added latency, so that clients can be tested against an upstream of
+realistic capacity. Everything is done on the IOLoop without blocking threads::
+
+    python -m httpsrvvcr.recorder 8080 http://some-api-url.com/api --mode replay \
+        --tape tape.yaml --rate 65536 --concurrency 4 --latency 0.05
+'''
+
+import re
+import fnmatch
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Semaphore
+
+
+class ResponseShaper:
+    '''
+    Shapes responses sent by :class:`httpsrvvcr.recorder.ProxyHandler`
+
+    :type rate: int
+    :param rate: bytes per second response bodies are streamed at, unlimited if ``None``
+
+    :type concurrency: int
+    :param concurrency: maximum number of responses sent at once, the rest wait in a queue
+
+    :type latency: float
+    :param latency: seconds every response is delayed by before it is sent
+
+    :type path_rates: list
+    :param path_rates: ``(pattern, rate)`` pairs overriding ``rate`` for request paths
+        matching shell-style patterns, e.g. ``('/api/files/*', 8192)``. First match wins
+
+    :type chunk_size: int
+    :param chunk_size: number of bytes written at once when rate is limited
+    '''
+    def __init__(self, rate=None, concurrency=None, latency=0, path_rates=None,
+                 chunk_size=16 * 1024):
+        self._rate = rate
+        self._semaphore = Semaphore(concurrency) if concurrency else None
+        self._latency = latency
+        self._path_rates = [(re.compile(fnmatch.translate(pattern)), path_rate)
+                            for pattern, path_rate in path_rates or []]
+        self._chunk_size = chunk_size
+        self._rates = {}
+
+    def rate(self, path):
+        '''
+        Returns rate a response to a given path is sent at, decisions are cached per path
+
+        :type path: str
+        :param path: request path without query string
+
+        :rtype: int
+        '''
+        if path not in self._rates:
+            self._rates[path] = next(
+                (rate for pattern, rate in self._path_rates if pattern.match(path)), self._rate)
+        return self._rates[path]
+
+    @gen.coroutine
+    def send(self, handler, body):
+        '''
+        Sends response body and finishes a request once the response gets
+        its turn, status and headers must be set by the handler
+
+        :type handler: tornado.web.RequestHandler
+        :param handler: handler of a request
+
+        :type body: bytes
+        :param body: response body
+        '''
+        if self._semaphore is not None:
+            yield self._semaphore.acquire()
+        try:
+            if self._latency:
+                yield gen.sleep(self._latency)
+            rate = self.rate(handler.request.path)
+            if body and rate:
+                yield self._stream(handler, body, rate)
+            elif body:
+                handler.write(body)
+            handler.finish()
+        except StreamClosedError:
+            # client gave up waiting
+            pass
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    @gen.coroutine
+    def _stream(self, handler, body, rate):
+        loop = IOLoop.current()
+        started = loop.time()
+        for offset in range(0, len(body), self._chunk_size):
+            chunk = body[offset:offset + self._chunk_size]
+            # chunk is sent once the rate allows all bytes up to its end
+            delay = started + (offset + len(chunk)) / rate - loop.time()
+            if delay > 0:
+                yield gen.sleep(delay)
+            handler.write(chunk)
+            yield handler.flush()
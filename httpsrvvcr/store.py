@@ -0,0 +1,263 @@
+'''
+SQLite tape store, an alternative to yaml tapes for huge recordings.
+
+Recorder appends interactions in batched transactions to a database in
+WAL mode, player queries interactions on demand by method, path and
+body hash. Database can be queried ad hoc as well, its schema is::
+
+    interactions(id, method, path, body_hash, data)
+    profiles(id, headers)
+
+where ``data`` is the json encoded interaction as it would be written to a yaml
+tape and ``body_hash`` is a sha1 digest of canonical request body,
+see :func:`httpsrvvcr.canonical.Canonicalizer.body`
+'''
+
+import errno
+import json as pyjson
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.tape import PROFILE_KEY, HeaderProfiles, Interaction, is_profile
+
+
+STORE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    body_hash BLOB NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS interactions_request ON interactions (method, path, body_hash);
+CREATE INDEX IF NOT EXISTS interactions_body_hash ON interactions (body_hash);
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    headers TEXT NOT NULL
+);
+'''
+
+# json bodies are hashed regardless of formatting and key order
+_canonicalizer = Canonicalizer()
+
+
+def is_store(tape_path):
+    '''
+    Checks if a tape file name refers to a SQLite store
+
+    :type tape_path: str
+    :param tape_path: tape file name
+    '''
+    return tape_path.endswith(STORE_SUFFIXES)
+
+
+def body_hash(text=None, json=None):
+    '''
+    Calculates request body hash stored along with an interaction
+
+    :type text: str
+    :param text: body text
+
+    :type json: any
+    :param json: parsed json body, has priority over ``text``
+
+    :rtype: bytes
+    '''
+    return hashlib.sha1(_canonicalizer.body(text, json).encode('utf8')).digest()
+
+
+def _connect(path, create):
+    if create:
+        return sqlite3.connect(path, check_same_thread=False)
+    uri = 'file:{}?mode=rw'.format(urllib.parse.quote(os.path.abspath(path)))
+    try:
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    except sqlite3.OperationalError:
+        if os.path.exists(path):
+            raise
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+
+class TapeStore:
+    '''
+    Interactions stored in a SQLite database. Store supports the writer
+    interface of :class:`httpsrvvcr.recorder.VcrWriter`, written items
+    are inserted in batches and committed with :func:`TapeStore.flush`.
+    Header profiles are never redefined, the first definition of an id is kept.
+    Store may be used from several threads
+
+    :type path: str
+    :param path: database file name
+
+    :type batch_size: int
+    :param batch_size: number of items inserted in a single transaction
+
+    :type flush_interval: float
+    :param flush_interval: seconds after which the next written item inserts
+        the batch even if it is not full, the recorder also flushes its
+        outputs periodically so items are not held while traffic pauses
+
+    :type create: bool
+    :param create: create missing database, otherwise :class:`FileNotFoundError`
+        is raised
+    '''
+    def __init__(self, path, batch_size=500, flush_interval=1.0, create=True):
+        self.path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._connection = _connect(path, create)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._pending = []
+        self._pending_profiles = []
+        self._profiles = None
+        self._parsed = {}
+
+    def write(self, items):
+        '''
+        Adds tape items, interactions or header profiles
+
+        :type items: list
+        :param items: tape items as written to a yaml tape
+        '''
+        for item in items:
+            if is_profile(item):
+                self._pending_profiles.append(
+                    (item[PROFILE_KEY], pyjson.dumps(item['headers'])))
+                continue
+            request = item['request']
+            # falsy json bodies match any body in httpsrv just like missing ones
+            digest = body_hash(request.get('text'), request.get('json') or None)
+            self._pending.append((request['method'], request['path'], digest, pyjson.dumps(item)))
+        if (len(self._pending) + len(self._pending_profiles) >= self._batch_size
+                or time.monotonic() - self._flushed >= self._flush_interval):
+            self.flush()
+
+    def flush(self):
+        '''
+        Inserts pending items in a single transaction
+        '''
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO profiles (id, headers) VALUES (?, ?)',
+                self._pending_profiles)
+            self._connection.executemany(
+                'INSERT INTO interactions (method, path, body_hash, data) VALUES (?, ?, ?, ?)',
+                self._pending)
+        if self._pending_profiles:
+            self._profiles = None
+        self._flushed = time.monotonic()
+        self._pending = []
+        self._pending_profiles = []
+
+    def close(self):
+        '''
+        Flushes pending items and closes the database
+        '''
+        self.flush()
+        self._connection.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM interactions')[0][0]
+
+    @property
+    def methods(self):
+        '''
+        Methods of recorded requests
+
+        :rtype: list
+        '''
+        return [method for method, in self._query('SELECT DISTINCT method FROM interactions')]
+
+    def _header_profiles(self):
+        if self._profiles is None:
+            profiles = HeaderProfiles()
+            for profile_id, headers in self._query('SELECT id, headers FROM profiles'):
+                profiles.add({PROFILE_KEY: profile_id, 'headers': pyjson.loads(headers)})
+            self._profiles = profiles
+        return self._profiles
+
+    def ids(self, method, path, digests=None):
+        '''
+        Returns ids of interactions recorded for a request in recording order
+
+        :type method: str
+        :param method: request method
+
+        :type path: str
+        :param path: request path including query string
+
+        :type digests: list
+        :param digests: accepted :func:`body_hash` values, any body matches if omitted
+
+        :rtype: list
+        '''
+        if not digests:
+            rows = self._query('SELECT id FROM interactions WHERE method = ? AND path = ? '
+                               'ORDER BY id', (method, path))
+        else:
+            rows = self._query(
+                'SELECT id FROM interactions WHERE method = ? AND path = ? '
+                'AND body_hash IN ({}) ORDER BY id'.format(', '.join('?' * len(digests))),
+                [method, path] + list(digests))
+        return [interaction_id for interaction_id, in rows]
+
+    def interaction(self, interaction_id):
+        '''
+        Reads an interaction by id, read interactions are cached
+
+        :type interaction_id: int
+        :param interaction_id: interaction id
+
+        :rtype: httpsrvvcr.tape.Interaction
+        '''
+        if interaction_id not in self._parsed:
+            data, = self._query('SELECT data FROM interactions WHERE id = ?', (interaction_id,))[0]
+            self._parsed[interaction_id] = Interaction.from_dict(
+                pyjson.loads(data), self._header_profiles())
+        return self._parsed[interaction_id]
+
+    def lookup(self, method, path):
+        '''
+        Returns all interactions recorded for given method and path
+
+        :type method: str
+        :param method: request method
+
+        :type path: str
+        :param path: request path including query string
+
+        :rtype: list
+        '''
+        return [self.interaction(interaction_id) for interaction_id in self.ids(method, path)]
+
+    def interactions(self):
+        '''
+        Reads all interactions in recording order
+
+        :rtype: generator
+        '''
+        profiles = self._header_profiles()
+        with self._lock:
+            cursor = self._connection.execute('SELECT data FROM interactions ORDER BY id')
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(self._batch_size)
+            if not rows:
+                return
+            for data, in rows:
+                yield Interaction.from_dict(pyjson.loads(data), profiles)
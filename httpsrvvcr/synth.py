@@ -0,0 +1,182 @@
+'''
+Synthetic tape generator. Produces tapes in the same format as
+``httpsrvvcr.recorder`` without a live API, so that tape loading and
+matching can be tested at any scale offline::
+
+    python -m httpsrvvcr.synth 100000 --body-sizes 64:70 4096:25 262144:5 > tape.yaml
+'''
+
+import io
+import sys
+import random
+import argparse
+
+from httpsrvvcr.tape import Interaction, RecordedRequest, RecordedResponse, write_tape
+
+
+_WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit']
+# size of json body without payload string
+_JSON_OVERHEAD = len('{"id": , "name": "", "payload": ""}')
+
+
+def parse_sizes(specs):
+    '''
+    Parses body size distribution given as ``SIZE[:WEIGHT]`` strings,
+    e.g. ``['64:70', '4096:25', '262144:5']``, weight defaults to 1
+
+    :type specs: list
+    :param specs: size specifications
+
+    :returns: list of ``(size, weight)`` tuples
+    :rtype: list
+    '''
+    sizes = []
+    for spec in specs:
+        size, _, weight = spec.partition(':')
+        sizes.append((int(size), float(weight) if weight else 1.0))
+    return sizes
+
+
+class TapeSynthesizer:
+    '''
+    Generates interactions in recorder format. ``GET`` requests fetch
+    ``/api/<endpoint>/<id>`` paths, ``POST`` requests send json bodies
+    to ``/api/<endpoint>``. Generation is deterministic for a given ``seed``
+
+    :type body_sizes: list
+    :param body_sizes: ``(size, weight)`` tuples, response body sizes in bytes
+        are picked with given weights
+
+    :type json_ratio: float
+    :param json_ratio: fraction of json responses, the rest are plain text
+
+    :type header_sets: int
+    :param header_sets: number of distinct header sets used by requests and responses
+
+    :type header_count: int
+    :param header_count: number of extra headers in every set
+
+    :type endpoints: int
+    :param endpoints: number of distinct endpoints
+
+    :type post_ratio: float
+    :param post_ratio: fraction of ``POST`` requests
+
+    :type seed: int
+    :param seed: random seed
+    '''
+    def __init__(self, body_sizes=None, json_ratio=0.8, header_sets=4, header_count=3,
+                 endpoints=10, post_ratio=0.1, seed=None):
+        sizes = body_sizes or [(64, 1.0)]
+        self._sizes = [size for size, _ in sizes]
+        self._weights = [weight for _, weight in sizes]
+        self._json_ratio = json_ratio
+        self._post_ratio = post_ratio
+        self._endpoints = ['resource{}'.format(number) for number in range(max(1, endpoints))]
+        self._request_headers = [
+            _header_set({'Accept': 'application/json'}, 'X-Client', number, header_count)
+            for number in range(max(1, header_sets))]
+        self._response_headers = [
+            _header_set({'Server': 'nginx'}, 'X-Backend', number, header_count)
+            for number in range(max(1, header_sets))]
+        self._random = random.Random(seed)
+
+    def interaction(self, number):
+        '''
+        Generates a single interaction
+
+        :type number: int
+        :param number: interaction number, used as resource id
+
+        :rtype: httpsrvvcr.tape.Interaction
+        '''
+        rnd = self._random
+        endpoint = rnd.choice(self._endpoints)
+        headers_number = rnd.randrange(len(self._request_headers))
+        size = rnd.choices(self._sizes, self._weights)[0]
+        is_json = rnd.random() < self._json_ratio
+        if rnd.random() < self._post_ratio:
+            request = RecordedRequest(
+                'POST', '/api/' + endpoint,
+                dict(self._request_headers[headers_number], **{'Content-Type': 'application/json'}),
+                None, {'name': _text(rnd, 16)})
+            code = 201
+        else:
+            request = RecordedRequest(
+                'GET', '/api/{}/{}'.format(endpoint, number),
+                dict(self._request_headers[headers_number]), None, None)
+            code = 200
+        content_type = 'application/json' if is_json else 'text/plain'
+        headers = dict(self._response_headers[headers_number], **{'Content-Type': content_type})
+        if is_json:
+            payload = 'x' * max(0, size - _JSON_OVERHEAD - len(str(number)) - len(endpoint))
+            response = RecordedResponse(
+                code, headers, None, {'id': number, 'name': endpoint, 'payload': payload})
+        else:
+            response = RecordedResponse(code, headers, _text(rnd, size), None)
+        return Interaction(request, response)
+
+    def interactions(self, count):
+        '''
+        Generates interactions one by one
+
+        :type count: int
+        :param count: number of interactions
+        '''
+        for number in range(count):
+            yield self.interaction(number)
+
+
+def _header_set(base, prefix, number, count):
+    headers = dict(base)
+    for position in range(count):
+        headers['{}-{}'.format(prefix, position)] = 'value-{}-{}'.format(number, position)
+    return headers
+
+
+def _text(rnd, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rnd.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def synth_yaml(count, **kwargs):
+    '''
+    Returns a synthetic tape as a yaml string
+
+    :type count: int
+    :param count: number of interactions
+
+    :param kwargs: :class:`TapeSynthesizer` arguments
+
+    :rtype: str
+    '''
+    stream = io.StringIO()
+    write_tape(stream, TapeSynthesizer(**kwargs).interactions(count))
+    return stream.getvalue()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Synthetic vcr tape generator', prog='python -m httpsrvvcr.synth')
+    parser.add_argument('count', help='number of interactions to generate', type=int)
+    parser.add_argument('--body-sizes', help='response body size distribution as SIZE[:WEIGHT], '
+                        'e.g. 64:70 4096:25 262144:5', type=str, nargs='*', default=['64'])
+    parser.add_argument('--json-ratio', help='fraction of json responses, the rest are text',
+                        type=float, default=0.8)
+    parser.add_argument('--header-sets', help='number of distinct header sets',
+                        type=int, default=4)
+    parser.add_argument('--header-count', help='number of extra headers in every set',
+                        type=int, default=3)
+    parser.add_argument('--endpoints', help='number of distinct endpoints', type=int, default=10)
+    parser.add_argument('--post-ratio', help='fraction of POST requests', type=float, default=0.1)
+    parser.add_argument('--seed', help='random seed', type=int, default=None)
+    args = parser.parse_args()
+    synthesizer = TapeSynthesizer(
+        parse_sizes(args.body_sizes), args.json_ratio, args.header_sets, args.header_count,
+        args.endpoints, args.post_ratio, args.seed)
+    write_tape(sys.stdout, synthesizer.interactions(args.count))
@@ -0,0 +1,359 @@
+'''
+Compact record types for vcr tape interactions shared by
+``httpsrvvcr.recorder``, ``httpsrvvcr.player`` and tape tools.
+
+Tapes are stored in yaml as nested dictionaries, records are the
+in-memory form: immutable tuples without per-instance ``__dict__``,
+with header names, header values and methods interned so that strings
+repeated in every interaction are stored only once.
+
+Tapes may contain header profiles, items like ``{'profile': 'h0', 'headers': {...}}``
+recorded once and referenced by id from ``headers`` of interactions.
+Every profile is resolved to a single shared read-only mapping
+'''
+
+import re
+import sys
+import fnmatch
+from types import MappingProxyType
+from collections import namedtuple
+
+import yaml
+
+
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def load_yaml(yaml_text):
+    '''
+    Parses yaml text using the fastest available safe loader
+
+    :type yaml_text: str
+    :param yaml_text: yaml string or bytes to parse
+    '''
+    return yaml.load(yaml_text, Loader=_Loader)
+
+
+def intern_headers(headers):
+    '''
+    Returns a copy of headers with names and string values interned
+
+    :type headers: dict
+    :param headers: headers to intern, ``None`` is returned as is
+
+    :rtype: dict
+    '''
+    if headers is None:
+        return None
+    return dict((sys.intern(str(name)), _intern_value(value))
+                for name, value in headers.items())
+
+
+def _intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+PROFILE_KEY = 'profile'
+
+
+def is_profile(item):
+    '''
+    Checks if a tape item is a header profile rather than an interaction
+
+    :type item: dict
+    :param item: tape item
+    '''
+    return isinstance(item, dict) and PROFILE_KEY in item
+
+
+class HeaderProfiles:
+    '''
+    Registry of header profiles that resolves profile ids and
+    repeated header dictionaries to shared read-only mappings
+    '''
+    def __init__(self):
+        self._by_id = {}
+        self._by_items = {}
+
+    def add(self, profile):
+        '''
+        Registers a header profile tape item
+
+        :type profile: dict
+        :param profile: ``{'profile': id, 'headers': {...}}`` tape item
+        '''
+        self._by_id[profile[PROFILE_KEY]] = self.share(profile['headers'])
+
+    def share(self, headers):
+        '''
+        Returns a shared read-only mapping equal to given headers
+
+        :type headers: dict
+        :param headers: headers to share, ``None`` is returned as is
+
+        :rtype: types.MappingProxyType
+        '''
+        if headers is None:
+            return None
+        try:
+            key = tuple(sorted(headers.items()))
+            shared = self._by_items.get(key)
+        except TypeError:
+            return MappingProxyType(intern_headers(headers))
+        if shared is None:
+            shared = self._by_items[key] = MappingProxyType(intern_headers(headers))
+        return shared
+
+    def resolve(self, headers):
+        '''
+        Resolves headers of an interaction, which are either
+        a profile id or a dictionary
+
+        :type headers: str or dict
+        :param headers: headers or profile id
+
+        :rtype: types.MappingProxyType
+        '''
+        if isinstance(headers, str):
+            return self._by_id[headers]
+        return self.share(headers)
+
+
+class RecordedRequest(namedtuple('RecordedRequest', 'method path headers text json')):
+    '''
+    Request recorded on a tape
+
+    :type method: str
+    :param method: request method
+
+    :type path: str
+    :param path: request path including query string
+
+    :type headers: dict
+    :param headers: request headers or ``None``
+
+    :type text: str
+    :param text: request body if it is not a json
+
+    :type json: any
+    :param json: parsed json request body
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, request, profiles=None):
+        '''
+        Creates a record from a tape dictionary
+
+        :type request: dict
+        :param request: ``request`` section of a tape interaction
+
+        :type profiles: HeaderProfiles
+        :param profiles: header profiles to resolve headers with
+        '''
+        return cls(sys.intern(request['method']), request['path'],
+                   _headers(request['headers'], profiles), request['text'], request['json'])
+
+    def to_dict(self):
+        '''
+        Converts record to a tape dictionary
+        '''
+        return _to_dict(self)
+
+
+class RecordedResponse(namedtuple('RecordedResponse', 'code headers text json')):
+    '''
+    Response recorded on a tape
+
+    :type code: int
+    :param code: response status code
+
+    :type headers: dict
+    :param headers: response headers or ``None``
+
+    :type text: str
+    :param text: response body if it is not a json
+
+    :type json: any
+    :param json: parsed json response body
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, response, profiles=None):
+        '''
+        Creates a record from a tape dictionary
+
+        :type response: dict
+        :param response: ``response`` section of a tape interaction
+
+        :type profiles: HeaderProfiles
+        :param profiles: header profiles to resolve headers with
+        '''
+        return cls(response['code'], _headers(response['headers'], profiles),
+                   response['text'], response['json'])
+
+    def to_dict(self):
+        '''
+        Converts record to a tape dictionary
+        '''
+        return _to_dict(self)
+
+
+def _headers(headers, profiles):
+    if profiles is None:
+        return intern_headers(headers)
+    return profiles.resolve(headers)
+
+
+def _to_dict(record):
+    output = dict(record._asdict())
+    if output['headers'] is not None:
+        output['headers'] = dict(output['headers'])
+    return output
+
+
+class Interaction(namedtuple('Interaction', 'request response')):
+    '''
+    Single request-response pair recorded on a tape
+
+    :type request: RecordedRequest
+    :param request: recorded request
+
+    :type response: RecordedResponse
+    :param response: recorded response
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, action, profiles=None):
+        '''
+        Creates a record from a tape dictionary, records are returned as is
+
+        :type action: dict
+        :param action: tape interaction with ``request`` and ``response`` keys
+
+        :type profiles: HeaderProfiles
+        :param profiles: header profiles to resolve headers with
+        '''
+        if isinstance(action, cls):
+            return action
+        return cls(RecordedRequest.from_dict(action['request'], profiles),
+                   RecordedResponse.from_dict(action['response'], profiles))
+
+    def to_dict(self):
+        '''
+        Converts record to a tape dictionary
+        '''
+        return {
+            'request': self.request.to_dict(),
+            'response': self.response.to_dict(),
+        }
+
+
+def interactions(tape, profiles=None):
+    '''
+    Yields :class:`Interaction` records for every interaction of a tape
+    resolving header profiles it contains
+
+    :type tape: list
+    :param tape: tape items, dictionaries or records
+
+    :type profiles: HeaderProfiles
+    :param profiles: header profiles to resolve headers with,
+        a new registry is used if omitted
+    '''
+    if profiles is None:
+        profiles = HeaderProfiles()
+    for item in tape:
+        if is_profile(item):
+            profiles.add(item)
+        else:
+            yield Interaction.from_dict(item, profiles)
+
+
+def read_tape(yaml_text):
+    '''
+    Parses yaml tape into a list of :class:`Interaction` records
+
+    :type yaml_text: str
+    :param yaml_text: yaml string to parse
+
+    :rtype: list
+    '''
+    return list(interactions(load_yaml(yaml_text) or []))
+
+
+def write_tape(stream, interactions, batch_size=1000):
+    '''
+    Writes interactions to a stream as a yaml tape. Interactions are
+    dumped in batches so tapes of any size can be written with constant memory
+
+    :type stream: object
+    :param stream: stream supporting ``write(str)``
+
+    :type interactions: iterable
+    :param interactions: :class:`Interaction` records
+
+    :type batch_size: int
+    :param batch_size: number of interactions dumped at once
+    '''
+    batch = []
+    for action in interactions:
+        batch.append(action.to_dict())
+        if len(batch) >= batch_size:
+            _dump(stream, batch)
+            batch = []
+    if batch:
+        _dump(stream, batch)
+
+
+def _dump(stream, batch):
+    stream.write(yaml.dump(batch, Dumper=_Dumper, default_flow_style=False, allow_unicode=True))
+
+
+def _compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns), re.I)
+
+
+class HeaderFilter:
+    '''
+    Decides which headers are recorded using shell-style name patterns,
+    e.g. ``X-Trace-*``. Names are matched case-insensitively and
+    decisions are cached per header name
+
+    :type keep: list
+    :param keep: if given only headers matching one of these patterns are recorded
+
+    :type drop: list
+    :param drop: headers matching one of these patterns are never recorded
+    '''
+    def __init__(self, keep=None, drop=None):
+        self._keep = _compile_patterns(keep)
+        self._drop = _compile_patterns(drop)
+        self._decisions = {}
+
+    def allows(self, name):
+        '''
+        Checks if header with a given name should be recorded
+
+        :type name: str
+        :param name: header name
+        '''
+        if name not in self._decisions:
+            self._decisions[name] = (
+                (self._keep is None or self._keep.match(name) is not None)
+                and (self._drop is None or self._drop.match(name) is None))
+        return self._decisions[name]
+
+    def filter(self, headers):
+        '''
+        Returns a dictionary of headers that should be recorded
+
+        :type headers: dict
+        :param headers: headers to filter
+        '''
+        return dict((name, value) for name, value in headers.items() if self.allows(name))
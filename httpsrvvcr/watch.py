@@ -0,0 +1,147 @@
+'''
+Hot reload of tapes for long-running players. Watched tape files are polled
+for changes, changed tapes are re-read and switched to with :func:`httpsrvvcr.player.Player.switch`,
+so only rules of changed interactions are replaced while the server keeps handling requests::
+
+    watcher = TapeWatcher(player, ['path/to/tape.yaml'])
+    watcher.start()
+
+Tapes are split into top-level items (see :func:`httpsrvvcr.index.split_items`)
+and only items that were not present in the previous version of a file are parsed
+and keyed for the switch.
+
+Rules are registered on the server only by checks made on the thread that calls
+:func:`TapeWatcher.start`, the watching thread just swaps rules of methods played
+already. Interactions of a method that is new to the player are served after
+:func:`TapeWatcher.check` is called on the server thread
+'''
+
+import os
+import sys
+import hashlib
+import threading
+
+from httpsrvvcr.index import parse_item, split_items
+from httpsrvvcr.player import CompiledTape, interaction_key
+from httpsrvvcr.tape import HeaderProfiles, Interaction, is_profile
+
+
+class TapeWatcher:
+    '''
+    Watches tape files and makes a player switch to them when any of them changes
+
+    :type player: httpsrvvcr.player.Player
+    :param player: player tapes are switched on
+
+    :type tape_file_names: list
+    :param tape_file_names: yaml tapes played together
+
+    :type interval: float
+    :param interval: seconds between checks made by the watching thread
+    '''
+    def __init__(self, player, tape_file_names, interval=1.0):
+        self._player = player
+        self._tape_file_names = list(tape_file_names)
+        self._interval = interval
+        self._stats = {}
+        # parsed items of current file versions keyed by item digest
+        self._items = {}
+        # interactions with their keys by digests of profiles preceding them and item digest
+        self._keyed = {}
+        # whether the last switch registered rules of every method
+        self._registered = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def check(self, register=True):
+        '''
+        Reloads tapes if any of them changed since the previous check,
+        the first check always loads them. A registering check also reloads
+        tapes switched to by a check that did not register rules
+
+        :type register: bool
+        :param register: if ``False`` rules are not registered on the server,
+            see :func:`httpsrvvcr.player.Player.switch`
+
+        :returns: number of rules created or ``None`` if nothing changed
+        :rtype: int
+        '''
+        stats = dict((name, _stat(name)) for name in self._tape_file_names)
+        if stats == self._stats and (self._registered or not register):
+            return None
+        # a tape that fails to parse is not retried until it changes again
+        self._stats = stats
+        keyed = []
+        items = {}
+        cache = {}
+        for name in self._tape_file_names:
+            keyed.extend(self._read(name, items, cache))
+        self._items = items
+        self._keyed = cache
+        tape = CompiledTape([action for action, _ in keyed], [key for _, key in keyed])
+        added = self._player.switch(tape, keep_served=True, register=register)
+        self._registered = register
+        return added
+
+    def _read(self, tape_file_name, items, cache):
+        with open(tape_file_name, 'rb') as tape_file:
+            data = tape_file.read()
+        profiles = HeaderProfiles()
+        # headers of an interaction depend on profiles defined before it
+        profiles_digest = b''
+        keyed = []
+        for offset, length in split_items(data):
+            chunk = data[offset:offset + length]
+            digest = hashlib.sha1(chunk).digest()
+            item = items.get(digest) or self._items.get(digest)
+            if item is None:
+                item = parse_item(chunk)
+            items[digest] = item
+            if is_profile(item):
+                profiles.add(item)
+                profiles_digest = hashlib.sha1(profiles_digest + digest).digest()
+                continue
+            cache_key = (profiles_digest, digest)
+            entry = cache.get(cache_key) or self._keyed.get(cache_key)
+            if entry is None:
+                action = Interaction.from_dict(item, profiles)
+                entry = (action, interaction_key(action))
+            cache[cache_key] = entry
+            keyed.append(entry)
+        return keyed
+
+    def start(self):
+        '''
+        Loads tapes and starts a daemon thread checking them every ``interval`` seconds,
+        rules are registered on the calling thread
+
+        :rtype: TapeWatcher
+        '''
+        self.check()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stops the watching thread
+        '''
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                # httpsrv is not thread-safe, methods are registered by the server thread only
+                self.check(register=False)
+            except Exception as error:
+                # tape being written may be incomplete, previous rules are kept
+                sys.stderr.write('Failed to reload tapes: {}\n'.format(error))
+
+
+def _stat(tape_file_name):
+    stat = os.stat(tape_file_name)
+    return stat.st_mtime_ns, stat.st_size
@@ -34,13 +34,12 @@ setup(
         'Topic :: Software Development :: Testing',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
     ],
     keywords='api http mock testing vcr',
     install_requires=['tornado', 'pyyaml', 'httpsrv'],
     extras_require={
         'test': ['requests'],
+        'curl': ['pycurl'],
     },
 )
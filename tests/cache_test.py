@@ -0,0 +1,123 @@
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from httpsrvvcr.cache import ResponseCache
+
+
+def request_mock(uri='/', method='GET'):
+    request = Mock()
+    request.method = method
+    request.uri = uri
+    request.headers = {'Accept': 'application/json'}
+    request.body = None
+    return request
+
+
+def response_mock(code=200, body=b'Response body', headers=None):
+    response = Mock()
+    response.code = code
+    response.body = body
+    response.headers = headers or {'Content-Type': 'text/plain'}
+    return response
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = ResponseCache(ttl=10, clock=self.clock)
+
+    def test_should_return_cached_response(self):
+        self.cache.put(request_mock(), response_mock())
+        cached = self.cache.get(request_mock())
+        self.assertEqual(cached.code, 200)
+        self.assertEqual(cached.body, b'Response body')
+        self.assertEqual(cached.headers['Content-Type'], 'text/plain')
+
+    def test_should_count_hits_and_misses(self):
+        self.cache.get(request_mock())
+        self.cache.put(request_mock(), response_mock())
+        self.cache.get(request_mock())
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_should_expire_responses(self):
+        self.cache.put(request_mock(), response_mock())
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get(request_mock()))
+
+    def test_should_not_cache_post(self):
+        self.cache.put(request_mock(method='POST'), response_mock())
+        self.assertIsNone(self.cache.get(request_mock(method='POST')))
+
+    def test_should_not_cache_server_errors(self):
+        self.cache.put(request_mock(), response_mock(code=500))
+        self.assertIsNone(self.cache.get(request_mock()))
+
+    def test_should_distinguish_relevant_headers(self):
+        self.cache.put(request_mock(), response_mock())
+        other = request_mock()
+        other.headers = {'Accept': 'text/plain'}
+        self.assertIsNone(self.cache.get(other))
+
+    def test_should_distinguish_targets(self):
+        self.cache.put(request_mock(), response_mock(), 'http://a.local')
+        self.assertIsNone(self.cache.get(request_mock(), 'http://b.local'))
+        self.assertIsNotNone(self.cache.get(request_mock(), 'http://a.local'))
+
+    def test_should_evict_least_recently_used(self):
+        cache = ResponseCache(max_bytes=1200, clock=self.clock)
+        cache.put(request_mock('/a'), response_mock())
+        cache.put(request_mock('/b'), response_mock())
+        cache.get(request_mock('/a'))
+        cache.put(request_mock('/c'), response_mock())
+        self.assertIsNotNone(cache.get(request_mock('/a')))
+        self.assertIsNone(cache.get(request_mock('/b')))
+        self.assertLessEqual(cache.stats()['bytes'], 1200)
+
+    def test_should_honor_cache_control(self):
+        cache = ResponseCache(ttl=10, respect_cache_control=True, clock=self.clock)
+        cache.put(request_mock('/a'), response_mock(headers={'Cache-Control': 'no-store'}))
+        cache.put(request_mock('/b'), response_mock(headers={'Cache-Control': 'max-age=60'}))
+        self.clock.now += 30
+        self.assertIsNone(cache.get(request_mock('/a')))
+        self.assertIsNotNone(cache.get(request_mock('/b')))
+
+
+class DiskResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_read_responses_cached_by_other_session(self):
+        ResponseCache(directory=self.directory, clock=self.clock).put(
+            request_mock(), response_mock())
+        cache = ResponseCache(directory=self.directory, clock=self.clock)
+        cached = cache.get(request_mock())
+        self.assertEqual(cached.body, b'Response body')
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+
+    def test_should_not_read_responses_of_other_target(self):
+        ResponseCache(directory=self.directory, clock=self.clock).put(
+            request_mock(), response_mock(), 'http://a.local')
+        cache = ResponseCache(directory=self.directory, clock=self.clock)
+        self.assertIsNone(cache.get(request_mock(), 'http://b.local'))
+
+    def test_should_expire_responses_on_disk(self):
+        ResponseCache(ttl=10, directory=self.directory, clock=self.clock).put(
+            request_mock(), response_mock())
+        self.clock.now += 10
+        cache = ResponseCache(directory=self.directory, clock=self.clock)
+        self.assertIsNone(cache.get(request_mock()))
@@ -0,0 +1,46 @@
+import unittest
+
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.tape import RecordedRequest
+
+
+class CanonicalizerTest(unittest.TestCase):
+    def test_should_keep_path_by_default(self):
+        self.assertEqual(Canonicalizer().path('/users?b=2&a=1'), '/users?b=2&a=1')
+
+    def test_should_sort_query(self):
+        canonicalizer = Canonicalizer(sort_query=True)
+        self.assertEqual(canonicalizer.path('/users?b=2&a=1&a=0'), '/users?a=0&a=1&b=2')
+
+    def test_should_drop_ignored_params(self):
+        canonicalizer = Canonicalizer(ignore_params=['_'])
+        self.assertEqual(canonicalizer.path('/users?_=123&name=John'), '/users?name=John')
+
+    def test_should_keep_blank_params(self):
+        canonicalizer = Canonicalizer(sort_query=True)
+        self.assertEqual(canonicalizer.path('/users?flag'), '/users?flag=')
+
+    def test_should_canonicalize_json(self):
+        canonicalizer = Canonicalizer()
+        self.assertEqual(canonicalizer.body(json={'b': 1, 'a': 2}),
+                         canonicalizer.body('{"a": 2,\n "b": 1}'))
+
+    def test_should_keep_text(self):
+        self.assertEqual(Canonicalizer().body('Hello'), 'Hello')
+
+    def test_should_compare_json_as_is(self):
+        canonicalizer = Canonicalizer(canonical_json=False)
+        self.assertNotEqual(canonicalizer.body(json={'b': 1, 'a': 2}),
+                            canonicalizer.body('{"a": 2, "b": 1}'))
+
+    def test_should_match_recorded_and_incoming_keys(self):
+        canonicalizer = Canonicalizer(sort_query=True, ignore_params=['_'])
+        request = RecordedRequest('POST', '/users?b=2&a=1', None, None, {'name': 'John'})
+        self.assertEqual(
+            canonicalizer.recorded_key(request),
+            canonicalizer.incoming_key('POST', '/users?a=1&_=42&b=2', b'{"name":"John"}'))
+
+    def test_should_distinguish_methods(self):
+        canonicalizer = Canonicalizer()
+        self.assertNotEqual(canonicalizer.incoming_key('GET', '/', None),
+                            canonicalizer.incoming_key('POST', '/', None))
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from httpsrvvcr import diff
+from httpsrvvcr.tape import HeaderFilter
+
+
+def tape_text(*interactions):
+    return ''.join(
+        '- request:\n    headers:\n      Accept: text/plain\n    json: null\n'
+        '    method: GET\n    path: {}\n    text: null\n'
+        '  response:\n    code: {}\n    headers:\n      Date: {}\n'
+        '    json: null\n    text: {}\n'.format(path, code, date, text)
+        for path, code, text, date in interactions)
+
+
+PROFILE_TAPE = (
+    '- headers:\n    Accept: text/plain\n  profile: h0\n'
+    '- request:\n    headers: h0\n    json: null\n    method: GET\n    path: /a\n'
+    '    text: null\n  response:\n    code: 200\n    headers: null\n'
+    '    json: null\n    text: a\n')
+
+
+class TapeDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.readers = []
+
+    def tearDown(self):
+        for reader in self.readers:
+            reader.close()
+        shutil.rmtree(self.directory)
+
+    def reader(self, name, text):
+        tape_path = os.path.join(self.directory, name)
+        with open(tape_path, 'w', encoding='utf8') as tape_file:
+            tape_file.write(text)
+        reader = diff.TapeReader(tape_path)
+        self.readers.append(reader)
+        return reader
+
+    def changes(self, old_text, new_text, comparer=None):
+        return [diff.format_change(*change) for change in (comparer or diff.TapeComparer()).diff(
+            self.reader('old.yaml', old_text), self.reader('new.yaml', new_text))]
+
+    def test_should_report_added_changed_and_removed(self):
+        old = tape_text(('/a', 200, 'a', 'Mon'), ('/b', 200, 'b', 'Mon'), ('/c', 200, 'c', 'Mon'))
+        new = tape_text(('/b', 500, 'b', 'Mon'), ('/c', 200, 'c', 'Mon'), ('/d', 200, 'd', 'Mon'))
+        self.assertEqual(self.changes(old, new), ['~ GET /b 200 -> 500', '+ GET /d', '- GET /a'])
+
+    def test_should_ignore_volatile_headers(self):
+        old = tape_text(('/a', 200, 'a', 'Mon'))
+        new = tape_text(('/a', 200, 'a', 'Tue'))
+        self.assertEqual(self.changes(old, new), [])
+
+    def test_should_compare_headers_unless_dropped(self):
+        old = tape_text(('/a', 200, 'a', 'Mon'))
+        new = tape_text(('/a', 200, 'a', 'Tue'))
+        comparer = diff.TapeComparer(header_filter=HeaderFilter())
+        self.assertEqual(self.changes(old, new, comparer), ['~ GET /a'])
+
+    def test_should_compare_json_regardless_of_key_order(self):
+        old = tape_text(('/a', 200, '\'{"a": 1, "b": 2}\'', 'Mon'))
+        new = tape_text(('/a', 200, '\'{"b":2,"a":1}\'', 'Mon'))
+        self.assertEqual(self.changes(old, new), [])
+
+    def test_should_cancel_equal_interactions_with_and_without_profiles(self):
+        old = tape_text(('/a', 200, 'first', 'Mon'), ('/a', 200, 'second', 'Mon'))
+        new = tape_text(('/a', 200, 'second', 'Mon'))
+        profile = '- headers:\n    Accept: text/plain\n  profile: h0\n'
+        self.assertEqual(self.changes(old, new), ['- GET /a'])
+        changes = diff.TapeComparer().diff(self.reader('old_profiles.yaml', profile + old),
+                                           self.reader('new_profiles.yaml', profile + new))
+        self.assertEqual([diff.format_change(*change) for change in changes], ['- GET /a'])
+
+    def test_should_pair_rest_of_repeated_requests_in_order(self):
+        old = tape_text(('/a', 200, 'first', 'Mon'), ('/a', 200, 'second', 'Mon'))
+        new = tape_text(('/a', 200, 'first', 'Mon'), ('/a', 200, 'changed', 'Mon'),
+                        ('/a', 200, 'third', 'Mon'))
+        self.assertEqual(self.changes(old, new), ['~ GET /a', '+ GET /a'])
+
+    def test_should_resolve_header_profiles(self):
+        plain = tape_text(('/a', 200, 'a', 'Mon')).replace('    headers:\n      Date: Mon\n',
+                                                           '    headers: null\n')
+        self.assertEqual(self.changes(PROFILE_TAPE, plain), [])
+
+    def test_should_not_parse_identical_items(self):
+        text = tape_text(('/a', 200, 'a', 'Mon'), ('/b', 200, 'b', 'Mon'))
+        old, new = self.reader('old.yaml', text), self.reader('new.yaml', text)
+        parsed = []
+        items = new.items
+        new.items = lambda skip=None: (parsed.append(item) or (offset, length, item)
+                                       for offset, length, item in items(skip))
+        self.assertEqual(list(diff.TapeComparer().diff(old, new)), [])
+        self.assertEqual(parsed, [])
+
+    def test_should_read_empty_tape(self):
+        self.assertEqual(self.changes('', tape_text(('/a', 200, 'a', 'Mon'))), ['+ GET /a'])
@@ -0,0 +1,192 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import Mock
+
+from httpsrvvcr import index
+from httpsrvvcr.player import Player
+
+
+TAPE_PATH = os.path.join(os.path.dirname(__file__), 'tape.yaml')
+
+
+class SplitItemsTest(unittest.TestCase):
+    def test_should_split_top_level_items(self):
+        data = b'- request:\n    a: 1\n    b:\n    - 2\n- request:\n    a: 3\n'
+        self.assertEqual(list(index.split_items(data)), [(0, 35), (35, 20)])
+
+    def test_should_split_empty_tape(self):
+        self.assertEqual(list(index.split_items(b'')), [])
+
+
+class TapeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tape_path = os.path.join(self.directory, 'tape.yaml')
+        shutil.copy(TAPE_PATH, self.tape_path)
+        self.index = index.TapeIndex.open(self.tape_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_should_write_index_next_to_tape(self):
+        self.assertTrue(os.path.exists(self.tape_path + '.idx'))
+
+    def test_should_count_interactions(self):
+        self.assertEqual(len(self.index), 2)
+
+    def test_should_store_methods(self):
+        self.assertEqual(self.index.methods, ['POST'])
+
+    def test_should_lookup_interactions_in_order(self):
+        found = self.index.lookup('POST', '/api/users')
+        self.assertEqual([action.response.json['id'] for action in found], [42, 43])
+
+    def test_should_not_find_unknown_path(self):
+        self.assertEqual(self.index.lookup('GET', '/api/users'), [])
+
+    def test_should_rebuild_stale_index(self):
+        with open(self.tape_path, 'a', encoding='utf8') as tape_file:
+            tape_file.write(
+                '- request:\n    path: /api/ping\n    method: GET\n'
+                '    headers: null\n    text: null\n    json: null\n'
+                '  response:\n    code: 204\n    headers: null\n'
+                '    text: null\n    json: null\n')
+        reopened = index.TapeIndex.open(self.tape_path)
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(reopened.lookup('GET', '/api/ping')[0].response.code, 204)
+        reopened.close()
+
+
+def _open_compiled(tape_path):
+    compiled = index.TapeIndex.open(tape_path, compiled=True)
+    try:
+        return [action.response.json['id'] for action in compiled.lookup('POST', '/api/users')]
+    finally:
+        compiled.close()
+
+
+class CompiledTapeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tape_path = os.path.join(self.directory, 'tape.yaml')
+        shutil.copy(TAPE_PATH, self.tape_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_write_compiled_tape_next_to_tape(self):
+        self.assertEqual(_open_compiled(self.tape_path), [42, 43])
+        self.assertTrue(os.path.exists(self.tape_path + '.hvc'))
+        self.assertFalse(os.path.exists(self.tape_path + '.idx'))
+
+    def test_should_reuse_fresh_compiled_tape(self):
+        index.TapeIndex.open(self.tape_path, compiled=True).close()
+        built = os.stat(self.tape_path + '.hvc').st_mtime_ns
+        index.TapeIndex.open(self.tape_path, compiled=True).close()
+        self.assertEqual(os.stat(self.tape_path + '.hvc').st_mtime_ns, built)
+
+    def test_should_resolve_profiles(self):
+        with open(self.tape_path, 'w', encoding='utf8') as tape_file:
+            tape_file.write(
+                '- headers:\n    Accept: text/plain\n  profile: h0\n'
+                '- request:\n    path: /api/ping\n    method: GET\n'
+                '    headers: h0\n    text: null\n    json: null\n'
+                '  response:\n    code: 204\n    headers: h0\n'
+                '    text: null\n    json: null\n')
+        compiled = index.TapeIndex.open(self.tape_path, compiled=True)
+        action, = compiled.lookup('GET', '/api/ping')
+        self.assertEqual(action.request.headers, {'Accept': 'text/plain'})
+        self.assertEqual(len(compiled), 1)
+        compiled.close()
+
+    def test_should_share_compiled_tape_between_processes(self):
+        with ProcessPoolExecutor(4) as executor:
+            results = list(executor.map(_open_compiled, [self.tape_path] * 8))
+        self.assertEqual(results, [[42, 43]] * 8)
+        leftovers = [name for name in os.listdir(self.directory) if name.endswith('.tmp')]
+        self.assertEqual(leftovers, [])
+
+
+class ProfiledTapeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tape_path = os.path.join(self.directory, 'tape.yaml')
+        with open(self.tape_path, 'w', encoding='utf8') as tape_file:
+            tape_file.write(
+                '- headers:\n    Accept: text/plain\n  profile: h0\n'
+                '- request:\n    path: /api/ping\n    method: GET\n'
+                '    headers: h0\n    text: null\n    json: null\n'
+                '  response:\n    code: 204\n    headers: h0\n'
+                '    text: null\n    json: null\n')
+        self.index = index.TapeIndex.open(self.tape_path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def test_should_not_count_profiles(self):
+        self.assertEqual(len(self.index), 1)
+
+    def test_should_resolve_profiles(self):
+        action = self.index.lookup('GET', '/api/ping')[0]
+        self.assertEqual(action.request.headers, {'Accept': 'text/plain'})
+        self.assertIs(action.request.headers, action.response.headers)
+
+
+class PlayIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.rule = Mock(method='POST')
+        self.server = Mock()
+        self.server.always = Mock(return_value=self.rule)
+        self.player = Player(self.server)
+        self.index = Mock()
+        self.index.methods = ['POST']
+        self.index.offsets = Mock(return_value=[(0, 1)])
+        self.index.interaction = Mock(return_value={
+            'request': {
+                'path': '/api/users',
+                'method': 'POST',
+                'headers': None,
+                'text': 'hello',
+                'json': None,
+            },
+            'response': {
+                'code': 201,
+                'headers': None,
+                'text': 'created',
+                'json': None,
+            }
+        })
+
+    def test_should_register_rule_per_method(self):
+        self.player.play_index(self.index)
+        self.server.always.assert_called_once_with('POST')
+
+    def test_should_resolve_response_on_demand(self):
+        self.player.play_index(self.index)
+        self.assertFalse(self.index.interaction.called)
+        self.assertTrue(self.rule.matches('POST', '/api/users', {}, b'hello'))
+        self.assertEqual(self.rule.response.code, 201)
+        self.assertEqual(self.rule.response.bytes, b'created')
+
+    def test_should_not_match_different_body(self):
+        self.player.play_index(self.index)
+        self.assertFalse(self.rule.matches('POST', '/api/users', {}, b'bye'))
+
+    def test_should_ask_indexes_of_one_method_in_turn(self):
+        self.server._always_rules = [self.rule]
+        self.player.play_index(self.index)
+        self.player.play_index(self.index)
+        self.server.always.assert_called_once_with('POST')
+        self.assertTrue(self.rule.matches('POST', '/api/users', {}, b'hello'))
+        self.assertTrue(self.rule.matches('POST', '/api/users', {}, b'hello'))
+        self.assertFalse(self.rule.matches('POST', '/api/users', {}, b'hello'))
+
+    def test_should_serve_interaction_once(self):
+        self.player.play_index(self.index)
+        self.assertTrue(self.rule.matches('POST', '/api/users', {}, b'hello'))
+        self.assertFalse(self.rule.matches('POST', '/api/users', {}, b'hello'))
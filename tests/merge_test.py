@@ -0,0 +1,70 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from httpsrvvcr import merge
+from httpsrvvcr.diff import TapeComparer, TapeReader
+from httpsrvvcr.tape import read_tape
+
+
+def tape_text(*interactions):
+    return ''.join(
+        '- request:\n    headers:\n      Accept: text/plain\n    json: null\n'
+        '    method: GET\n    path: {}\n    text: null\n'
+        '  response:\n    code: {}\n    headers:\n      Date: {}\n'
+        '    json: null\n    text: {}\n'.format(path, code, date, text)
+        for path, code, text, date in interactions)
+
+
+PROFILE_TAPE = (
+    '- headers:\n    Accept: text/plain\n  profile: h0\n'
+    '- request:\n    headers: h0\n    json: null\n    method: GET\n    path: /a\n'
+    '    text: null\n  response:\n    code: 200\n    headers: null\n'
+    '    json: null\n    text: a\n')
+
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.readers = []
+
+    def tearDown(self):
+        for reader in self.readers:
+            reader.close()
+        shutil.rmtree(self.directory)
+
+    def merged(self, *texts, prefer=merge.PREFER_LAST):
+        for number, text in enumerate(texts):
+            tape_path = os.path.join(self.directory, '{}.yaml'.format(number))
+            with open(tape_path, 'w', encoding='utf8') as tape_file:
+                tape_file.write(text)
+            self.readers.append(TapeReader(tape_path))
+        stream = io.StringIO()
+        merge.write_merged(stream, merge.merge(TapeComparer(), self.readers, prefer))
+        return [(action.request.path, action.response.text)
+                for action in read_tape(stream.getvalue())]
+
+    def test_should_prefer_last_tape(self):
+        self.assertEqual(self.merged(
+            tape_text(('/a', 200, 'old', 'Mon'), ('/b', 200, 'b', 'Mon')),
+            tape_text(('/c', 200, 'c', 'Mon'), ('/a', 200, 'new', 'Mon'))),
+            [('/a', 'new'), ('/b', 'b'), ('/c', 'c')])
+
+    def test_should_prefer_first_tape(self):
+        self.assertEqual(self.merged(
+            tape_text(('/a', 200, 'old', 'Mon')),
+            tape_text(('/a', 200, 'new', 'Mon'), ('/b', 200, 'b', 'Mon')),
+            prefer=merge.PREFER_FIRST),
+            [('/a', 'old'), ('/b', 'b')])
+
+    def test_should_keep_repeated_requests(self):
+        self.assertEqual(self.merged(
+            tape_text(('/a', 200, 'first', 'Mon')),
+            tape_text(('/a', 200, 'first', 'Mon'), ('/a', 200, 'second', 'Mon'))),
+            [('/a', 'first'), ('/a', 'second')])
+
+    def test_should_resolve_header_profiles(self):
+        merged = self.merged(PROFILE_TAPE, tape_text(('/b', 200, 'b', 'Mon')))
+        self.assertEqual(merged, [('/a', 'a'), ('/b', 'b')])
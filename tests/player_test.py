@@ -1,7 +1,13 @@
+import os
+import asyncio
+import tempfile
 import unittest
-from unittest.mock import Mock, call
+from unittest.mock import Mock, MagicMock, call
 
-from httpsrvvcr.player import Player, tape_from_yaml
+from httpsrvvcr.player import CompiledTape, Player, tape_from_yaml
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.routing import PathRouter
+from httpsrvvcr.store import TapeStore
 
 
 class PlayerTest(unittest.TestCase):
@@ -140,6 +146,13 @@ class PlayerTest(unittest.TestCase):
             }),
         ])
 
+    def test_should_profile_play(self):
+        player = Player(self.server)
+        player._profiler = MagicMock()
+        player.play(self.tape)
+        player._profiler.__enter__.assert_called_once_with()
+        player._profiler.__exit__.assert_called_once_with(None, None, None)
+
     def test_should_create_properly_named_decorator(self):
         @self.player.load('foo')
         def some_wrapped():
@@ -147,6 +160,324 @@ class PlayerTest(unittest.TestCase):
 
         self.assertEqual(some_wrapped.__name__, 'some_wrapped')
 
+    def test_should_create_coroutine_decorator(self):
+        @self.player.load('foo')
+        async def some_wrapped():
+            pass
+
+        self.assertEqual(some_wrapped.__name__, 'some_wrapped')
+        self.assertTrue(asyncio.iscoroutinefunction(some_wrapped))
+
+
+class CanonicalPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.tape = [{
+            'request': {
+                'path': '/api/users?b=2&a=1',
+                'method': 'POST',
+                'headers': {'Accept': 'application/json'},
+                'text': None,
+                'json': {'name': 'John', 'last_name': 'Doe'},
+            },
+            'response': {
+                'code': 201,
+                'headers': None,
+                'text': 'created',
+                'json': None,
+            }
+        }]
+        self.rule = Mock(method='POST')
+        self.server = Mock()
+        self.server.always = Mock(return_value=self.rule)
+        self.player = Player(self.server, canonicalizer=Canonicalizer(sort_query=True))
+
+    def test_should_register_rule_per_method(self):
+        self.player.play(self.tape)
+        self.server.always.assert_called_once_with('POST')
+        self.assertFalse(self.server.on.called)
+
+    def test_should_match_canonical_request(self):
+        self.player.play(self.tape)
+        self.assertTrue(self.rule.matches(
+            'POST', '/api/users?a=1&b=2', {'Accept': 'application/json'},
+            b'{"last_name": "Doe", "name": "John"}'))
+        self.assertEqual(self.rule.response.code, 201)
+
+    def test_should_check_recorded_headers(self):
+        self.player.play(self.tape)
+        self.assertFalse(self.rule.matches(
+            'POST', '/api/users?a=1&b=2', {}, b'{"last_name": "Doe", "name": "John"}'))
+
+    def test_should_add_tapes_to_one_table_until_reset(self):
+        self.server._always_rules = [self.rule]
+        self.player.play(self.tape)
+        self.player.play(self.tape)
+        self.server.always.assert_called_once_with('POST')
+        args = ('POST', '/api/users?a=1&b=2', {'Accept': 'application/json'},
+                b'{"last_name": "Doe", "name": "John"}')
+        self.assertTrue(self.rule.matches(*args))
+        self.assertTrue(self.rule.matches(*args))
+        self.assertFalse(self.rule.matches(*args))
+        self.server._always_rules.clear()
+        self.player.play(self.tape)
+        self.assertEqual(self.server.always.call_count, 2)
+        self.assertTrue(self.rule.matches(*args))
+        self.assertFalse(self.rule.matches(*args))
+
+    def test_should_serve_rule_once(self):
+        self.player.play(self.tape)
+        args = ('POST', '/api/users?a=1&b=2', {'Accept': 'application/json'},
+                b'{"last_name": "Doe", "name": "John"}')
+        self.assertTrue(self.rule.matches(*args))
+        self.assertFalse(self.rule.matches(*args))
+
+
+class StorePlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = TapeStore(os.path.join(self.directory.name, 'tape.db'))
+        self.store.write([{
+            'request': {
+                'path': '/api/users',
+                'method': method,
+                'headers': {'Accept': 'application/json'},
+                'text': None,
+                'json': json,
+            },
+            'response': {'code': code, 'headers': None, 'text': 'ok', 'json': None},
+        } for method, json, code in [('POST', {'name': 'John'}, 201),
+                                     ('POST', {'name': 'Jane'}, 202),
+                                     ('GET', None, 200)]])
+        self.store.flush()
+        self.rules = {}
+        self.server = Mock()
+        self.server.always = Mock(
+            side_effect=lambda method: self.rules.setdefault(method, Mock(method=method)))
+        self.player = Player(self.server)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_should_not_create_missing_store(self):
+        missing = os.path.join(self.directory.name, 'missing.db')
+        with self.assertRaises(FileNotFoundError):
+            self.player.load(missing)(lambda: None)()
+        self.assertFalse(os.path.exists(missing))
+
+    def test_should_register_rule_per_method(self):
+        self.player.play_store(self.store)
+        self.assertEqual(sorted(self.rules), ['GET', 'POST'])
+
+    def test_should_match_request_by_body(self):
+        self.player.play_store(self.store)
+        rule = self.rules['POST']
+        self.assertTrue(rule.matches('POST', '/api/users', {'Accept': 'application/json'},
+                                     b'{"name": "Jane"}'))
+        self.assertEqual(rule.response.code, 202)
+
+    def test_should_match_recorded_request_without_body_with_any_body(self):
+        self.player.play_store(self.store)
+        self.assertTrue(self.rules['GET'].matches(
+            'GET', '/api/users', {'Accept': 'application/json'}, b'ignored'))
+
+    def test_should_leave_requests_of_other_methods_to_their_rules(self):
+        self.player.play_store(self.store)
+        args = ('GET', '/api/users', {'Accept': 'application/json'}, None)
+        self.assertFalse(self.rules['POST'].matches(*args))
+        self.assertTrue(self.rules['GET'].matches(*args))
+
+    def test_should_serve_interaction_once(self):
+        self.player.play_store(self.store)
+        args = ('POST', '/api/users', {'Accept': 'application/json'}, b'{"name": "John"}')
+        self.assertTrue(self.rules['POST'].matches(*args))
+        self.assertFalse(self.rules['POST'].matches(*args))
+
+
+def _action(path, code=200):
+    return {
+        'request': {'path': path, 'method': 'GET', 'headers': {}, 'text': None, 'json': None},
+        'response': {'code': code, 'headers': None, 'text': 'ok', 'json': None},
+    }
+
+
+class SwitchPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.rule = Mock(method='GET')
+        self.server = Mock()
+        self.server.always = Mock(return_value=self.rule)
+        self.server._always_rules = [self.rule]
+        self.player = Player(self.server)
+
+    def matches(self, path):
+        return self.rule.matches('GET', path, {}, None)
+
+    def test_should_register_rule_per_method_once(self):
+        self.player.switch([_action('/a')])
+        self.player.switch([_action('/b')])
+        self.server.always.assert_called_once_with('GET')
+
+    def test_should_register_rule_again_after_reset(self):
+        self.player.switch([_action('/a')])
+        self.server._always_rules.clear()
+        self.player.switch([_action('/a')])
+        self.assertEqual(self.server.always.call_count, 2)
+        self.assertTrue(self.matches('/a'))
+
+    def test_should_create_rules_for_difference_only(self):
+        self.assertEqual(self.player.switch([_action('/a'), _action('/b')]), 2)
+        self.assertEqual(self.player.switch([_action('/b'), _action('/c')]), 1)
+
+    def test_should_drop_rules_of_previous_tape(self):
+        self.player.switch([_action('/a')])
+        self.player.switch([_action('/b')])
+        self.assertFalse(self.matches('/a'))
+        self.assertTrue(self.matches('/b'))
+
+    def test_should_make_served_rules_available_after_switch(self):
+        tape = CompiledTape([_action('/a')])
+        self.player.switch(tape)
+        self.assertTrue(self.matches('/a'))
+        self.assertFalse(self.matches('/a'))
+        self.assertEqual(self.player.switch(tape), 0)
+        self.assertTrue(self.matches('/a'))
+
+    def test_should_serve_repeated_interactions_in_order(self):
+        self.player.switch([_action('/a', 200), _action('/a', 201), _action('/a', 200)])
+        codes = []
+        while self.matches('/a'):
+            codes.append(self.rule.response.code)
+        self.assertEqual(codes, [200, 201, 200])
+
+    def test_should_switch_loaded_tapes(self):
+        @self.player.load(TAPE_PATH, incremental=True)
+        def some_wrapped():
+            pass
+
+        some_wrapped()
+        some_wrapped()
+        self.server.always.assert_called_once_with('POST')
+        self.assertFalse(self.server.on.called)
+
+
+class LayeredPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.rule = Mock(method='GET')
+        self.server = Mock()
+        self.server.always = Mock(return_value=self.rule)
+        self.server._always_rules = [self.rule]
+        self.player = Player(self.server)
+        self.base = CompiledTape([_action('/a', 200), _action('/b', 200)])
+
+    def matches(self, path):
+        return self.rule.matches('GET', path, {}, None)
+
+    def test_should_prefer_overlay_rules(self):
+        self.player.play_layers(self.base, [_action('/a', 201)])
+        self.assertTrue(self.matches('/a'))
+        self.assertEqual(self.rule.response.code, 201)
+
+    def test_should_fall_back_to_base_rules(self):
+        self.player.play_layers(self.base, [_action('/a', 201)])
+        self.assertTrue(self.matches('/b'))
+        self.assertEqual(self.rule.response.code, 200)
+        self.matches('/a')
+        self.assertTrue(self.matches('/a'))
+        self.assertEqual(self.rule.response.code, 200)
+
+    def test_should_serve_base_rules_once_per_play(self):
+        self.player.play_layers(self.base)
+        self.assertTrue(self.matches('/b'))
+        self.assertFalse(self.matches('/b'))
+        self.player.play_layers(self.base)
+        self.assertTrue(self.matches('/b'))
+
+    def test_should_replace_previous_layers(self):
+        self.player.play_layers(self.base, [_action('/a', 201)])
+        self.player.play_layers(self.base)
+        self.server.always.assert_called_once_with('GET')
+        self.assertTrue(self.matches('/a'))
+        self.assertEqual(self.rule.response.code, 200)
+
+    def test_should_create_base_rules_once(self):
+        self.player._create_rule = Mock(side_effect=self.player._create_rule)
+        self.player.play_layers(self.base, [_action('/c')])
+        self.player.play_layers(self.base, [_action('/d')])
+        self.assertEqual(self.player._create_rule.call_count, 4)
+
+    def test_should_compile_base_tape_once(self):
+        @self.player.load(TAPE_PATH, base=TAPE_PATH)
+        def some_wrapped():
+            pass
+
+        some_wrapped()
+        some_wrapped()
+        self.assertEqual(list(self.player._compiled), [(TAPE_PATH,)])
+        self.assertFalse(self.server.on.called)
+
+
+class RoutedPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.tape = [self.interaction('/api/users/42', 'John'),
+                     self.interaction('/api/users/43', 'Jane')]
+        self.rule = Mock(method='GET')
+        self.server = Mock()
+        self.server.always = Mock(return_value=self.rule)
+        self.player = Player(self.server, router=PathRouter(auto=True))
+
+    def interaction(self, path, name):
+        return {
+            'request': {'path': path, 'method': 'GET', 'headers': None, 'text': None, 'json': None},
+            'response': {'code': 200, 'headers': None, 'text': name, 'json': None},
+        }
+
+    def test_should_prefer_exact_path(self):
+        self.player.play(self.tape)
+        self.assertTrue(self.rule.matches('GET', '/api/users/43', {}))
+        self.assertEqual(self.rule.response.bytes, b'Jane')
+
+    def test_should_serve_first_template_rule_for_unknown_path(self):
+        self.player.play(self.tape)
+        for _ in range(2):
+            self.assertTrue(self.rule.matches('GET', '/api/users/44', {}))
+            self.assertEqual(self.rule.response.bytes, b'John')
+
+    def test_should_not_match_other_template(self):
+        self.player.play(self.tape)
+        self.assertFalse(self.rule.matches('GET', '/api/groups/44', {}))
+
+    def test_should_take_query_into_account(self):
+        self.player.play(self.tape)
+        self.assertFalse(self.rule.matches('GET', '/api/users/44?full=1', {}))
+
+
+TAPE_PATH = os.path.join(os.path.dirname(__file__), 'tape.yaml')
+
+
+class AsyncPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.rule = Mock()
+        self.server = Mock()
+        self.server.on = Mock(return_value=self.rule)
+        self.player = Player(self.server)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_should_load_tapes(self):
+        self.loop.run_until_complete(self.player.aload(TAPE_PATH, TAPE_PATH))
+        self.assertEqual(self.server.on.call_count, 4)
+
+    def test_should_load_tape_for_coroutine(self):
+        @self.player.load(TAPE_PATH)
+        async def some_wrapped(value):
+            return value
+
+        result = self.loop.run_until_complete(some_wrapped(42))
+        self.assertEqual(result, 42)
+        self.assertEqual(self.server.on.call_count, 2)
+
 
 class YamlReaderTest(unittest.TestCase):
     def test_should_read_tape_from_yaml_text(self):
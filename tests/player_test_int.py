@@ -1,13 +1,33 @@
+import os
+import asyncio
+import tempfile
 import unittest
 
 import httpsrv
 import requests
 
 from httpsrvvcr.player import tape_from_yaml, Player
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.index import TapeIndex
+from httpsrvvcr.store import TapeStore
+from httpsrvvcr.tape import read_tape
+
+
+def tape_text(*items):
+    return ''.join(
+        '- request:\n    path: {}\n    method: {}\n    headers: null\n    text: null\n'
+        '    json: null\n  response:\n    code: {}\n    headers: null\n'
+        '    text: {}\n    json: null\n'.format(*item)
+        for item in items)
+
+
+MIXED_TAPE = tape_text(('/a', 'GET', 200, 'first'), ('/a', 'GET', 200, 'second'),
+                       ('/b', 'POST', 201, 'created'))
 
 
 server = httpsrv.Server(8080).start()
 player = Player(server)
+canonical_player = Player(server, canonicalizer=Canonicalizer(sort_query=True))
 
 
 class RealTapePlaybackTest(unittest.TestCase):
@@ -65,3 +85,171 @@ class RealTapePlaybackTest(unittest.TestCase):
 
         unbound_function(201)
 
+
+    @player.load('tests/tape.yaml', lazy=True)
+    def test_should_play_indexed_tape(self):
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'Jane', 'last_name': 'Doe'})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['id'], 43)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['id'], 42)
+
+    @player.load('tests/tape.yaml', shared=True)
+    def test_should_play_shared_tape(self):
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'Jane', 'last_name': 'Doe'})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['id'], 43)
+
+    @canonical_player.load('tests/tape.yaml')
+    def test_should_play_canonical_tape(self):
+        res = requests.post('http://localhost:8080/api/users',
+                            data='{"last_name": "Doe", "name": "Jane"}',
+                            headers={'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['id'], 43)
+
+    def test_should_play_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, 'tape.db')
+            store = TapeStore(store_path)
+            with open('tests/tape.yaml', 'r', encoding='utf8') as tape_file:
+                store.write([action.to_dict() for action in read_tape(tape_file.read())])
+            store.close()
+
+            @Player(server).load(store_path)
+            def play():
+                res = requests.post('http://localhost:8080/api/users',
+                                    json={'name': 'Jane', 'last_name': 'Doe'})
+                self.assertEqual(res.status_code, 201)
+                self.assertEqual(res.json()['id'], 43)
+
+            play()
+
+    def test_should_play_layered_tapes(self):
+        layered_player = Player(server)
+        with open('tests/tape.yaml', 'r', encoding='utf8') as tape_file:
+            tape = read_tape(tape_file.read())
+        overlay = [tape[1]._replace(request=tape[0].request)]
+        layered_player.play_layers(tape, overlay)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 43)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 42)
+
+    def test_should_replace_previously_played_layers(self):
+        layered_player = Player(server)
+        with open('tests/tape.yaml', 'r', encoding='utf8') as tape_file:
+            tape = read_tape(tape_file.read())
+        overlay = [tape[1]._replace(request=tape[0].request)]
+        layered_player.play_layers(tape, overlay)
+        layered_player.play_layers(tape)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 42)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.status_code, 500)
+
+    def test_should_switch_tapes(self):
+        switching_player = Player(server)
+        with open('tests/tape.yaml', 'r', encoding='utf8') as tape_file:
+            tape = read_tape(tape_file.read())
+        switching_player.switch(tape[:1])
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 42)
+        switching_player.switch(tape)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'John', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 42)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'Jane', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 43)
+
+    def test_should_serve_every_interaction_of_mixed_methods_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tape_path = os.path.join(directory, 'tape.yaml')
+            with open(tape_path, 'w', encoding='utf8') as tape_file:
+                tape_file.write(MIXED_TAPE)
+            index = TapeIndex.open(tape_path)
+            Player(server).play_index(index)
+            self.assertEqual(requests.get('http://localhost:8080/a').text, 'first')
+            self.assertEqual(requests.post('http://localhost:8080/b').text, 'created')
+            self.assertEqual(requests.get('http://localhost:8080/a').text, 'second')
+            self.assertEqual(requests.get('http://localhost:8080/a').status_code, 500)
+            index.close()
+
+    def test_should_serve_canonical_tapes_played_together_in_turn(self):
+        canonical_player.play(tape_from_yaml(MIXED_TAPE))
+        canonical_player.play(tape_from_yaml(MIXED_TAPE))
+        for _ in range(2):
+            self.assertEqual(requests.post('http://localhost:8080/b').text, 'created')
+        self.assertEqual(requests.post('http://localhost:8080/b').status_code, 500)
+
+    def test_should_serve_every_canonical_interaction_of_mixed_methods_once(self):
+        canonical_player.play(tape_from_yaml(MIXED_TAPE))
+        self.assertEqual(requests.get('http://localhost:8080/a').text, 'first')
+        self.assertEqual(requests.post('http://localhost:8080/b').text, 'created')
+        self.assertEqual(requests.get('http://localhost:8080/a').text, 'second')
+
+    def test_should_switch_tapes_after_reset(self):
+        switching_player = Player(server)
+        with open('tests/tape.yaml', 'r', encoding='utf8') as tape_file:
+            tape = read_tape(tape_file.read())
+        switching_player.switch(tape)
+        server.reset()
+        switching_player.switch(tape)
+        res = requests.post('http://localhost:8080/api/users',
+                            json={'name': 'Jane', 'last_name': 'Doe'})
+        self.assertEqual(res.json()['id'], 43)
+
+
+class OverlappingTapesTest(unittest.TestCase):
+    def setUp(self):
+        server.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.tape_paths = []
+        for name in ('a', 'b'):
+            tape_path = os.path.join(self.directory.name, name + '.yaml')
+            with open(tape_path, 'w', encoding='utf8') as tape_file:
+                tape_file.write(tape_text(('/x', 'GET', 200, 'from-' + name)))
+            self.tape_paths.append(tape_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_served_in_turn(self):
+        self.assertEqual(requests.get('http://localhost:8080/x').text, 'from-a')
+        self.assertEqual(requests.get('http://localhost:8080/x').text, 'from-b')
+        self.assertEqual(requests.get('http://localhost:8080/x').status_code, 500)
+
+    def load(self, loading_player, **kwargs):
+        first, second = self.tape_paths
+        loading_player.load(first, **kwargs)(
+            loading_player.load(second, **kwargs)(self.assert_served_in_turn))()
+
+    def test_should_serve_overlapping_tapes_in_turn(self):
+        self.load(player)
+
+    def test_should_serve_overlapping_indexed_tapes_in_turn(self):
+        self.load(player, lazy=True)
+
+    def test_should_serve_overlapping_shared_tapes_in_turn(self):
+        self.load(player, shared=True)
+
+    def test_should_serve_overlapping_canonical_tapes_in_turn(self):
+        self.load(canonical_player)
+
+    def test_should_preload_overlapping_indexed_tapes(self):
+        asyncio.run(player.aload(*self.tape_paths, lazy=True))
+        self.assert_served_in_turn()
+
+    def test_should_preload_overlapping_shared_tapes(self):
+        asyncio.run(player.aload(*self.tape_paths, shared=True))
+        self.assert_served_in_turn()
@@ -0,0 +1,70 @@
+import io
+import os
+import pstats
+import tempfile
+import tracemalloc
+import unittest
+
+from httpsrvvcr.profiling import Profiler
+
+
+def _allocate():
+    return [str(number) for number in range(1000)]
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+
+    def test_should_report_profiled_functions(self):
+        profiler = Profiler(stream=self.stream)
+        with profiler:
+            _allocate()
+        profiler.report()
+        self.assertIn('_allocate', self.stream.getvalue())
+        self.assertIn('allocation sites', self.stream.getvalue())
+
+    def test_should_accumulate_nested_sections(self):
+        profiler = Profiler(stream=self.stream)
+        with profiler:
+            with profiler:
+                _allocate()
+            _allocate()
+        with profiler:
+            _allocate()
+        profiler.report()
+        stats = pstats.Stats(profiler._profile)
+        calls = [value[1] for func, value in stats.stats.items() if func[2] == '_allocate']
+        self.assertEqual(calls, [3])
+
+    def test_should_trace_memory_inside_sections_only(self):
+        profiler = Profiler(stream=self.stream)
+        with profiler:
+            with profiler:
+                self.assertTrue(tracemalloc.is_tracing())
+            self.assertTrue(tracemalloc.is_tracing())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_should_sum_allocations_of_sections(self):
+        profiler = Profiler(stream=self.stream)
+        kept = []
+        for _ in range(2):
+            with profiler:
+                kept.append(_allocate())
+        lineno = _allocate.__code__.co_firstlineno + 1
+        size = sum(size for traceback, (size, _) in profiler._allocations.items()
+                   if (traceback[0].filename, traceback[0].lineno) == (__file__, lineno))
+        self.assertGreater(size, sum(len(item) for item in kept[0]) * 2)
+
+    def test_should_dump_pstats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'out.pstats')
+            profiler = Profiler(output, stream=self.stream)
+            with profiler:
+                _allocate()
+            profiler.report()
+            self.assertIn('_allocate', str(pstats.Stats(output).stats))
+
+    def test_should_report_nothing_if_not_profiled(self):
+        Profiler(stream=self.stream).report()
+        self.assertEqual(self.stream.getvalue(), '')
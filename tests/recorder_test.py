@@ -1,10 +1,18 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import Mock, MagicMock, call
+from unittest.mock import Mock, MagicMock, call, patch
 
+import yaml
 from tornado.testing import AsyncTestCase, gen_test
 from tornado.concurrent import Future
 
 from httpsrvvcr import recorder
+from httpsrvvcr.replay import ReplayIndex
+from httpsrvvcr.index import TapeIndex
+from httpsrvvcr.tape import Interaction
+from httpsrvvcr.cache import ResponseCache
+from httpsrvvcr.store import TapeStore
 
 
 def future_mock(value):
@@ -27,9 +35,9 @@ def client_mock(response):
     return client
 
 
-def create_handler(request, client, target, writer):
+def create_handler(request, client, target, writer, **kwargs):
     handler = recorder.ProxyHandler(
-        MagicMock(), request, httpclient=client, target=target, writer=writer)
+        MagicMock(), request, httpclient=client, target=target, writer=writer, **kwargs)
     handler.set_status = Mock()
     handler.finish = Mock()
     handler.write = Mock()
@@ -116,6 +124,37 @@ class ProxyHandlerTest(AsyncTestCase):
             allow_nonstandard_methods=True,
             body=self.request.body)
 
+    @gen_test
+    def test_should_not_forward_hop_by_hop_headers(self):
+        self.request.headers = {'Connection': 'close', 'Accept': 'text/plain'}
+        yield self.handler.prepare()
+        self.client.fetch.assert_called_with(
+            self.target + self.request.uri,
+            method=self.request.method,
+            headers={'Accept': 'text/plain'},
+            allow_nonstandard_methods=True,
+            body=self.request.body)
+
+    @gen_test
+    def test_should_strip_route_prefix(self):
+        self.request.uri = '/users/api/42?full=1'
+        handler = create_handler(self.request, self.client, self.target, self.writer,
+                                 prefix='/users')
+        yield handler.prepare()
+        self.assertEqual(self.client.fetch.call_args[0][0], self.target + '/api/42?full=1')
+        self.writer.write.assert_called_with(self.request, self.response)
+
+    @gen_test
+    def test_should_send_body_with_shaper(self):
+        shaper = Mock()
+        shaper.send = future_mock(None)
+        handler = create_handler(self.request, self.client, self.target, self.writer,
+                                 shaper=shaper)
+        yield handler.prepare()
+        shaper.send.assert_called_once_with(handler, self.response.body)
+        self.assertFalse(handler.write.called)
+        handler.set_status.assert_called_with(self.response.code)
+
     @gen_test
     def test_should_exclude_headers_in_response(self):
         self.response.headers['Transfer-Encoding'] = 'chunked'
@@ -123,6 +162,273 @@ class ProxyHandlerTest(AsyncTestCase):
         self.assertNotIn((('Transfer-Encoding', 'chunked'),), self.handler.set_header.call_args_list)
 
 
+class ProxyHandlerModesTest(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.response = response_mock()
+        self.client = client_mock(self.response)
+        self.request = request_mock()
+        self.writer = Mock()
+        self.replay_index = ReplayIndex([Interaction.from_dict({
+            'request': {'path': '/', 'method': 'GET', 'headers': None, 'text': None, 'json': None},
+            'response': {'code': 201, 'headers': None, 'text': 'Recorded', 'json': None},
+        })])
+
+    def create_handler(self, mode):
+        return create_handler(self.request, self.client, 'http://nowhere.com', self.writer,
+                              mode=mode, replay_index=self.replay_index)
+
+    @gen_test
+    def test_should_serve_recorded_response_in_replay_mode(self):
+        handler = self.create_handler(recorder.MODE_REPLAY)
+        yield handler.prepare()
+        self.assertFalse(self.client.fetch.called)
+        self.assertFalse(self.writer.write.called)
+        handler.set_status.assert_called_with(201)
+        handler.write.assert_called_with(b'Recorded')
+
+    @gen_test
+    def test_should_forward_unknown_request_in_replay_mode(self):
+        self.request.uri = '/unknown'
+        handler = self.create_handler(recorder.MODE_REPLAY)
+        yield handler.prepare()
+        self.assertTrue(self.client.fetch.called)
+        self.assertFalse(self.writer.write.called)
+        handler.write.assert_called_with(self.response.body)
+
+    @gen_test
+    def test_should_not_record_in_passthrough_mode(self):
+        handler = self.create_handler(recorder.MODE_PASSTHROUGH)
+        yield handler.prepare()
+        self.assertTrue(self.client.fetch.called)
+        self.assertFalse(self.writer.write.called)
+
+    @gen_test
+    def test_should_record_unknown_request_in_record_new_mode(self):
+        self.request.uri = '/unknown'
+        handler = self.create_handler(recorder.MODE_RECORD_NEW)
+        yield handler.prepare()
+        self.writer.write.assert_called_with(self.request, self.response)
+        self.assertEqual(self.replay_index.lookup(self.request).body, self.response.body)
+
+    @gen_test
+    def test_should_ignore_replay_index_in_record_mode(self):
+        handler = self.create_handler(recorder.MODE_RECORD)
+        yield handler.prepare()
+        self.assertTrue(self.client.fetch.called)
+        self.writer.write.assert_called_with(self.request, self.response)
+
+
+class RequestCoalescerTest(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.response = response_mock()
+        self.pending = Future()
+        self.client = Mock()
+        self.client.fetch = Mock(return_value=self.pending)
+        self.writer = Mock()
+        self.coalescer = recorder.RequestCoalescer()
+
+    def create_handler(self, request):
+        return create_handler(request, self.client, 'http://nowhere.com', self.writer,
+                              coalescer=self.coalescer)
+
+    @gen_test
+    def test_should_share_identical_requests(self):
+        handlers = [self.create_handler(request_mock()) for _ in range(3)]
+        futures = [handler.prepare() for handler in handlers]
+        self.pending.set_result(self.response)
+        for future in futures:
+            yield future
+        self.assertEqual(self.client.fetch.call_count, 1)
+        self.assertEqual(self.writer.write.call_count, 1)
+        self.assertEqual(self.coalescer.coalesced, 2)
+        for handler in handlers:
+            handler.write.assert_called_with(self.response.body)
+
+    @gen_test
+    def test_should_not_share_different_requests(self):
+        other = request_mock()
+        other.uri = '/other'
+        futures = [self.create_handler(request_mock()).prepare(),
+                   self.create_handler(other).prepare()]
+        self.pending.set_result(self.response)
+        for future in futures:
+            yield future
+        self.assertEqual(self.client.fetch.call_count, 2)
+
+    @gen_test
+    def test_should_not_share_post_requests(self):
+        post = request_mock()
+        post.method = 'POST'
+        self.assertIsNone(self.coalescer.key(post))
+
+    @gen_test
+    def test_should_not_share_finished_requests(self):
+        self.pending.set_result(self.response)
+        yield self.create_handler(request_mock()).prepare()
+        yield self.create_handler(request_mock()).prepare()
+        self.assertEqual(self.client.fetch.call_count, 2)
+
+    def test_should_distinguish_relevant_headers(self):
+        other = request_mock()
+        other.headers = {'Accept': 'text/plain'}
+        self.assertNotEqual(self.coalescer.key(request_mock()), self.coalescer.key(other))
+
+
+class ProxyHandlerCacheTest(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.response = response_mock()
+        self.client = client_mock(self.response)
+        self.writer = Mock()
+        self.cache = ResponseCache()
+
+    def create_handler(self):
+        return create_handler(request_mock(), self.client, 'http://nowhere.com', self.writer,
+                              cache=self.cache)
+
+    @gen_test
+    def test_should_fetch_target_once(self):
+        yield self.create_handler().prepare()
+        handler = self.create_handler()
+        yield handler.prepare()
+        self.assertEqual(self.client.fetch.call_count, 1)
+        handler.write.assert_called_with(self.response.body)
+
+    @gen_test
+    def test_should_record_cached_response(self):
+        yield self.create_handler().prepare()
+        yield self.create_handler().prepare()
+        self.assertEqual(self.writer.write.call_count, 2)
+
+
+class RouteTest(unittest.TestCase):
+    def request(self, path, host_name='localhost'):
+        request = Mock()
+        request.path = path
+        request.host_name = host_name
+        return request
+
+    def test_should_match_path_prefix(self):
+        matcher = recorder.Route('/users/', 'http://users').matcher()
+        self.assertIsNotNone(matcher.match(self.request('/users')))
+        self.assertIsNotNone(matcher.match(self.request('/users/42')))
+        self.assertIsNone(matcher.match(self.request('/users42')))
+
+    def test_should_match_host(self):
+        matcher = recorder.Route('users.local', 'http://users').matcher()
+        self.assertIsNotNone(matcher.match(self.request('/api', 'users.local')))
+        self.assertIsNone(matcher.match(self.request('/api', 'users-local')))
+
+    def test_should_not_strip_prefix_of_host_route(self):
+        self.assertEqual(recorder.Route('users.local', 'http://users').prefix, '')
+        self.assertEqual(recorder.Route('/users/', 'http://users').prefix, '/users')
+
+    def test_should_parse_route(self):
+        route = recorder.Route.parse(['/users', 'http://users', 'users.yaml'])
+        self.assertEqual((route.match, route.target, route.output),
+                         ('/users', 'http://users', 'users.yaml'))
+        self.assertIsNone(recorder.Route.parse(['/users', 'http://users']).output)
+
+    def test_should_not_parse_incomplete_route(self):
+        with self.assertRaises(ValueError):
+            recorder.Route.parse(['/users'])
+
+    def test_should_open_yaml_output_for_appending(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tape_path = os.path.join(directory, 'tape.yaml')
+            writer = recorder.open_output(tape_path)
+            writer.write([{'a': 1}])
+            writer.flush()
+            with open(tape_path, 'r', encoding='utf8') as tape_file:
+                self.assertEqual(tape_file.read(), '- a: 1\n')
+            writer.close()
+
+
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        patchers = [patch('httpsrvvcr.recorder.listen'), patch('tornado.ioloop.IOLoop.current'),
+                    patch('tornado.ioloop.PeriodicCallback')]
+        _, self.current, self.periodic = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    @patch('sys.stderr')
+    def test_should_write_cache_stats_when_interrupted(self, stderr):
+        self.current.return_value.start.side_effect = KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            recorder.run(8080, 'http://target', output=Mock(), cache=ResponseCache())
+        self.assertIn('cache: ', stderr.write.call_args[0][0])
+
+    def test_should_not_open_route_tapes_unless_recording(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tape_path = os.path.join(directory, 'users.yaml')
+            for mode in (recorder.MODE_REPLAY, recorder.MODE_PASSTHROUGH):
+                recorder.run(8080, None, mode=mode, output=Mock(), routes=[
+                    recorder.Route('/users', 'http://users', tape_path, Mock())])
+            self.assertFalse(os.path.exists(tape_path))
+
+    @patch('httpsrvvcr.recorder.open_output')
+    def test_should_create_sampler_per_tape(self, _):
+        sampler_factory = Mock(side_effect=lambda: Mock(drain=Mock(return_value=[])))
+        recorder.run(8080, 'http://target', output=Mock(), sampler_factory=sampler_factory,
+                     routes=[recorder.Route('/users', 'http://users', 'users.yaml', Mock())])
+        self.assertEqual(sampler_factory.call_count, 2)
+
+    @patch('httpsrvvcr.recorder.open_output')
+    def test_should_close_route_tapes_when_stopped(self, open_output):
+        recorder.run(8080, None, output=Mock(), routes=[
+            recorder.Route('/users', 'http://users', 'users.yaml', Mock())])
+        open_output.assert_called_once_with('users.yaml')
+        open_output.return_value.flush.assert_called_once_with()
+        open_output.return_value.close.assert_called_once_with()
+
+    def test_should_flush_outputs_periodically(self):
+        output = Mock()
+        recorder.run(8080, 'http://target', output=output)
+        self.periodic.return_value.start.assert_called_once_with()
+        self.periodic.return_value.stop.assert_called_once_with()
+        output.flush.reset_mock()
+        flush_outputs, interval = self.periodic.call_args[0]
+        flush_outputs()
+        output.flush.assert_called_once_with()
+        self.assertEqual(interval, recorder.OUTPUT_FLUSH_INTERVAL * 1000)
+
+
+class LoadReplayIndexTest(unittest.TestCase):
+    def test_should_load_index_from_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, 'tape.db')
+            store = TapeStore(store_path)
+            store.write([{
+                'request': {'path': '/', 'method': 'GET', 'headers': {}, 'text': None,
+                            'json': None},
+                'response': {'code': 200, 'headers': {}, 'text': 'ok', 'json': None},
+            }])
+            store.close()
+            self.assertEqual(len(recorder.load_replay_index(store_path)), 1)
+
+
+class CreateClientTest(unittest.TestCase):
+    def test_should_create_client_with_ca_certs(self):
+        client = recorder.create_client(max_clients=3, ca_certs='ca.pem')
+        self.assertEqual(client.max_clients, 3)
+        self.assertEqual(client.defaults['ca_certs'], 'ca.pem')
+        client.close()
+
+
+class ListenTest(unittest.TestCase):
+    @patch('httpsrvvcr.recorder.tornado.netutil.bind_sockets')
+    @patch('httpsrvvcr.recorder.HTTPServer')
+    def test_should_create_server_with_options(self, server_class, bind_sockets):
+        app = Mock()
+        server = recorder.listen(app, 8080, backlog=1024, max_body_size=10, xheaders=True)
+        server_class.assert_called_once_with(app, max_body_size=10, xheaders=True)
+        bind_sockets.assert_called_once_with(8080, backlog=1024)
+        server.add_sockets.assert_called_once_with(bind_sockets.return_value)
+
+
 class YamlWriterTest(unittest.TestCase):
     def setUp(self):
         self.wrapped_writer = Mock()
@@ -152,6 +458,22 @@ class VcrWriterTest(unittest.TestCase):
         self.json.loads = Mock(return_value=self.parsed_json)
         self.writer = recorder.VcrWriter(self.wrapped_writer, self.json)
 
+    def test_should_write_sampled_interactions_only(self):
+        sampler = Mock()
+        sampler.offer = Mock(return_value=[])
+        writer = recorder.VcrWriter(self.wrapped_writer, self.json, sampler=sampler)
+        writer.write(self.request, self.response)
+        sampler.offer.assert_called_once_with(self.request, self.response)
+        self.assertFalse(self.wrapped_writer.write.called)
+        self.assertFalse(self.json.loads.called)
+
+    def test_should_write_kept_interactions_on_flush(self):
+        sampler = Mock()
+        sampler.drain = Mock(return_value=[(self.request, self.response)])
+        writer = recorder.VcrWriter(self.wrapped_writer, self.json, sampler=sampler)
+        writer.flush()
+        self.assertEqual(self.wrapped_writer.write.call_count, 1)
+
     def test_should_write_request_and_response(self):
         self.writer.write(self.request, self.response)
         self.wrapped_writer.write.assert_called_with([{
@@ -243,6 +565,46 @@ class VcrWriterTest(unittest.TestCase):
             },
         }])
 
+    def test_should_write_header_profile_once(self):
+        writer = recorder.VcrWriter(self.wrapped_writer, self.json, share_headers=True)
+        writer.write(self.request, self.response)
+        writer.write(self.request, self.response)
+        written = [args[0][0] for args, _ in self.wrapped_writer.write.call_args_list]
+        request_id, response_id = written[0]['profile'], written[1]['profile']
+        self.assertNotEqual(request_id, response_id)
+        self.assertEqual(written[:2], [
+            {'profile': request_id, 'headers': self.request.headers},
+            {'profile': response_id, 'headers': self.response.headers},
+        ])
+        self.assertEqual(len(written), 4)
+        for action in (written[2], written[3]):
+            self.assertEqual(action['request']['headers'], request_id)
+            self.assertEqual(action['response']['headers'], response_id)
+
+    def test_should_keep_header_profiles_of_appended_sessions_apart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tape_path = os.path.join(directory, 'tape.yaml')
+            for accept in ['application/json', 'text/plain']:
+                self.request.headers = {'Accept': accept}
+                with open(tape_path, 'a', encoding='utf8') as tape_file:
+                    writer = recorder.VcrWriter(
+                        recorder.YamlWriter(tape_file, yaml), self.json, share_headers=True)
+                    writer.write(self.request, self.response)
+            index = TapeIndex.open(tape_path)
+            actions = [index.interaction(offset, length)
+                       for offset, length in index.offsets('GET', '/')]
+            index.close()
+        self.assertEqual([action.request.headers for action in actions],
+                         [{'Accept': 'application/json'}, {'Accept': 'text/plain'}])
+
+    def test_should_filter_headers(self):
+        header_filter = recorder.HeaderFilter(drop=['content-*'])
+        writer = recorder.VcrWriter(self.wrapped_writer, self.json, header_filter=header_filter)
+        writer.write(self.request, self.response)
+        action = self.wrapped_writer.write.call_args[0][0][0]
+        self.assertEqual(action['request']['headers'], self.request.headers)
+        self.assertEqual(action['response']['headers'], {})
+
     def test_shoud_skip_target_methods(self):
         writer = recorder.VcrWriter(self.wrapped_writer, self.json, skip_methods=['POST'])
         self.request.method = 'POST'
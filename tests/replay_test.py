@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import Mock
+
+from httpsrvvcr.replay import ReplayIndex, ReplayResponse
+from httpsrvvcr.canonical import Canonicalizer
+from httpsrvvcr.tape import Interaction
+
+
+def interaction(path, request_json=None, response_text='OK'):
+    return Interaction.from_dict({
+        'request': {
+            'path': path,
+            'method': 'POST',
+            'headers': None,
+            'text': None,
+            'json': request_json,
+        },
+        'response': {
+            'code': 200,
+            'headers': {'Content-Type': 'text/plain', 'Content-Length': '2'},
+            'text': response_text,
+            'json': None,
+        }
+    })
+
+
+def request_mock(path, body=None, content_type='application/json'):
+    request = Mock()
+    request.method = 'POST'
+    request.uri = path
+    request.body = body
+    request.headers = {'Content-Type': content_type}
+    return request
+
+
+class ReplayResponseTest(unittest.TestCase):
+    def test_should_encode_json(self):
+        action = interaction('/')
+        response = ReplayResponse.from_record(action.response._replace(json={'id': 42}))
+        self.assertEqual(response.body, b'{"id": 42}')
+
+    def test_should_skip_content_length(self):
+        response = ReplayResponse.from_record(interaction('/').response)
+        self.assertEqual(response.headers, (('Content-Type', 'text/plain'),))
+
+
+class ReplayIndexTest(unittest.TestCase):
+    def test_should_find_recorded_response(self):
+        index = ReplayIndex([interaction('/users')])
+        self.assertEqual(index.lookup(request_mock('/users')).body, b'OK')
+
+    def test_should_not_find_unknown_request(self):
+        index = ReplayIndex([interaction('/users')])
+        self.assertIsNone(index.lookup(request_mock('/groups')))
+
+    def test_should_match_json_regardless_of_key_order(self):
+        index = ReplayIndex([interaction('/users', {'name': 'John', 'age': 42})])
+        found = index.lookup(request_mock('/users', b'{"age": 42, "name": "John"}'))
+        self.assertIsNotNone(found)
+
+    def test_should_serve_responses_in_order_repeating_last(self):
+        index = ReplayIndex([interaction('/users', response_text='1'),
+                             interaction('/users', response_text='2')])
+        bodies = [index.lookup(request_mock('/users')).body for _ in range(3)]
+        self.assertEqual(bodies, [b'1', b'2', b'2'])
+
+    def test_should_ignore_query_order(self):
+        index = ReplayIndex([interaction('/users?b=2&a=1')], Canonicalizer(sort_query=True))
+        self.assertIsNotNone(index.lookup(request_mock('/users?a=1&b=2')))
+
+    def test_should_add_target_response(self):
+        index = ReplayIndex()
+        response = Mock()
+        response.code = 200
+        response.headers = {}
+        response.body = b'live'
+        index.add_response(request_mock('/users'), response)
+        self.assertEqual(index.lookup(request_mock('/users')).body, b'live')
+
+    def test_should_count_responses(self):
+        self.assertEqual(len(ReplayIndex([interaction('/a'), interaction('/b')])), 2)
@@ -0,0 +1,58 @@
+import unittest
+
+from httpsrvvcr.routing import PathRouter, derive_template, is_template
+
+
+class DeriveTemplateTest(unittest.TestCase):
+    def test_should_replace_numbers(self):
+        self.assertEqual(derive_template('/api/users/42/posts/7'), '/api/users/{id}/posts/{id}')
+
+    def test_should_replace_uuids(self):
+        self.assertEqual(derive_template('/api/users/3f2b6c1e-9a4d-4c1b-8e2f-1a2b3c4d5e6f'),
+                         '/api/users/{id}')
+
+    def test_should_keep_words(self):
+        self.assertEqual(derive_template('/api/users/me'), '/api/users/me')
+
+
+class IsTemplateTest(unittest.TestCase):
+    def test_should_detect_placeholders(self):
+        self.assertTrue(is_template('/api/users/{id}'))
+        self.assertFalse(is_template('/api/users/42'))
+
+
+class PathRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = PathRouter(['/api/users/{id}', '/api/users/me', '/api/{kind}/list'])
+
+    def test_should_find_template(self):
+        self.assertEqual(self.router.find('/api/users/42'), '/api/users/{id}')
+
+    def test_should_ignore_query(self):
+        self.assertEqual(self.router.find('/api/users/42?full=1'), '/api/users/{id}')
+
+    def test_should_prefer_literal_segments(self):
+        self.assertEqual(self.router.find('/api/users/me'), '/api/users/me')
+
+    def test_should_match_placeholder_in_the_middle(self):
+        self.assertEqual(self.router.find('/api/groups/list'), '/api/{kind}/list')
+
+    def test_should_backtrack_to_placeholder(self):
+        router = PathRouter(['/a/b/c', '/a/{x}/d'])
+        self.assertEqual(router.find('/a/b/d'), '/a/{x}/d')
+
+    def test_should_not_find_unknown_path(self):
+        self.assertIsNone(self.router.find('/api/users/42/posts'))
+
+    def test_should_return_route_without_template(self):
+        self.assertEqual(PathRouter().template('/api/users/42?a=1'), '/api/users/42')
+
+    def test_should_add_template_paths(self):
+        router = PathRouter()
+        self.assertEqual(router.template('/api/users/{id}'), '/api/users/{id}')
+        self.assertEqual(router.find('/api/users/42'), '/api/users/{id}')
+
+    def test_should_derive_templates_in_auto_mode(self):
+        router = PathRouter(auto=True)
+        self.assertEqual(router.template('/api/users/42'), '/api/users/{id}')
+        self.assertEqual(router.find('/api/users/43'), '/api/users/{id}')
@@ -0,0 +1,69 @@
+import random
+import unittest
+from unittest.mock import Mock
+
+from httpsrvvcr.sampling import RateSampler, FirstSampler, ReservoirSampler, endpoint_key
+
+
+def request_mock(path='/api/users', method='GET'):
+    request = Mock()
+    request.method = method
+    request.path = path
+    return request
+
+
+class RateSamplerTest(unittest.TestCase):
+    def test_should_record_fraction_of_interactions(self):
+        sampler = RateSampler(0.25, random.Random(1))
+        recorded = sum(len(sampler.offer(request_mock(), Mock())) for _ in range(4000))
+        self.assertAlmostEqual(recorded / 4000, 0.25, delta=0.03)
+
+    def test_should_return_offered_pair(self):
+        request, response = request_mock(), Mock()
+        self.assertEqual(RateSampler(1).offer(request, response), [(request, response)])
+        self.assertEqual(RateSampler(0).offer(request, response), [])
+
+
+class FirstSamplerTest(unittest.TestCase):
+    def test_should_record_first_interactions_per_endpoint(self):
+        sampler = FirstSampler(2)
+        offered = [request_mock('/a'), request_mock('/a'), request_mock('/b'), request_mock('/a'),
+                   request_mock('/a', 'POST')]
+        recorded = [request for request in offered for _ in sampler.offer(request, Mock())]
+        self.assertEqual(recorded, [offered[0], offered[1], offered[2], offered[4]])
+        self.assertEqual(sampler.drain(), [])
+
+
+class ReservoirSamplerTest(unittest.TestCase):
+    def test_should_keep_interactions_until_drained(self):
+        sampler = ReservoirSampler(2)
+        self.assertEqual(sampler.offer(request_mock(), Mock()), [])
+        self.assertEqual(len(sampler.drain()), 1)
+        self.assertEqual(sampler.drain(), [])
+
+    def test_should_bound_sample_per_endpoint(self):
+        sampler = ReservoirSampler(3, rnd=random.Random(1))
+        for number in range(100):
+            sampler.offer(request_mock('/a'), number)
+            sampler.offer(request_mock('/b'), number)
+        drained = sampler.drain()
+        self.assertEqual(len(drained), 6)
+        self.assertEqual(sorted(endpoint_key(request)[1] for request, _ in drained),
+                         ['/a', '/a', '/a', '/b', '/b', '/b'])
+
+    def test_should_drain_in_arrival_order(self):
+        sampler = ReservoirSampler(5, rnd=random.Random(1))
+        for number in range(50):
+            sampler.offer(request_mock('/a'), number)
+        numbers = [response for _, response in sampler.drain()]
+        self.assertEqual(numbers, sorted(numbers))
+
+    def test_should_sample_uniformly(self):
+        sampler = ReservoirSampler(1, rnd=random.Random(1))
+        counts = [0] * 4
+        for _ in range(2000):
+            for number in range(4):
+                sampler.offer(request_mock(), number)
+            counts[sampler.drain()[0][1]] += 1
+        for number_count in counts:
+            self.assertAlmostEqual(number_count / 2000, 0.25, delta=0.05)
@@ -0,0 +1,66 @@
+import time
+from unittest.mock import Mock
+
+from tornado.gen import multi
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.concurrent import Future
+from tornado.iostream import StreamClosedError
+
+from httpsrvvcr.shaping import ResponseShaper
+
+
+def handler_mock(path='/api/files/1'):
+    handler = Mock()
+    handler.request.path = path
+    flushed = Future()
+    flushed.set_result(None)
+    handler.flush = Mock(return_value=flushed)
+    return handler
+
+
+class ResponseShaperTest(AsyncTestCase):
+    def test_should_use_first_matching_path_rate(self):
+        shaper = ResponseShaper(100, path_rates=[('/api/files/*', 10), ('/api/*', 20)])
+        self.assertEqual(shaper.rate('/api/files/1'), 10)
+        self.assertEqual(shaper.rate('/api/users'), 20)
+        self.assertEqual(shaper.rate('/health'), 100)
+
+    @gen_test
+    def test_should_send_body_at_once_without_rate(self):
+        handler = handler_mock()
+        yield ResponseShaper().send(handler, b'body')
+        handler.write.assert_called_once_with(b'body')
+        handler.finish.assert_called_once_with()
+
+    @gen_test
+    def test_should_stream_body_in_chunks(self):
+        handler = handler_mock()
+        yield ResponseShaper(rate=1000000, chunk_size=4).send(handler, b'0123456789')
+        self.assertEqual([args[0] for args, _ in handler.write.call_args_list],
+                         [b'0123', b'4567', b'89'])
+        self.assertEqual(handler.flush.call_count, 3)
+        handler.finish.assert_called_once_with()
+
+    @gen_test
+    def test_should_limit_rate(self):
+        started = time.monotonic()
+        yield ResponseShaper(rate=1000, chunk_size=50).send(handler_mock(), b'x' * 100)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    @gen_test
+    def test_should_queue_responses_over_concurrency(self):
+        shaper = ResponseShaper(concurrency=1, latency=0.05)
+        started = time.monotonic()
+        yield multi([shaper.send(handler_mock(), b'a'), shaper.send(handler_mock(), b'b')])
+        self.assertGreaterEqual(time.monotonic() - started, 0.095)
+
+    @gen_test
+    def test_should_release_slot_when_client_disconnects(self):
+        shaper = ResponseShaper(rate=1000000, concurrency=1)
+        handler = handler_mock()
+        handler.flush.side_effect = StreamClosedError()
+        yield shaper.send(handler, b'body')
+        self.assertFalse(handler.finish.called)
+        other = handler_mock()
+        yield shaper.send(other, b'body')
+        other.finish.assert_called_once_with()
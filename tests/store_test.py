@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from httpsrvvcr.store import TapeStore, body_hash, is_store
+from httpsrvvcr.tape import Interaction
+
+
+def action(path='/api/users', method='GET', json=None, code=200, headers=None):
+    return {
+        'request': {
+            'path': path,
+            'method': method,
+            'headers': headers if headers is not None else {'Accept': 'application/json'},
+            'text': None,
+            'json': json,
+        },
+        'response': {'code': code, 'headers': {}, 'text': 'ok', 'json': None},
+    }
+
+
+class BodyHashTest(unittest.TestCase):
+    def test_should_hash_json_regardless_of_key_order(self):
+        self.assertEqual(body_hash(json={'a': 1, 'b': 2}), body_hash('{"b": 2, "a": 1}'))
+
+    def test_should_hash_missing_body_as_empty(self):
+        self.assertEqual(body_hash(), body_hash(''))
+
+    def test_should_detect_store_files(self):
+        self.assertTrue(is_store('tape.db'))
+        self.assertFalse(is_store('tape.yaml'))
+
+
+class TapeStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tape.db')
+        self.store = TapeStore(self.path, batch_size=2)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_should_use_wal_journal(self):
+        mode, = self.store._query('PRAGMA journal_mode')[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_should_insert_in_batches(self):
+        self.store.write([action('/a')])
+        self.assertEqual(len(self.store), 0)
+        self.store.write([action('/b')])
+        self.assertEqual(len(self.store), 2)
+
+    def test_should_lookup_interactions_in_recording_order(self):
+        self.store.write([action(code=200), action('/other'), action(code=201)])
+        self.store.flush()
+        found = self.store.lookup('GET', '/api/users')
+        self.assertEqual([item.response.code for item in found], [200, 201])
+        self.assertIsInstance(found[0], Interaction)
+
+    def test_should_find_ids_by_body_hash(self):
+        self.store.write([action(method='POST', json={'name': 'John'}),
+                          action(method='POST', json={'name': 'Jane'})])
+        self.store.flush()
+        ids = self.store.ids('POST', '/api/users', [body_hash('{"name": "Jane"}')])
+        self.assertEqual(len(ids), 1)
+        self.assertEqual(self.store.interaction(ids[0]).request.json, {'name': 'Jane'})
+
+    def test_should_list_methods(self):
+        self.store.write([action(), action(method='POST')])
+        self.assertEqual(sorted(self.store.methods), ['GET', 'POST'])
+
+    def test_should_resolve_header_profiles(self):
+        self.store.write([{'profile': 'h0', 'headers': {'Accept': 'text/plain'}},
+                          action(headers='h0')])
+        self.store.flush()
+        found, = self.store.interactions()
+        self.assertEqual(dict(found.request.headers), {'Accept': 'text/plain'})
+
+    def test_should_insert_after_flush_interval(self):
+        self.store.close()
+        self.store = TapeStore(self.path, flush_interval=0)
+        self.store.write([action()])
+        self.assertEqual(len(self.store), 1)
+
+    def test_should_keep_first_profile_definition(self):
+        self.store.write([{'profile': 'h0', 'headers': {'Accept': 'text/plain'}}])
+        self.store.flush()
+        self.store.write([{'profile': 'h0', 'headers': {'Accept': 'text/html'}},
+                          action(headers='h0')])
+        self.store.flush()
+        found, = self.store.interactions()
+        self.assertEqual(dict(found.request.headers), {'Accept': 'text/plain'})
+
+    def test_should_persist_between_connections(self):
+        self.store.write([action()])
+        self.store.close()
+        self.store = TapeStore(self.path)
+        self.assertEqual(len(list(self.store.interactions())), 1)
+
+    def test_should_open_existing_store_without_creating(self):
+        self.store.write([action()])
+        self.store.close()
+        self.store = TapeStore(self.path, create=False)
+        self.assertEqual(len(list(self.store.interactions())), 1)
+
+    def test_should_not_create_missing_store(self):
+        missing = os.path.join(self.directory.name, 'missing.db')
+        with self.assertRaises(FileNotFoundError):
+            TapeStore(missing, create=False)
+        self.assertFalse(os.path.exists(missing))
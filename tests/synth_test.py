@@ -0,0 +1,55 @@
+import io
+import json
+import unittest
+
+from httpsrvvcr.synth import TapeSynthesizer, parse_sizes, synth_yaml
+from httpsrvvcr.tape import read_tape, write_tape
+
+
+class ParseSizesTest(unittest.TestCase):
+    def test_should_parse_sizes_with_weights(self):
+        self.assertEqual(parse_sizes(['64:70', '4096']), [(64, 70.0), (4096, 1.0)])
+
+
+class TapeSynthesizerTest(unittest.TestCase):
+    def test_should_be_deterministic_for_seed(self):
+        first = list(TapeSynthesizer(seed=1).interactions(20))
+        second = list(TapeSynthesizer(seed=1).interactions(20))
+        self.assertEqual(first, second)
+
+    def test_should_generate_json_bodies_of_given_size(self):
+        synthesizer = TapeSynthesizer(body_sizes=[(512, 1)], json_ratio=1, seed=1)
+        for action in synthesizer.interactions(10):
+            self.assertEqual(len(json.dumps(action.response.json)), 512)
+            self.assertEqual(action.response.headers['Content-Type'], 'application/json')
+
+    def test_should_generate_text_bodies_of_given_size(self):
+        synthesizer = TapeSynthesizer(body_sizes=[(100, 1)], json_ratio=0, seed=1)
+        for action in synthesizer.interactions(10):
+            self.assertEqual(len(action.response.text), 100)
+            self.assertIsNone(action.response.json)
+
+    def test_should_limit_header_cardinality(self):
+        synthesizer = TapeSynthesizer(header_sets=2, post_ratio=0, seed=1)
+        headers = set(tuple(sorted(action.request.headers.items()))
+                      for action in synthesizer.interactions(50))
+        self.assertEqual(len(headers), 2)
+
+    def test_should_generate_post_requests(self):
+        synthesizer = TapeSynthesizer(post_ratio=1, endpoints=1, seed=1)
+        action = synthesizer.interaction(0)
+        self.assertEqual(action.request.method, 'POST')
+        self.assertEqual(action.request.path, '/api/resource0')
+        self.assertIsNotNone(action.request.json)
+        self.assertEqual(action.response.code, 201)
+
+
+class WriteTapeTest(unittest.TestCase):
+    def test_should_write_readable_tape_in_batches(self):
+        actions = list(TapeSynthesizer(seed=1).interactions(25))
+        stream = io.StringIO()
+        write_tape(stream, actions, batch_size=10)
+        self.assertEqual(read_tape(stream.getvalue()), actions)
+
+    def test_should_return_yaml_string(self):
+        self.assertEqual(len(read_tape(synth_yaml(5, seed=1))), 5)
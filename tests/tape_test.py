@@ -0,0 +1,99 @@
+import unittest
+
+import yaml
+
+from httpsrvvcr.tape import (
+    HeaderFilter, Interaction, RecordedRequest, RecordedResponse, read_tape)
+
+
+ACTION = {
+    'request': {
+        'path': '/api/users',
+        'method': 'POST',
+        'headers': {'Content-Type': 'application/json'},
+        'text': None,
+        'json': {'name': 'John'},
+    },
+    'response': {
+        'code': 201,
+        'headers': {'Content-Type': 'application/json'},
+        'text': None,
+        'json': {'id': 42},
+    }
+}
+
+
+class InteractionTest(unittest.TestCase):
+    def test_should_create_records_from_dict(self):
+        action = Interaction.from_dict(ACTION)
+        self.assertEqual(action.request, RecordedRequest(
+            'POST', '/api/users', {'Content-Type': 'application/json'}, None, {'name': 'John'}))
+        self.assertEqual(action.response, RecordedResponse(
+            201, {'Content-Type': 'application/json'}, None, {'id': 42}))
+
+    def test_should_convert_back_to_dict(self):
+        self.assertEqual(Interaction.from_dict(ACTION).to_dict(), ACTION)
+
+    def test_should_return_records_as_is(self):
+        action = Interaction.from_dict(ACTION)
+        self.assertIs(Interaction.from_dict(action), action)
+
+    def test_should_not_have_instance_dict(self):
+        action = Interaction.from_dict(ACTION)
+        self.assertFalse(hasattr(action.request, '__dict__'))
+
+    def test_should_intern_header_names(self):
+        first = Interaction.from_dict(ACTION)
+        second = read_tape(yaml.dump([ACTION]))[0]
+        first_name, = first.request.headers
+        second_name, = second.request.headers
+        self.assertIs(first_name, second_name)
+
+
+class ReadTapeTest(unittest.TestCase):
+    def test_should_read_empty_tape(self):
+        self.assertEqual(read_tape(''), [])
+
+    def test_should_resolve_header_profiles(self):
+        profile = {'profile': 'h0', 'headers': {'Content-Type': 'application/json'}}
+        action = {
+            'request': dict(ACTION['request'], headers='h0'),
+            'response': dict(ACTION['response'], headers='h0'),
+        }
+        tape = read_tape(yaml.dump([profile, action, action]))
+        self.assertEqual(len(tape), 2)
+        self.assertEqual(tape[0], Interaction.from_dict(ACTION))
+        self.assertIs(tape[0].request.headers, tape[1].response.headers)
+
+    def test_should_share_equal_headers(self):
+        tape = read_tape(yaml.dump([ACTION, ACTION]))
+        self.assertIs(tape[0].request.headers, tape[1].response.headers)
+
+    def test_should_make_shared_headers_read_only(self):
+        headers = read_tape(yaml.dump([ACTION]))[0].request.headers
+        with self.assertRaises(TypeError):
+            headers['Host'] = 'localhost'
+
+
+class HeaderFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.headers = {
+            'Content-Type': 'text/plain',
+            'Date': 'Mon, 01 Jan 2018 00:00:00 GMT',
+            'X-Trace-Id': '42',
+        }
+
+    def test_should_keep_all_headers_by_default(self):
+        self.assertEqual(HeaderFilter().filter(self.headers), self.headers)
+
+    def test_should_keep_matching_headers(self):
+        header_filter = HeaderFilter(keep=['content-type'])
+        self.assertEqual(header_filter.filter(self.headers), {'Content-Type': 'text/plain'})
+
+    def test_should_drop_matching_headers(self):
+        header_filter = HeaderFilter(drop=['Date', 'x-trace-*'])
+        self.assertEqual(header_filter.filter(self.headers), {'Content-Type': 'text/plain'})
+
+    def test_should_drop_headers_kept_by_pattern(self):
+        header_filter = HeaderFilter(keep=['*'], drop=['date'])
+        self.assertNotIn('Date', header_filter.filter(self.headers))
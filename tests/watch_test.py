@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from httpsrvvcr import watch
+from httpsrvvcr.player import Player
+
+
+TAPE_PATH = os.path.join(os.path.dirname(__file__), 'tape.yaml')
+
+PING = ('- request:\n    path: /api/ping\n    method: GET\n'
+        '    headers: null\n    text: null\n    json: null\n'
+        '  response:\n    code: {}\n    headers: null\n'
+        '    text: null\n    json: null\n')
+
+
+class TapeWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tape_path = os.path.join(self.directory, 'tape.yaml')
+        shutil.copy(TAPE_PATH, self.tape_path)
+        self.rules = {}
+        self.server = Mock()
+        self.server.always = Mock(
+            side_effect=lambda method: self.rules.setdefault(method, Mock(method=method)))
+        self.server._always_rules = self.rules.values()
+        self.player = Player(self.server)
+        self.watcher = watch.TapeWatcher(self.player, [self.tape_path])
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.directory)
+
+    def append(self, text):
+        with open(self.tape_path, 'a', encoding='utf8') as tape_file:
+            tape_file.write(text)
+        stat = os.stat(self.tape_path)
+        os.utime(self.tape_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    def test_should_load_tape_on_first_check(self):
+        self.assertEqual(self.watcher.check(), 2)
+        self.server.always.assert_called_once_with('POST')
+
+    def test_should_skip_unchanged_tape(self):
+        self.watcher.check()
+        self.assertIsNone(self.watcher.check())
+
+    def test_should_parse_changed_items_only(self):
+        self.watcher.check()
+        with patch('httpsrvvcr.watch.parse_item', side_effect=watch.parse_item) as parse_item:
+            self.append(PING.format(204))
+            self.assertEqual(self.watcher.check(), 1)
+        self.assertEqual(parse_item.call_count, 1)
+        self.assertTrue(self.rules['GET'].matches('GET', '/api/ping', {}, None))
+        self.assertEqual(self.rules['GET'].response.code, 204)
+
+    def test_should_key_changed_items_only(self):
+        self.watcher.check()
+        with patch('httpsrvvcr.watch.interaction_key',
+                   side_effect=watch.interaction_key) as interaction_key:
+            self.append(PING.format(204))
+            self.watcher.check()
+        self.assertEqual(interaction_key.call_count, 1)
+
+    def test_should_rekey_items_when_profiles_change(self):
+        with open(self.tape_path, 'w', encoding='utf8') as tape_file:
+            tape_file.write('- profile: p1\n  headers: {Accept: text/plain}\n'
+                            + PING.format(204).replace('headers: null', 'headers: p1', 1))
+        self.watcher.check()
+        with open(self.tape_path, 'r+', encoding='utf8') as tape_file:
+            text = tape_file.read().replace('text/plain', 'text/html')
+            tape_file.seek(0)
+            tape_file.write(text)
+        stat = os.stat(self.tape_path)
+        os.utime(self.tape_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.watcher.check()
+        self.assertTrue(self.rules['GET'].matches('GET', '/api/ping', {'Accept': 'text/html'}, None))
+
+    def test_should_not_register_methods_unless_asked(self):
+        self.watcher.check()
+        self.append(PING.format(204))
+        self.assertEqual(self.watcher.check(register=False), 1)
+        self.assertNotIn('GET', self.rules)
+        self.assertIsNone(self.watcher.check(register=False))
+        self.assertEqual(self.watcher.check(), 0)
+        self.assertTrue(self.rules['GET'].matches('GET', '/api/ping', {}, None))
+        self.assertIsNone(self.watcher.check())
+
+    def test_should_keep_served_interactions(self):
+        self.append(PING.format(204))
+        self.watcher.check()
+        self.assertTrue(self.rules['GET'].matches('GET', '/api/ping', {}, None))
+        self.append(PING.format(200))
+        self.watcher.check()
+        self.assertTrue(self.rules['GET'].matches('GET', '/api/ping', {}, None))
+        self.assertEqual(self.rules['GET'].response.code, 200)
+        self.assertFalse(self.rules['GET'].matches('GET', '/api/ping', {}, None))
+
+    def test_should_keep_rules_of_broken_tape(self):
+        self.append(PING.format(204))
+        self.watcher.check()
+        self.append('- request: [\n')
+        with self.assertRaises(Exception):
+            self.watcher.check()
+        self.assertIsNone(self.watcher.check())
+        self.assertTrue(self.rules['GET'].matches('GET', '/api/ping', {}, None))
+
+    def test_should_reload_in_background(self):
+        self.watcher = watch.TapeWatcher(self.player, [self.tape_path], interval=0.01)
+        self.watcher.start()
+        switched = Mock(wraps=self.player.switch)
+        with patch.object(self.player, 'switch', switched):
+            self.append(PING.format(204))
+            for _ in range(500):
+                if switched.called:
+                    break
+                self.watcher._stopped.wait(0.01)
+        self.watcher.stop()
+        self.assertTrue(switched.called)